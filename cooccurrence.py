@@ -0,0 +1,155 @@
+"""
+Person co-occurrence graph for Face Recognition File Explorer
+
+Counts how many photos each pair of labeled people appear in together.
+The counts are kept as a sparse symmetric adjacency map and updated as
+faces are labeled and recognized, so "who appears with whom" never needs
+a pass over every photo.
+"""
+
+import heapq
+import json
+from xml.sax.saxutils import quoteattr
+
+
+class CooccurrenceGraph:
+    """Sparse, incrementally maintained co-occurrence counts between people"""
+
+    def __init__(self):
+        self.edges = {}  # name -> {other name -> photos together}
+        self.appearances = {}  # name -> photos the person appears in
+        self.photos = 0  # photos with at least one labeled person
+
+    @classmethod
+    def from_photo_faces(cls, photo_faces):
+        """Build the graph from a database's photo_faces mapping"""
+        graph = cls()
+        for faces in photo_faces.values():
+            graph.add_photo(name for name, _ in faces)
+        return graph
+
+    @classmethod
+    def from_state(cls, state):
+        """Restore a graph saved with state()"""
+        graph = cls()
+        graph.edges = {name: dict(others) for name, others in state['edges'].items()}
+        graph.appearances = dict(state['appearances'])
+        graph.photos = state['photos']
+        return graph
+
+    def state(self):
+        """Plain data for storing the graph alongside the face database"""
+        return {'edges': {name: dict(others) for name, others in self.edges.items()},
+                'appearances': dict(self.appearances),
+                'photos': self.photos}
+
+    def clear(self):
+        self.__init__()
+
+    def _link(self, a, b, delta):
+        others = self.edges.setdefault(a, {})
+        count = others.get(b, 0) + delta
+        if count > 0:
+            others[b] = count
+        else:
+            others.pop(b, None)
+            if not others:
+                del self.edges[a]
+
+    def add_person(self, name, others):
+        """
+        Record that name now appears in a photo with others
+
+        Args:
+            name (str): Person newly found in the photo
+            others (iterable): Distinct people already in the photo
+        """
+        others = set(others) - {name}
+        if not others:
+            self.photos += 1
+        self.appearances[name] = self.appearances.get(name, 0) + 1
+        for other in others:
+            self._link(name, other, 1)
+            self._link(other, name, 1)
+
+    def remove_person(self, name, others):
+        """Undo add_person: name no longer appears in a photo with others"""
+        others = set(others) - {name}
+        if not others:
+            self.photos -= 1
+        count = self.appearances.get(name, 0) - 1
+        if count > 0:
+            self.appearances[name] = count
+        else:
+            self.appearances.pop(name, None)
+        for other in others:
+            self._link(name, other, -1)
+            self._link(other, name, -1)
+
+    def add_photo(self, names):
+        """Record a photo and everyone in it"""
+        present = []
+        for name in dict.fromkeys(names):
+            self.add_person(name, present)
+            present.append(name)
+
+    def count(self, a, b):
+        """Photos a and b appear in together"""
+        return self.edges.get(a, {}).get(b, 0)
+
+    def companions(self, name, limit=None):
+        """
+        People who appear most often with name
+
+        Args:
+            name (str): Person to look up
+            limit (int, optional): Return only the top entries
+
+        Returns:
+            list: (other name, photos together), most frequent first
+        """
+        others = self.edges.get(name, {})
+        key = lambda item: (-item[1], item[0])
+        if limit is None:
+            return sorted(others.items(), key=key)
+        return heapq.nsmallest(limit, others.items(), key=key)
+
+    def pairs(self, min_count=1):
+        """Every pair of people seen together, each pair once"""
+        for name, others in self.edges.items():
+            for other, count in others.items():
+                if name < other and count >= min_count:
+                    yield name, other, count
+
+    def export_json(self, output_file, min_count=1):
+        """Write the graph as JSON with 'nodes' and 'edges' lists"""
+        data = {
+            'nodes': [{'id': name, 'photos': count} for name, count in sorted(self.appearances.items())],
+            'edges': [{'source': a, 'target': b, 'weight': count}
+                      for a, b, count in sorted(self.pairs(min_count))]
+        }
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+
+    def export_graphml(self, output_file, min_count=1):
+        """Write the graph as GraphML, readable by Gephi, yEd and networkx"""
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+            f.write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n')
+            f.write('  <key id="photos" for="node" attr.name="photos" attr.type="int"/>\n')
+            f.write('  <key id="weight" for="edge" attr.name="weight" attr.type="int"/>\n')
+            f.write('  <graph id="cooccurrence" edgedefault="undirected">\n')
+            for name, count in sorted(self.appearances.items()):
+                f.write(f'    <node id={quoteattr(name)}><data key="photos">{count}</data></node>\n')
+            for a, b, count in sorted(self.pairs(min_count)):
+                f.write(f'    <edge source={quoteattr(a)} target={quoteattr(b)}>'
+                        f'<data key="weight">{count}</data></edge>\n')
+            f.write('  </graph>\n')
+            f.write('</graphml>\n')
+
+    def export(self, output_file, min_count=1):
+        """Export as GraphML or JSON, chosen by the file extension"""
+        if str(output_file).lower().endswith('.graphml'):
+            self.export_graphml(output_file, min_count)
+        else:
+            self.export_json(output_file, min_count)
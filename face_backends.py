@@ -0,0 +1,361 @@
+"""
+Face detection and encoding backends for Face Recognition File Explorer
+
+A backend finds faces in RGB images and turns each into a 128-number
+encoding. Encodings of different backends can't be compared with each
+other, so every database records the backend its encodings came from.
+
+- 'dlib' is face_recognition: HOG (fast, misses small and turned faces) or
+  CNN (accurate, too slow without a GPU) detection, and dlib's ResNet encoder
+- 'opencv' runs OpenCV's YuNet detector and SFace encoder through cv2.dnn.
+  It is far faster than dlib's CNN on a CPU and finds more faces than HOG.
+  The two ONNX models are loaded from local files; they are published in
+  the OpenCV model zoo (github.com/opencv/opencv_zoo)
+
+SFace encodings are compared by cosine similarity. They are scaled to a
+sphere on which SFace's recommended cosine threshold falls at a Euclidean
+distance of 0.6, so the tolerance everything else uses means the same for
+both backends.
+"""
+
+import abc
+import io
+import math
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+import face_recognition
+
+BACKENDS = ('dlib', 'opencv')
+
+# Where the OpenCV backend looks for its models unless told otherwise
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
+YUNET_MODEL = 'face_detection_yunet_2023mar.onnx'
+SFACE_MODEL = 'face_recognition_sface_2021dec.onnx'
+
+# YuNet's lowest face score, and the overlap its non-maximum suppression merges
+DNN_SCORE_THRESHOLD = 0.8
+DNN_NMS_THRESHOLD = 0.3
+
+# Longest side images are shrunk to for YuNet
+DNN_DETECT_SIZE = 1920
+
+# SFace's recommended cosine similarity threshold for the same person
+SFACE_COSINE_THRESHOLD = 0.363
+
+# Radius of the sphere SFace encodings are scaled to: two encodings at the
+# cosine threshold are 0.6 apart
+SFACE_SCALE = 0.6 / math.sqrt(2 - 2 * SFACE_COSINE_THRESHOLD)
+
+# Room around a face, as a fraction of its size, searched for its landmarks
+# when encoding faces that weren't found by detect()
+LANDMARK_MARGIN = 0.5
+
+# Images whose detections are kept for encode(): about the photos in flight
+# between the detect and encode stages of a scan
+DETECTION_CACHE = 64
+
+
+class FaceBackend(abc.ABC):
+    """Interface of a face detection and encoding backend"""
+
+    # Recorded in the database with the encodings the backend produced
+    name = None
+
+    @abc.abstractmethod
+    def detect(self, image):
+        """
+        Find faces
+
+        Args:
+            image (ndarray): RGB pixels
+
+        Returns:
+            list: (top, right, bottom, left) face locations
+        """
+
+    @abc.abstractmethod
+    def encode(self, image, face_locations):
+        """
+        Encode faces
+
+        Args:
+            image (ndarray): RGB pixels
+            face_locations (list): Locations from detect()
+
+        Returns:
+            list: One 128-number ndarray per face location
+        """
+
+    def describe(self):
+        """Short description for reports"""
+        return self.name
+
+
+class DlibBackend(FaceBackend):
+    """face_recognition's dlib detectors and encoder"""
+
+    name = 'dlib'
+
+    def __init__(self, model='hog'):
+        """
+        Args:
+            model (str): Face detection model ('hog' or 'cnn')
+        """
+        self.model = model
+
+    def detect(self, image):
+        return face_recognition.face_locations(image, model=self.model)
+
+    def encode(self, image, face_locations):
+        return face_recognition.face_encodings(image, face_locations)
+
+    def describe(self):
+        return f"dlib ({self.model})"
+
+
+class OpenCVBackend(FaceBackend):
+    """YuNet detection and SFace encoding through cv2.dnn"""
+
+    name = 'opencv'
+
+    def __init__(self, detector_model=None, recognizer_model=None, score_threshold=DNN_SCORE_THRESHOLD):
+        """
+        Args:
+            detector_model (str, optional): YuNet ONNX file (default:
+                models/face_detection_yunet_2023mar.onnx)
+            recognizer_model (str, optional): SFace ONNX file (default:
+                models/face_recognition_sface_2021dec.onnx)
+            score_threshold (float): Lowest detection score kept
+
+        Raises:
+            FileNotFoundError: A model file is missing
+        """
+        self.detector_model = detector_model or os.path.join(MODEL_DIR, YUNET_MODEL)
+        self.recognizer_model = recognizer_model or os.path.join(MODEL_DIR, SFACE_MODEL)
+        for path in (self.detector_model, self.recognizer_model):
+            if not os.path.isfile(path):
+                raise FileNotFoundError(f"OpenCV face model {path} not found; download it from "
+                                        f"the OpenCV model zoo (github.com/opencv/opencv_zoo)")
+        self.score_threshold = score_threshold
+        self._local = threading.local()
+        self._detections = OrderedDict()
+        self._detections_lock = threading.Lock()
+
+    def __getstate__(self):
+        # Networks aren't picklable; shard processes load their own
+        state = self.__dict__.copy()
+        for key in ('_local', '_detections', '_detections_lock'):
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+        self._detections = OrderedDict()
+        self._detections_lock = threading.Lock()
+
+    def _networks(self):
+        """This thread's detector and recognizer; cv2.dnn networks can't be shared between threads"""
+        local = self._local
+        if not hasattr(local, 'detector'):
+            local.detector = cv2.FaceDetectorYN.create(self.detector_model, "", (320, 320),
+                                                       self.score_threshold, DNN_NMS_THRESHOLD)
+            local.recognizer = cv2.FaceRecognizerSF.create(self.recognizer_model, "")
+        return local.detector, local.recognizer
+
+    def _detect_rows(self, bgr):
+        """YuNet rows (box, five landmarks, score) in the image's pixels"""
+        detector, _ = self._networks()
+        height, width = bgr.shape[:2]
+        scale = max(height, width) / DNN_DETECT_SIZE
+        if scale > 1:
+            bgr = cv2.resize(bgr, (int(width / scale), int(height / scale)), interpolation=cv2.INTER_AREA)
+        else:
+            scale = 1.0
+        detector.setInputSize((bgr.shape[1], bgr.shape[0]))
+        _, rows = detector.detect(bgr)
+        if rows is None:
+            return np.empty((0, 15), dtype=np.float32)
+        rows = rows.copy()
+        rows[:, :14] *= scale
+        return rows
+
+    @staticmethod
+    def _location(row, width, height):
+        x, y, w, h = row[:4]
+        return (max(0, int(round(y))), min(width, int(round(x + w))),
+                min(height, int(round(y + h))), max(0, int(round(x))))
+
+    def detect(self, image):
+        bgr = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+        height, width = image.shape[:2]
+        rows = self._detect_rows(bgr)
+        face_locations = [self._location(row, width, height) for row in rows]
+        if face_locations:
+            # SFace aligns faces by their landmarks, which a location leaves
+            # out: keep the rows so encode() needn't detect them again. The
+            # detect and encode stages of a scan run on different threads
+            with self._detections_lock:
+                self._detections[id(image)] = (weakref.ref(image), dict(zip(face_locations, rows)))
+                while len(self._detections) > DETECTION_CACHE:
+                    self._detections.popitem(last=False)
+        return face_locations
+
+    def _detected_rows(self, image):
+        """Rows detect() found in this very image, by location"""
+        with self._detections_lock:
+            entry = self._detections.pop(id(image), None)
+        if entry is None or entry[0]() is not image:
+            return {}
+        return entry[1]
+
+    def encode(self, image, face_locations):
+        _, recognizer = self._networks()
+        bgr = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+        detected = self._detected_rows(image)
+        encodings = []
+        for face_location in face_locations:
+            row = detected.get(tuple(int(v) for v in face_location))
+            if row is not None:
+                aligned = recognizer.alignCrop(bgr, row)
+            else:
+                aligned = self._align_again(bgr, face_location)
+            feature = recognizer.feature(aligned).reshape(-1).astype(np.float64)
+            encodings.append(feature / (np.linalg.norm(feature) or 1.0) * SFACE_SCALE)
+        return encodings
+
+    def _align_again(self, bgr, face_location):
+        """
+        Align a face detect() didn't report, such as one found in a tile or
+        by a tracker, by finding its landmarks again in a crop around it
+        """
+        _, recognizer = self._networks()
+        height, width = bgr.shape[:2]
+        top, right, bottom, left = face_location
+        pad = int(max(bottom - top, right - left) * LANDMARK_MARGIN)
+        x0, y0 = max(0, left - pad), max(0, top - pad)
+        crop = bgr[y0:min(height, bottom + pad), x0:min(width, right + pad)]
+        best, best_overlap = None, 0.0
+        for row in self._detect_rows(crop):
+            found = self._location(row, crop.shape[1], crop.shape[0])
+            overlap = _iou(found, (top - y0, right - x0, bottom - y0, left - x0))
+            if overlap > best_overlap:
+                best, best_overlap = row, overlap
+        if best is not None:
+            return recognizer.alignCrop(crop, best)
+        # Unaligned is worse than aligned, but better than nothing
+        return cv2.resize(bgr[top:bottom, left:right], (112, 112))
+
+    def describe(self):
+        return "opencv (YuNet + SFace)"
+
+
+def _iou(a, b):
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    if bottom <= top or right <= left:
+        return 0.0
+    intersection = (bottom - top) * (right - left)
+    union = (a[2] - a[0]) * (a[1] - a[3]) + (b[2] - b[0]) * (b[1] - b[3]) - intersection
+    return intersection / union
+
+
+def create_backend(name='dlib', model='hog', detector_model=None, recognizer_model=None):
+    """
+    Build a backend by name
+
+    Args:
+        name (str): One of BACKENDS
+        model (str): dlib detection model ('hog' or 'cnn')
+        detector_model (str, optional): YuNet model file for 'opencv'
+        recognizer_model (str, optional): SFace model file for 'opencv'
+
+    Returns:
+        FaceBackend: The backend
+    """
+    if name == 'dlib':
+        return DlibBackend(model)
+    if name == 'opencv':
+        return OpenCVBackend(detector_model, recognizer_model)
+    raise ValueError(f"Unknown face backend '{name}' (expected one of {', '.join(BACKENDS)})")
+
+
+def compare_backends(store, photo_reader, backends, photos=50, tolerance=0.6):
+    """
+    Measure the speed and accuracy of backends on the photos labeled so far
+
+    Labeled faces are the ground truth. A labeled face counts as found when
+    a detected face overlaps it, and as recognized when the nearest other
+    found face of the same backend belongs to the same person and is within
+    tolerance; only people found more than once count towards recognition.
+    Labels were made from whichever backend scanned the database, which
+    favours that backend's detections a little.
+
+    Args:
+        store (FaceStore): Database with labeled photos
+        photo_reader (PhotoReader): Reads the photos
+        backends (list): FaceBackends to compare
+        photos (int): Labeled photos to use at most
+        tolerance (float): Distance below which two faces match
+
+    Returns:
+        dict: 'photos', 'faces' and 'backends', a list of dicts with
+        'backend', 'seconds', 'photos_per_second', 'detected', 'found'
+        and 'recognized' (the last two as fractions)
+    """
+    labeled = [(photo_path, faces) for photo_path, faces in store.iter_photo_faces() if faces]
+    step = max(1, len(labeled) // photos) if photos else 1
+    labeled = labeled[::step][:photos]
+
+    images = []
+    for photo_path, faces in labeled:
+        try:
+            images.append((face_recognition.load_image_file(io.BytesIO(photo_reader.read_bytes(photo_path))),
+                           faces))
+        except Exception as e:
+            print(f"Skipping {photo_path}: {e}")
+    report = {'photos': len(images), 'faces': sum(len(faces) for _, faces in images), 'backends': []}
+
+    for backend in backends:
+        detected = 0
+        matched = []
+        start = time.perf_counter()
+        for image, faces in images:
+            face_locations = backend.detect(image)
+            detected += len(face_locations)
+            encodings = backend.encode(image, face_locations)
+            for name, location in faces:
+                overlaps = [_iou(location, found) for found in face_locations]
+                if overlaps and max(overlaps) >= 0.3:
+                    matched.append((name, encodings[int(np.argmax(overlaps))]))
+        seconds = time.perf_counter() - start
+
+        # Leave-one-out: each face against every other found face
+        recognized = 0
+        names = [name for name, _ in matched]
+        repeated = [i for i, name in enumerate(names) if names.count(name) > 1]
+        if repeated:
+            encodings = np.array([encoding for _, encoding in matched])
+            for i in repeated:
+                name, encoding = matched[i]
+                distances = np.linalg.norm(encodings - encoding, axis=1)
+                distances[i] = np.inf
+                nearest = int(np.argmin(distances))
+                if names[nearest] == name and distances[nearest] <= tolerance:
+                    recognized += 1
+
+        report['backends'].append({
+            'backend': backend.describe(),
+            'seconds': seconds,
+            'photos_per_second': len(images) / seconds if seconds else 0.0,
+            'detected': detected,
+            'found': len(matched) / report['faces'] if report['faces'] else 0.0,
+            'recognized': recognized / len(repeated) if repeated else 0.0,
+        })
+    return report
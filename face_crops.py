@@ -0,0 +1,132 @@
+"""
+Cached face crops for Face Recognition File Explorer
+
+Reviewing thousands of face clusters needs small pictures of the faces, not
+the photos they came from. Each face is cropped once, shrunk to a small
+square JPEG and stored on disk under a name derived from the photo's size,
+modification time and the face box, so later review sessions never decode
+the full photo again.
+"""
+
+import hashlib
+import io
+import os
+from pathlib import Path
+
+from PIL import Image
+
+from photo_sources import split_archive_path
+
+# Side in pixels of a cached face crop
+CROP_SIZE = 64
+
+# Extra room around the detected box, as a fraction of its size
+CROP_MARGIN = 0.25
+
+FACE_CROP_DIR = '.face_crops'
+
+
+class FaceCropCache:
+    """Creates and locates small cached crops of detected faces"""
+
+    def __init__(self, cache_dir, reader, size=CROP_SIZE, quality=85):
+        """
+        Args:
+            cache_dir (Path): Directory crops are stored in
+            reader (PhotoReader): Reads photos, including archive members
+            size (int): Side of each square crop
+            quality (int): JPEG quality of the crops
+        """
+        self.cache_dir = Path(cache_dir)
+        self.reader = reader
+        self.size = size
+        self.quality = quality
+
+    def path(self, photo_path, face_location):
+        """Where the crop of a face lives; changes when the photo does"""
+        archive, _ = split_archive_path(photo_path)
+        stat = os.stat(self.reader.photos_dir / archive)
+        box = ','.join(str(int(v)) for v in face_location)
+        signature = f"{photo_path}|{stat.st_size}|{stat.st_mtime_ns}|{box}|{self.size}"
+        key = hashlib.sha1(signature.encode('utf-8')).hexdigest()[:20]
+        return self.cache_dir / key[:2] / f"{key}.jpg"
+
+    def _crop_box(self, face_location, scale, image_size):
+        """Square box around a face, with margin, in the decoded image's pixels"""
+        top, right, bottom, left = (v * scale for v in face_location)
+        side = max(bottom - top, right - left) * (1 + 2 * CROP_MARGIN)
+        cx, cy = (left + right) / 2, (top + bottom) / 2
+        x0 = max(0, int(cx - side / 2))
+        y0 = max(0, int(cy - side / 2))
+        return (x0, y0, min(image_size[0], int(x0 + side)), min(image_size[1], int(y0 + side)))
+
+    def render(self, photo_path, face_locations):
+        """
+        Decode a photo once and crop several faces out of it
+
+        Args:
+            photo_path (str): Photo key
+            face_locations (list): (top, right, bottom, left) boxes in the
+                photo's full-size pixels
+
+        Returns:
+            list: PIL images, one per face, in the same order
+        """
+        with self.reader.open(photo_path) as f, Image.open(f) as image:
+            full_width = image.size[0]
+            # JPEGs can be decoded at a fraction of their size, as long as
+            # the smallest face still fills a crop
+            smallest = min(min(bottom - top, right - left) for top, right, bottom, left in face_locations)
+            reduce = max(1.0, smallest * (1 + 2 * CROP_MARGIN) / self.size)
+            image.draft('RGB', (int(image.size[0] / reduce), int(image.size[1] / reduce)))
+            image = image.convert('RGB')
+            scale = image.size[0] / full_width
+
+            crops = []
+            for face_location in face_locations:
+                crop = image.crop(self._crop_box(face_location, scale, image.size))
+                crops.append(crop.resize((self.size, self.size), Image.LANCZOS))
+        return crops
+
+    def _store(self, path, crop):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        buffer = io.BytesIO()
+        crop.save(buffer, 'JPEG', quality=self.quality)
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(buffer.getvalue())
+        os.replace(tmp_path, path)
+
+    def load(self, photo_path, face_locations):
+        """
+        Crops of faces in one photo, from the cache where possible
+
+        Faces missing from the cache are cropped with a single decode of the
+        photo and stored for next time.
+
+        Args:
+            photo_path (str): Photo key
+            face_locations (list): (top, right, bottom, left) boxes
+
+        Returns:
+            list: PIL images, one per face, in the same order
+        """
+        paths = [self.path(photo_path, face_location) for face_location in face_locations]
+        crops = [None] * len(paths)
+        missing = []
+        for i, path in enumerate(paths):
+            try:
+                with Image.open(path) as cached:
+                    crops[i] = cached.convert('RGB')
+            except (OSError, ValueError):
+                missing.append(i)
+
+        if missing:
+            rendered = self.render(photo_path, [face_locations[i] for i in missing])
+            for i, crop in zip(missing, rendered):
+                crops[i] = crop
+                try:
+                    self._store(paths[i], crop)
+                except OSError as e:
+                    print(f"  Error caching face crop {paths[i]}: {e}")
+        return crops
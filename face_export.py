@@ -0,0 +1,192 @@
+"""
+Streaming export of face data for Face Recognition File Explorer
+
+Faces are written one record at a time, so memory use stays flat no matter
+how large the database is. Two layouts are supported:
+
+- NDJSON: one JSON object per face, optionally gzip or zstd compressed
+- Columnar: embeddings.npy (float32, one row per face with an encoding)
+  that downstream tools can memory-map with np.load(..., mmap_mode='r'),
+  plus faces.csv holding boxes, names, photos and face IDs
+"""
+
+import csv
+import gzip
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+EXPORT_FORMATS = ('json', 'ndjson', 'columnar')
+
+CSV_FIELDS = ('face_id', 'source', 'name', 'photo', 'top', 'right', 'bottom', 'left',
+              'unlabeled_index', 'embedding_row', 'taken', 'camera', 'latitude', 'longitude')
+
+
+def iter_face_records(store, timeline=None, photos=None):
+    """
+    Every face in the database as a flat record
+
+    Face IDs number the faces of one export in a fixed order: recognized
+    faces in photos, then labeled reference encodings, then unlabeled faces.
+
+    Args:
+        store (FaceStore): The explorer's face database
+        timeline (PhotoTimeline, optional): Adds capture date, camera and GPS
+        photos (set, optional): Only export faces in these photos
+
+    Yields:
+        dict: 'face_id', 'source' ('photo', 'reference' or 'unlabeled'),
+        'name', 'photo', 'box' (top, right, bottom, left), 'encoding'
+        (None if not stored) and 'unlabeled_index'
+    """
+    face_id = 0
+
+    def record(source, name, photo_path, face_location, encoding, unlabeled_index=None):
+        result = {'face_id': face_id, 'source': source, 'name': name, 'photo': photo_path,
+                  'box': [int(v) for v in face_location] if face_location is not None else None,
+                  'encoding': encoding, 'unlabeled_index': unlabeled_index}
+        if timeline is not None and photo_path is not None:
+            result.update(timeline.get(photo_path))
+        return result
+
+    for photo_path, faces in store.iter_photo_faces():
+        if photos is not None and photo_path not in photos:
+            continue
+        for name, face_location in faces:
+            yield record('photo', name, photo_path, face_location, None)
+            face_id += 1
+
+    # Encodings of labeled faces aren't linked to the photo they came from
+    if photos is None:
+        for name, encodings in store.reference_encodings().items():
+            for encoding in encodings:
+                yield record('reference', name, None, None, encoding)
+                face_id += 1
+
+    for index, (_, photo_path, encoding, face_location) in enumerate(store.unlabeled_faces()):
+        if photos is not None and photo_path not in photos:
+            continue
+        yield record('unlabeled', None, photo_path, face_location, encoding, index)
+        face_id += 1
+
+
+def open_text_output(output_file):
+    """Open a file for writing text, compressed if its name ends in .gz or .zst"""
+    name = str(output_file).lower()
+    if name.endswith('.gz'):
+        return gzip.open(output_file, 'wt', encoding='utf-8')
+    if name.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError("zstd compression needs the 'zstandard' package (pip install zstandard)")
+        return _ZstdTextWriter(open(output_file, 'wb'))
+    return open(output_file, 'w', encoding='utf-8')
+
+
+class _ZstdTextWriter:
+    """Text file interface over a zstd-compressed file"""
+
+    def __init__(self, raw):
+        self._raw = raw
+        self._writer = zstandard.ZstdCompressor().stream_writer(raw)
+
+    def write(self, text):
+        return self._writer.write(text.encode('utf-8'))
+
+    def close(self):
+        self._writer.close()
+        self._raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def export_ndjson(records, output_file, include_encodings=True):
+    """
+    Write face records as newline-delimited JSON
+
+    Args:
+        records (iterable): Records from iter_face_records
+        output_file (str): Destination; '.gz' or '.zst' compresses
+        include_encodings (bool): Write each face's 128-d encoding
+
+    Returns:
+        int: Number of records written
+    """
+    count = 0
+    with open_text_output(output_file) as f:
+        for record in records:
+            encoding = record.pop('encoding')
+            if include_encodings and encoding is not None:
+                record['encoding'] = [round(float(v), 6) for v in encoding]
+            f.write(json.dumps(record, separators=(',', ':')))
+            f.write('\n')
+            count += 1
+    return count
+
+
+def export_columnar(records, output_dir, embedding_count, dimensions=128):
+    """
+    Write face metadata as CSV and encodings as a memory-mappable .npy
+
+    Args:
+        records (iterable): Records from iter_face_records
+        output_dir (str): Directory for faces.csv and embeddings.npy
+        embedding_count (int): Number of records that carry an encoding,
+            so the .npy file can be sized before writing
+        dimensions (int): Length of each encoding
+
+    Returns:
+        tuple: (faces written, embeddings written)
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    embeddings_path = output_dir / 'embeddings.npy'
+    tmp_path = output_dir / 'embeddings.npy.tmp'
+
+    # Rows are written straight into the file, never collected in memory
+    embeddings = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32,
+                                           shape=(embedding_count, dimensions))
+    faces = rows = 0
+    try:
+        with open(output_dir / 'faces.csv', 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(CSV_FIELDS)
+            for record in records:
+                encoding = record['encoding']
+                embedding_row = ''
+                if encoding is not None and rows < embedding_count:
+                    embeddings[rows] = encoding
+                    embedding_row = rows
+                    rows += 1
+                top, right, bottom, left = record['box'] or ('', '', '', '')
+                latitude, longitude = record.get('gps') or ('', '')
+                writer.writerow([
+                    record['face_id'], record['source'], record['name'] or '', record['photo'] or '',
+                    top, right, bottom, left,
+                    '' if record['unlabeled_index'] is None else record['unlabeled_index'],
+                    embedding_row, record.get('taken', ''), record.get('camera', ''), latitude, longitude
+                ])
+                faces += 1
+        embeddings.flush()
+    finally:
+        del embeddings
+
+    if rows < embedding_count:
+        # Fewer encodings than expected: copy the filled rows into a right-sized file
+        filled = np.load(tmp_path, mmap_mode='r')[:rows]
+        np.save(embeddings_path, filled)
+        del filled
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, embeddings_path)
+    return faces, rows
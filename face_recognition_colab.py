@@ -127,12 +127,15 @@ class CoLabFaceRecognitionExplorer:
             except Exception as e:
                 print(f"Error saving database: {e}")
                 
-    def upload_photos(self, extract_to_subfolders=True):
+    def upload_photos(self, extract_to_subfolders=True, extract_archives=True):
         """
         Upload photos to Google Colab
         
         Args:
             extract_to_subfolders (bool): Whether to extract zip files to subfolders
+            extract_archives (bool): Whether to extract zip files at all. When False
+                the zip is stored as-is and scanned as a virtual directory, with
+                photo keys like 'photos.zip!/member.jpg'
         """
         print("Please upload photos (zip file recommended for multiple photos)...")
         uploaded = files.upload()
@@ -140,7 +143,15 @@ class CoLabFaceRecognitionExplorer:
         uploaded_count = 0
         
         for filename, content in uploaded.items():
-            if filename.endswith('.zip'):
+            if filename.endswith('.zip') and not extract_archives:
+                # Keep the archive whole; scanning streams members out of it
+                save_path = os.path.join(self.photos_dir, filename)
+                with open(save_path, 'wb') as f:
+                    f.write(content)
+                with zipfile.ZipFile(io.BytesIO(content), 'r') as zip_ref:
+                    uploaded_count += len(zip_ref.namelist())
+                print(f"Stored zip file {filename} without extracting it")
+            elif filename.endswith('.zip'):
                 # Extract zip file
                 print(f"Extracting zip file {filename}...")
                 
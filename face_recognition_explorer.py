@@ -1,5 +1,5 @@
 import os
-import pickle
+import sys
 import numpy as np
 import cv2
 import face_recognition
@@ -8,44 +8,262 @@ import argparse
 from pathlib import Path
 import shutil
 import json
+import hashlib
+import html
+from urllib.parse import quote
 import tkinter as tk
 from tkinter import simpledialog, messagebox
 from sklearn.cluster import DBSCAN
 import imghdr
 import concurrent.futures
 import threading
+import random
+import tempfile
+import time
+from scan_pipeline import ScanPipeline, ScanItem, parse_stage_workers
+from resource_governor import ResourceGovernor
+from face_quality import QualityGate
+from photo_sources import (PhotoReader, frame_key, is_archive, is_video, iter_archive_members, member_key,
+                           split_archive_path)
+from photo_output import OUTPUT_MODES, OutputManifest, output_name, source_signature, sync_outputs
+from thumbnails import THUMBNAIL_DIR, ThumbnailStore
+from face_crops import FACE_CROP_DIR, FaceCropCache
+from sidecars import SIDECAR_FORMATS, write_sidecars
+from person_index import PersonIndex, parse_query, query_names
+from cooccurrence import CooccurrenceGraph
+from face_export import EXPORT_FORMATS, export_columnar, export_ndjson, iter_face_records
+from photo_timeline import PhotoTimeline, read_photo_metadata, select_photos
+from match_index import MATCH_MODES, compare_match_modes
+from face_store import open_store
+from tiled_detection import TILE_SIZE, TILE_THRESHOLD_MP
+from video_faces import VideoFaceTracker
+from face_shards import SHARD_MODES, FederatedStore, find_shard_databases, merge_shards, run_sharded_scan, scan_shard
+from face_backends import BACKENDS, DlibBackend, OpenCVBackend, compare_backends, create_backend
+from scan_schedule import SAMPLE_FIRST, SCAN_ORDERS, ScanCandidate, ScanSchedule, stratified_sample
+from scan_preview import PROFILE_SAMPLE, SCAN_PROFILES, chao1, format_preview, mean_interval, proportion_interval
+from perceptual_hash import hamming_distance, image_hash
+
+# dtypes face encodings can be stored with in the database
+ENCODING_PRECISIONS = ('float64', 'float32', 'float16')
+
+# File extensions picked up when scanning the photos directory
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif')
 
 class FaceRecognitionExplorer:
-    def __init__(self, photos_dir, database_file='face_database.pkl'):
+    def __init__(self, photos_dir, database_file='face_database.db', store=None, backend=None):
         """
         Initialize the face recognition system
         
         Args:
             photos_dir (str): Directory containing photos to process
-            database_file (str): File to store face encodings and metadata
+            database_file (str): SQLite file to store face encodings and
+                metadata; a face_database.pkl from older versions next to it
+                is imported the first time
+            store (FaceStore, optional): Use this store instead of opening
+                database_file, e.g. a FederatedStore over shard databases
+            backend (FaceBackend, optional): Detects and encodes faces
+                (default: the backend the database was scanned with)
         """
         self.photos_dir = Path(photos_dir)
-        self.database_file = database_file
-        self.face_database = self._load_database()
+        self.store = store if store is not None else open_store(database_file)
+        self.database_file = self.store.path
+        self.person_index = self._load_person_index()
+        self.cooccurrence = self._load_cooccurrence()
+        self.timeline = self._load_timeline()
+        self.photo_reader = PhotoReader(self.photos_dir)
+        # Face crops are cached next to the database they belong to
+        crop_dir = Path(os.path.abspath(self.database_file)).parent / FACE_CROP_DIR
+        self.face_crops = FaceCropCache(crop_dir, self.photo_reader)
+        self.backend = backend
+        # Backends built by face_backend(), kept so their models load once
+        self._default_backends = {}
         self._tk_root = None
         
-    def _load_database(self):
-        """Load existing face database or create new one"""
-        if os.path.exists(self.database_file):
-            with open(self.database_file, 'rb') as f:
-                return pickle.load(f)
-        else:
-            return {
-                'faces': {},  # name -> list of face encodings
-                'photo_faces': {},  # photo_path -> list of (name, face_location)
-                'unlabeled_faces': []  # list of (photo_path, face_encoding, face_location)
-            }
-        def save_database(self):
-            """Save face database to disk"""
-            with open(self.database_file, 'wb') as f:
-                pickle.dump(self.face_database, f)
-            
-    def scan_photos(self, force_rescan=False, parallel=True, model="hog"):
+    def _load_person_index(self):
+        """Restore the person -> photo index saved with the database, or build it"""
+        version = self.store.sync_photo_faces_version()
+        saved = self.store.get_meta('person_index')
+        # Another process may have changed photo_faces since it was saved
+        if saved is not None and saved['version'] == version:
+            return PersonIndex.from_state(saved['state'])
+        return PersonIndex.from_photo_faces(dict(self.store.iter_photo_faces()))
+    
+    def _load_cooccurrence(self):
+        """Restore the co-occurrence graph saved with the database, or build it"""
+        version = self.store.sync_photo_faces_version()
+        saved = self.store.get_meta('cooccurrence')
+        if saved is not None and saved['version'] == version:
+            return CooccurrenceGraph.from_state(saved['state'])
+        return CooccurrenceGraph.from_photo_faces(dict(self.store.iter_photo_faces()))
+    
+    def _load_timeline(self):
+        """Load the EXIF capture-date timeline from the database"""
+        timeline = PhotoTimeline()
+        timeline.records = self.store.photo_metadata()
+        return timeline
+    
+    def reload(self):
+        """Pick up changes other processes made to the database"""
+        self.person_index = self._load_person_index()
+        self.cooccurrence = self._load_cooccurrence()
+        self.timeline = self._load_timeline()
+        
+    def save_database(self):
+        """
+        Save the person index and co-occurrence graph with the database
+        
+        Faces are written to the database as they change; only these
+        indexes, which are rebuilt if missing, are saved here.
+        """
+        version = self.store.photo_faces_version
+        if version is None:
+            # Changed by another process too: ours no longer match the database
+            return
+        with self.store.transaction():
+            self.store.set_meta('person_index', {'version': version, 'state': self.person_index.state()})
+            self.store.set_meta('cooccurrence', {'version': version, 'state': self.cooccurrence.state()})
+    
+    def _set_photo_metadata(self, photo_path, metadata):
+        self.timeline.set(photo_path, metadata)
+        self.store.set_photo_metadata(photo_path, self.timeline.records[photo_path])
+    
+    def _stored_encoding(self, encoding):
+        """A new face encoding converted to the database's storage precision"""
+        return np.asarray(encoding, dtype=self.store.get_meta('encoding_precision', 'float64'))
+    
+    def set_encoding_precision(self, precision):
+        """
+        Convert every stored face encoding to a new precision
+        
+        float16 halves the memory and file size of float32 and quarters
+        float64; distances between face encodings change by far less than
+        any useful tolerance.
+        
+        Args:
+            precision (str): One of ENCODING_PRECISIONS
+        """
+        if precision not in ENCODING_PRECISIONS:
+            raise ValueError(f"Unknown precision '{precision}' (expected one of {', '.join(ENCODING_PRECISIONS)})")
+        before = self._encoding_bytes()
+        with self.store.transaction():
+            self.store.set_meta('encoding_precision', precision)
+            self.store.convert_encodings(precision)
+        print(f"Encodings stored as {precision}: {before / 2**20:.1f} MB -> {self._encoding_bytes() / 2**20:.1f} MB")
+    
+    def face_backend(self, model="hog"):
+        """
+        The backend new faces are detected and encoded with
+        
+        Args:
+            model (str): dlib detection model, if dlib is used
+        """
+        if self.backend is not None:
+            return self.backend
+        opencv = self.store.get_meta('encoding_backend') == OpenCVBackend.name
+        key = OpenCVBackend.name if opencv else (DlibBackend.name, model)
+        backend = self._default_backends.get(key)
+        if backend is None:
+            backend = OpenCVBackend() if opencv else DlibBackend(model)
+            self._default_backends[key] = backend
+        return backend
+    
+    def _use_backend(self, backend):
+        """
+        Record the backend new encodings come from, refusing to mix backends
+        
+        Databases from before backends were recorded hold dlib encodings.
+        
+        Raises:
+            ValueError: The database already holds another backend's encodings
+        """
+        recorded = self.store.get_meta('encoding_backend')
+        if recorded is None and (self.store.unlabeled_count() or self.store.reference_counts()):
+            recorded = DlibBackend.name
+        if recorded is not None and recorded != backend.name:
+            raise ValueError(f"{self.database_file} holds {recorded} face encodings, which can't be compared "
+                             f"with {backend.name} ones; use another database for the {backend.name} backend")
+        if self.store.get_meta('encoding_backend') is None:
+            self.store.set_meta('encoding_backend', backend.name)
+    
+    def backend_report(self, backends, photos=50, tolerance=0.6):
+        """
+        Print the speed and accuracy of backends on the photos labeled so far
+        
+        Args:
+            backends (list): FaceBackends to compare
+            photos (int): Labeled photos to use at most
+            tolerance (float): Distance below which two faces match
+        """
+        report = compare_backends(self.store, self.photo_reader, backends, photos=photos, tolerance=tolerance)
+        print(f"{report['photos']} labeled photos with {report['faces']} labeled faces")
+        if not report['faces']:
+            print("Label some faces first: they are what the backends are measured against.")
+            return report
+        print(f"{'backend':24} {'photos/s':>9} {'time':>8} {'faces':>6} {'found':>6} {'recognized':>11}")
+        for row in report['backends']:
+            print(f"{row['backend']:24} {row['photos_per_second']:>9.2f} {row['seconds']:>7.1f}s "
+                  f"{row['detected']:>6} {row['found']:>6.1%} {row['recognized']:>11.1%}")
+        return report
+    
+    def _encoding_bytes(self):
+        """Memory the stored encodings take once loaded, including per-array overhead"""
+        total = sum(sys.getsizeof(np.array(e)) for encodings in self.store.reference_encodings().values()
+                    for e in encodings)
+        return total + sum(sys.getsizeof(np.array(face[2])) for face in self.store.unlabeled_faces())
+    
+    def encoding_report(self, modes=('float16', 'pq'), queries=200, k=10, tolerance=0.6, pq_bytes=16):
+        """
+        Print memory use and match agreement of compact match index modes
+        
+        Args:
+            modes (iterable): Modes compared with the exact float32 index
+            queries (int): Faces from the database used as queries
+            k (int): Neighbours compared per query
+            tolerance (float): Distance below which the nearest face is a match
+            pq_bytes (int): Bytes per face in 'pq' mode
+        """
+        report = compare_match_modes(self.store, modes, queries=queries, k=k,
+                                     tolerance=tolerance, pq_bytes=pq_bytes)
+        print(f"{report['faces']} face encodings, {report['database_bytes'] / 2**20:.1f} MB as stored in the database")
+        if not report['modes']:
+            print("Not enough faces to compare.")
+            return report
+        print(f"{'mode':8} {'memory':>10} {'saved':>7} {'build':>8} {'query':>9} "
+              f"{'recall@' + str(k):>9} {'top-1':>6} {'match':>6}")
+        for row in report['modes']:
+            saved = 1 - row['bytes'] / report['database_bytes']
+            print(f"{row['mode']:8} {row['bytes'] / 2**20:>8.1f}MB {saved:>7.1%} {row['build_seconds']:>7.1f}s "
+                  f"{row['query_ms']:>7.2f}ms {row['recall']:>9.1%} {row['top1']:>6.1%} {row['decisions']:>6.1%}")
+        return report
+    
+    def _add_photo_face(self, photo_path, name, face_location):
+        """Record a labeled face in photo_faces and keep the indexes in step"""
+        present = {other for other, _ in self.store.photo_faces(photo_path)}
+        self.store.add_photo_face(photo_path, name, face_location)
+        if name not in present:
+            self.person_index.add(name, photo_path)
+            self.cooccurrence.add_person(name, present)
+        
+    def _replace_photo_faces(self, photo_path, faces):
+        """Replace who was recognized in a photo and keep the indexes in step"""
+        faces = [(name, tuple(int(v) for v in face_location)) for name, face_location in faces]
+        old_faces = self.store.photo_faces(photo_path)
+        if old_faces == faces:
+            return
+        
+        old_names = list(dict.fromkeys(name for name, _ in old_faces))
+        for i in reversed(range(len(old_names))):
+            self.person_index.remove(old_names[i], photo_path)
+            self.cooccurrence.remove_person(old_names[i], old_names[:i])
+        
+        self.store.set_photo_faces(photo_path, faces)
+        names = list(dict.fromkeys(name for name, _ in faces))
+        for name in names:
+            self.person_index.add(name, photo_path)
+        self.cooccurrence.add_photo(names)
+        
+    def scan_photos(self, force_rescan=False, parallel=True, model="hog", progress=None,
+                    select=None, schedule=None, backend=None, skip=(), **pipeline_options):
         """
         Scan photos directory for faces
         
@@ -53,102 +271,454 @@ class FaceRecognitionExplorer:
             force_rescan (bool): Whether to rescan already processed photos
             parallel (bool): Whether to use parallel processing
             model (str): Face detection model ('hog' or 'cnn')
+            progress (callable, optional): Called as progress(done, total)
+                after every photo
+            select (callable, optional): Called with each photo key, or the
+                archive's path for archives; photos it rejects are left out
+            schedule (ScanSchedule, optional): Order to scan photos in
+                (default: the order they lie on disk)
+            backend (FaceBackend, optional): Detects and encodes faces
+                (default: face_backend())
+            skip (iterable): More photo keys to leave out, such as those
+                already in another database; unlike select, archive members
+                are checked one by one
+            **pipeline_options: Passed on to ScanPipeline (stage_workers,
+                memory_budget_mb, read_ahead_mb, queue_size, governor,
+                quality_gate, dedup, cancel_event)
+                
+        Returns:
+            int: Number of photos processed
         """
-        print(f"Scanning photos in {self.photos_dir}...")
-        photo_paths = []
+        backend = backend or self.face_backend(model)
+        self._use_backend(backend)
+        print(f"Scanning photos in {self.photos_dir} with {backend.describe()}...")
         
-        # Find valid image files
-        for ext in ['*.jpg', '*.jpeg', '*.png', '*.bmp', '*.gif']:
-            photo_paths.extend(list(self.photos_dir.glob(f"**/{ext}")))
-            
-        # Filter already processed files
-        if not force_rescan:
-            photo_paths = [
-                p for p in photo_paths 
-                if str(p.relative_to(self.photos_dir)) not in self.face_database['photo_faces']
-            ]
-            
-        print(f"Found {len(photo_paths)} photos to process")
+        # Photos scanned before are skipped, whether they had faces or not
+        processed = set() if force_rescan else self._scanned_photo_paths()
+        processed.update(skip)
         
-        # Database lock for parallel processing
-        db_lock = threading.Lock()
-        processed_count = 0
+        pipeline = ScanPipeline(model=model, parallel=parallel, backend=backend, **pipeline_options)
         new_face_count = 0
         
-        # Function to process a single image
-        def process_image(photo_path):
-            nonlocal processed_count, new_face_count
+        # Runs in this thread; each photo is committed in one short transaction
+        def commit(item):
+            nonlocal new_face_count
             
-            rel_path = photo_path.relative_to(self.photos_dir)
+            if item.error is not None:
+                print(f"Error processing {item.rel_path}: {item.error}")
             
-            try:
-                # Verify this is really an image file
-                if not self._is_valid_image(photo_path):
-                    return 0
-                
-                # Load image
-                image = face_recognition.load_image_file(photo_path)
-                
-                # Find all faces in the image
-                face_locations = face_recognition.face_locations(image, model=model)
-                
-                if not face_locations:
-                    return 0
-                    
-                face_encodings = face_recognition.face_encodings(image, face_locations)
+            with self.store.transaction():
+                if item.metadata is not None:
+                    self._set_photo_metadata(item.rel_path, item.metadata)
                 
-                # Store unlabeled faces for later naming
-                face_count = len(face_encodings)
-                
-                if face_count > 0:
-                    with db_lock:
-                        for face_encoding, face_location in zip(face_encodings, face_locations):
-                            self.face_database['unlabeled_faces'].append(
-                                (str(rel_path), face_encoding, face_location)
-                            )
-                        new_face_count += face_count
-                
-                return face_count
-                
-            except Exception as e:
-                print(f"Error processing {rel_path}: {e}")
-                return 0
-        
-        # Process images (parallel or sequential)
-        if parallel and len(photo_paths) > 10:
-            with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
-                future_to_path = {
-                    executor.submit(process_image, path): path for path in photo_paths
-                }
-                
-                for i, future in enumerate(concurrent.futures.as_completed(future_to_path)):
-                    photo_path = future_to_path[future]
-                    rel_path = photo_path.relative_to(self.photos_dir)
-                    face_count = future.result()
-                    
-                    processed_count += 1
-                    print(f"Processing image {processed_count}/{len(photo_paths)}: {rel_path} - Found {face_count} faces")
-                    
-                    # Save progress periodically
-                    if processed_count % 20 == 0:
-                        with db_lock:
-                            self.save_database()
+                for face_encoding, face_location in zip(item.face_encodings, item.face_locations):
+                    self.store.add_unlabeled(item.rel_path, self._stored_encoding(face_encoding), face_location)
+                # Photos that failed are tried again by the next scan
+                if item.error is None:
+                    self.store.mark_scanned(item.rel_path)
+            new_face_count += item.face_count
+            
+            print(f"Processing image {pipeline.committed}/{pipeline.discovered}: "
+                  f"{item.rel_path} - Found {item.face_count} faces")
+            if schedule is not None and schedule.sample_size and pipeline.committed == schedule.sample_size:
+                print(f"Sample of {schedule.sample_size} photos from across the library scanned "
+                      f"({self.store.unlabeled_count()} unlabeled faces): labeling can start while the scan continues")
+            if progress is not None:
+                progress(pipeline.committed, pipeline.discovered)
+        
+        pipeline.run(self._iter_scan_items(skip=processed, select=select, schedule=schedule), commit)
+        print(pipeline.format_stats())
+        
+        videos = 0
+        if not pipeline.cancelled:
+            videos, video_faces = self._scan_videos(processed, select, backend, pipeline.stage_workers['detect'],
+                                                    pipeline.cancel_event, progress)
+            new_face_count += video_faces
+        
+        if pipeline.cancelled:
+            print(f"Scan cancelled after {pipeline.committed} photos and {videos} videos. "
+                  f"Found {new_face_count} new faces.")
         else:
-            for i, photo_path in enumerate(photo_paths):
-                rel_path = photo_path.relative_to(self.photos_dir)
-                
-                face_count = process_image(photo_path)
-                processed_count += 1
+            print(f"Scan complete. Found {new_face_count} new faces.")
+        print(f"Total unlabeled faces: {self.store.unlabeled_count()}")
+        return pipeline.committed + videos
+    
+    def _scan_videos(self, skip, select, backend, workers, cancel_event=None, progress=None):
+        """
+        Find the faces in videos, one face per track
+        
+        Each track is stored as an unlabeled face, shown by the frame where
+        it is biggest, and its times are kept with the video's tracks.
+        
+        Args:
+            skip (set): Photo keys already in the database; videos with
+                frames among them are left out
+            select (callable, optional): Leaves out videos it returns False for
+            backend (FaceBackend): Detects and encodes faces
+            workers (int): Videos processed at once
+            cancel_event (threading.Event, optional): Stops the scan once set
+            progress (callable, optional): Called as progress(done, total)
+            
+        Returns:
+            tuple: (videos processed, faces found)
+        """
+        done = {split_archive_path(photo_path)[0] for photo_path in skip}
+        videos = []
+        for video_path in self._iter_video_paths():
+            rel_path = str(video_path.relative_to(self.photos_dir))
+            if rel_path not in done and (select is None or select(rel_path)):
+                videos.append((video_path, rel_path))
+        if not videos:
+            return 0, 0
+        
+        tracker = VideoFaceTracker(backend, cancel_event=cancel_event)
+        committed = 0
+        face_count = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(tracker.track, video_path): rel_path for video_path, rel_path in videos}
+            for future in concurrent.futures.as_completed(futures):
+                rel_path = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Error processing {rel_path}: {e}")
+                    continue
+                if result is None:
+                    # Cancelled part way through
+                    continue
+                tracks, stats = result
                 
-                print(f"Processing image {processed_count}/{len(photo_paths)}: {rel_path} - Found {face_count} faces")
+                with self.store.transaction():
+                    # Faces from an earlier scan of the video are replaced
+                    for photo_path, *_ in self.store.video_tracks(rel_path):
+                        self.store.clear_unlabeled(photo_path)
+                    records = []
+                    for track in tracks:
+                        photo_path = frame_key(rel_path, track.frame_time)
+                        encoding = self._stored_encoding(track.encoding())
+                        self.store.add_unlabeled(photo_path, encoding, track.frame_location)
+                        records.append((photo_path, track.start, track.end, encoding, track.frame_location))
+                    self.store.set_video_tracks(rel_path, records)
+                    self.store.mark_scanned(rel_path)
+                committed += 1
+                face_count += len(tracks)
                 
-                # Save progress periodically
-                if i % 10 == 0:
-                    self.save_database()
-                    
+                print(f"Processing video {committed}/{len(videos)}: {rel_path} - Found {len(tracks)} faces "
+                      f"({stats['searches']} searches and {stats['encodings']} encodings "
+                      f"over {stats['frames']} frames)")
+                if progress is not None:
+                    progress(committed, len(videos))
+        return committed, face_count
+    
+    def scan_sharded(self, shards, mode='hash', processes=None, merge=True, **shard_options):
+        """
+        Scan photos with one process per shard, then merge the shards
+        
+        Args:
+            shards (int): Number of shards the library is split into
+            mode (str): 'hash' spreads photos evenly, 'subtree' keeps each
+                folder in one shard
+            processes (int, optional): Shards scanned at once (default: all)
+            merge (bool): Merge the shard databases into this one afterwards
+            **shard_options: Passed on to face_shards.scan_shard
+        """
+        print(f"Scanning photos in {self.photos_dir} as {shards} shards ({mode})...")
+        run_sharded_scan(self.photos_dir, self.database_file, shards, mode, processes, **shard_options)
+        if merge:
+            self.merge_shards()
+    
+    def merge_shards(self, shard_files=None, remove=True):
+        """
+        Merge shard databases into this database
+        
+        Args:
+            shard_files (list, optional): Shard databases; those found next to
+                this database by default
+            remove (bool): Delete each shard database once merged
+        """
+        if shard_files is None:
+            shard_files = find_shard_databases(self.database_file)
+        if not shard_files:
+            print("No shard databases to merge.")
+            return
+        counts = merge_shards(self.store, shard_files, remove=remove)
+        self.reload()
         self.save_database()
-        print(f"Scan complete. Found {new_face_count} new faces.")
-        print(f"Total unlabeled faces: {len(self.face_database['unlabeled_faces'])}")
+        print(f"Merged {len(shard_files)} shards: {counts['photos']} photos, "
+              f"{counts['unlabeled']} unlabeled faces, {counts['reference']} labeled faces")
+    
+    def preview_scan(self, count, tolerance=0.6, profiles=None, seed=None, parallel=True, model="hog",
+                     dedup_distance=4, hash_method='dhash', **pipeline_options):
+        """
+        Scan a stratified random sample and estimate what a full scan will find
+        
+        The sample is scanned with the normal pipeline into a throwaway
+        database, so this database is left untouched. Archives and videos
+        are left out of the sample.
+        
+        Args:
+            count (int): Photos in the sample
+            tolerance (float): Clustering tolerance used to count people
+            profiles (list, optional): Names from SCAN_PROFILES to time
+                (default: all of them)
+            seed (int, optional): Seed of the random sample, to repeat it
+            parallel (bool): Whether to use parallel processing
+            model (str): Face detection model for the sample scan
+            dedup_distance (int): Largest hash distance counted as a near-duplicate
+            hash_method (str): Perceptual hash used to find near-duplicates
+            **pipeline_options: Passed on to ScanPipeline for the sample scan
+            
+        Returns:
+            dict: The estimates, as used by scan_preview.format_preview
+        """
+        skip = self._scanned_photo_paths()
+        candidates, skipped = [], 0
+        for photo_path in self._iter_photo_paths():
+            rel_path = str(photo_path.relative_to(self.photos_dir))
+            if is_archive(photo_path):
+                skipped += 1
+            elif rel_path not in skip:
+                candidates.append(ScanCandidate(photo_path, rel_path))
+        skipped += sum(1 for _ in self._iter_video_paths())
+        sample = stratified_sample(candidates, count, random.Random(seed))
+        print(f"Previewing {len(sample)} of {len(candidates)} photos not scanned yet...")
+        
+        temp_dir = tempfile.mkdtemp(prefix="face_preview_")
+        try:
+            preview = FaceRecognitionExplorer(self.photos_dir, os.path.join(temp_dir, "preview.db"),
+                                              backend=self.face_backend(model))
+            chosen = {candidate.rel_path for candidate in sample}
+            start = time.perf_counter()
+            preview.scan_photos(True, parallel, model, select=chosen.__contains__,
+                                dedup_distance=dedup_distance, hash_method=hash_method, **pipeline_options)
+            seconds = time.perf_counter() - start
+            
+            faces = preview.store.unlabeled_faces()
+            clusters = preview.cluster_faces(tolerance, faces=faces) if faces else []
+            preview.store.close()
+            
+            per_photo = {rel_path: 0 for rel_path in chosen}
+            for _, photo_path, _, _ in faces:
+                per_photo[photo_path] = per_photo.get(photo_path, 0) + 1
+            
+            duplicates = self._count_sample_duplicates(candidates, sample, dedup_distance, hash_method)
+            population = len(candidates)
+            report = {
+                'population': population,
+                'sample': len(sample),
+                'skipped': skipped,
+                'seconds': seconds,
+                'faces': mean_interval(list(per_photo.values()), population),
+                'photos_with_faces': proportion_interval(sum(1 for n in per_photo.values() if n),
+                                                         len(sample), population),
+                'duplicates': proportion_interval(duplicates, len(sample), population),
+                'clusters': len(clusters),
+                'people': chao1([len(cluster) for cluster in clusters]),
+                'profile_sample': 0,
+                'profiles': {},
+            }
+            
+            # Each profile on the same smaller sample, so their times compare
+            timed = stratified_sample(sample, PROFILE_SAMPLE)
+            report['profile_sample'] = len(timed)
+            selected = {candidate.rel_path for candidate in timed}
+            duplicate_share = report['duplicates'][0] / population if population else 0.0
+            for name in (profiles or list(SCAN_PROFILES)) if timed else []:
+                options = dict(pipeline_options, **SCAN_PROFILES[name][1])
+                options['quality_gate'] = QualityGate() if options['quality_gate'] else None
+                profile_model = options.pop('model')
+                try:
+                    options['backend'] = create_backend(options['backend'], profile_model)
+                except FileNotFoundError as e:
+                    print(f"Skipping the {name} profile: {e}")
+                    continue
+                profile_dir = os.path.join(temp_dir, name)
+                os.makedirs(profile_dir)
+                print(f"Timing the {name} profile...")
+                timing = FaceRecognitionExplorer(self.photos_dir, os.path.join(profile_dir, "preview.db"))
+                # Timed from the first photo finished to the last, which
+                # leaves out starting the pipeline and loading the models
+                finished = []
+                start = time.perf_counter()
+                timing.scan_photos(True, parallel, profile_model, select=selected.__contains__,
+                                   progress=lambda done, total: finished.append(time.perf_counter()),
+                                   dedup_distance=dedup_distance, hash_method=hash_method, **options)
+                if len(finished) > 1:
+                    per_photo_seconds = (finished[-1] - finished[0]) / (len(finished) - 1)
+                else:
+                    per_photo_seconds = time.perf_counter() - start
+                timing.store.close()
+                # Near-duplicates are scattered too thinly through a sample
+                # for the timing run to find them; they skip nearly all work
+                total = per_photo_seconds * population
+                if options['dedup']:
+                    total *= 1 - duplicate_share
+                report['profiles'][name] = {'per_photo': per_photo_seconds, 'total': total}
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        
+        print(format_preview(report))
+        return report
+    
+    def _count_sample_duplicates(self, candidates, sample, dedup_distance, hash_method):
+        """
+        Count sampled photos that are near-duplicates of the photo taken before them
+        
+        Burst shots sit next to each other in a folder, so comparing each
+        sampled photo with its predecessor finds the duplicates a full scan
+        would skip, which a scattered sample almost never contains in pairs.
+        """
+        by_folder = {}
+        for candidate in candidates:
+            by_folder.setdefault(candidate.folder, []).append(candidate)
+        previous = {}
+        for folder_candidates in by_folder.values():
+            folder_candidates.sort(key=lambda candidate: (candidate.mtime, candidate.rel_path))
+            for before, candidate in zip(folder_candidates, folder_candidates[1:]):
+                previous[candidate.rel_path] = before
+        
+        def photo_hash(candidate):
+            with open(candidate.path, 'rb') as f:
+                return image_hash(f.read(), hash_method)[0]
+        
+        duplicates = 0
+        for candidate in sample:
+            before = previous.get(candidate.rel_path)
+            if before is None:
+                continue
+            try:
+                if hamming_distance(photo_hash(candidate), photo_hash(before)) <= dedup_distance:
+                    duplicates += 1
+            except Exception:
+                continue
+        return duplicates
+    
+    def _iter_photo_paths(self):
+        """
+        Lazily yield image files and archives below the photos directory
+        
+        Folders are visited in name order, and the files of each folder in
+        inode order, which on most filesystems and file servers is close to
+        the order they lie on disk, so reading them seeks less. On Windows,
+        where inode numbers cost an extra call per file, files stay in name
+        order.
+        """
+        pending = [str(self.photos_dir)]
+        while pending:
+            dirpath = pending.pop()
+            try:
+                with os.scandir(dirpath) as it:
+                    entries = list(it)
+            except OSError:
+                continue
+            
+            dirnames, files = [], []
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirnames.append(entry.name)
+                    elif os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS or is_archive(entry.name):
+                        files.append(entry)
+                except OSError:
+                    continue
+            if os.name == 'nt':
+                files.sort(key=lambda entry: entry.name)
+            else:
+                files.sort(key=lambda entry: (entry.inode(), entry.name))
+            for entry in files:
+                yield Path(dirpath) / entry.name
+            pending.extend(os.path.join(dirpath, name) for name in sorted(dirnames, reverse=True))
+    
+    def _iter_video_paths(self):
+        """Lazily yield video files below the photos directory"""
+        for dirpath, dirnames, filenames in os.walk(self.photos_dir):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if is_video(filename):
+                    yield Path(dirpath) / filename
+    
+    def _iter_scan_items(self, skip=(), select=None, schedule=None):
+        """
+        Lazily yield a ScanItem for every photo, including archive members
+        
+        Archive members are read here, in one sequential pass over the
+        archive, and their bytes travel with the item so the read stage has
+        nothing left to do for them.
+        
+        Args:
+            skip (set): Photo keys to leave out
+            select (callable, optional): Leaves out photos and archives it
+                returns False for
+            schedule (ScanSchedule, optional): Orders the photos; the photos
+                directory is then listed before the first one is yielded
+        """
+        def candidates():
+            for photo_path in self._iter_photo_paths():
+                rel_path = str(photo_path.relative_to(self.photos_dir))
+                if select is not None and not select(rel_path):
+                    continue
+                if is_archive(photo_path) or rel_path not in skip:
+                    yield photo_path, rel_path
+        
+        paths = candidates()
+        if schedule is not None:
+            ordered = schedule.order([ScanCandidate(photo_path, rel_path) for photo_path, rel_path in paths])
+            paths = ((candidate.path, candidate.rel_path) for candidate in ordered)
+        
+        for photo_path, rel_path in paths:
+            if not is_archive(photo_path):
+                yield ScanItem(photo_path, rel_path)
+                continue
+            
+            try:
+                for member_name, data in iter_archive_members(photo_path, IMAGE_EXTENSIONS):
+                    key = member_key(rel_path, member_name)
+                    if key in skip:
+                        continue
+                    item = ScanItem(photo_path, key)
+                    item.data = data
+                    yield item
+            except Exception as e:
+                print(f"Error reading archive {rel_path}: {e}")
+    
+    def _load_photo_bgr(self, photo_path):
+        """Decode a photo (file or archive member) for OpenCV, or None"""
+        try:
+            data = self.photo_reader.read_bytes(photo_path)
+        except Exception:
+            return None
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    
+    def _scanned_photo_paths(self):
+        """Relative paths of photos and videos scanned before, with faces or without"""
+        return self.store.scanned_photos()
+        
+    def index_photo_dates(self, max_workers=None):
+        """
+        Read capture dates for photos scanned before dates were recorded
+        
+        Only EXIF headers are read, so this is much quicker than a rescan.
+        
+        Args:
+            max_workers (int, optional): Threads reading headers in parallel
+        """
+        missing = [photo_path for photo_path in self._scanned_photo_paths()
+                   if photo_path not in self.timeline and not is_video(photo_path)]
+        print(f"Reading capture dates of {len(missing)} photos...")
+        
+        def read(photo_path):
+            with self.photo_reader.open(photo_path) as f, Image.open(f) as image:
+                return read_photo_metadata(image)
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(read, photo_path): photo_path for photo_path in missing}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    self._set_photo_metadata(futures[future], future.result())
+                except Exception as e:
+                    print(f"Error reading {futures[future]}: {e}")
+        
+        print(f"{len(self.timeline.between())} of {len(self.timeline.records)} photos have a capture date")
         
     def _is_valid_image(self, file_path):
         """Check if file is a valid image"""
@@ -173,27 +743,43 @@ class FaceRecognitionExplorer:
             index (int): Index of unlabeled face
             name (str): Person's name to assign
         """
-        if index >= len(self.face_database['unlabeled_faces']):
+        unlabeled_faces = self.store.unlabeled_faces(encodings=False)
+        if index >= len(unlabeled_faces):
             print(f"Invalid index: {index}")
             return False
             
-        photo_path, face_encoding, face_location = self.face_database['unlabeled_faces'][index]
-        
-        # Add to named faces
-        if name not in self.face_database['faces']:
-            self.face_database['faces'][name] = []
-        self.face_database['faces'][name].append(face_encoding)
-        
-        # Add to photo_faces
-        if photo_path not in self.face_database['photo_faces']:
-            self.face_database['photo_faces'][photo_path] = []
-        self.face_database['photo_faces'][photo_path].append((name, face_location))
+        face = self.store.unlabeled_face(unlabeled_faces[index][0])
+        if face is None or not self.label_faces([(face, name)]):
+            print(f"Face #{index} was labeled or removed by another process")
+            return False
+        return True
+    
+    def label_faces(self, assignments):
+        """
+        Label many unlabeled faces at once, in one transaction
         
-        # Remove from unlabeled
-        self.face_database['unlabeled_faces'].pop(index)
+        Args:
+            assignments (list): (unlabeled face, name) pairs, with faces as
+                returned by store.unlabeled_faces(). Faces are matched by
+                face ID, so a batch prepared from a snapshot stays valid
+                while earlier batches commit; faces already labeled or
+                removed meanwhile are skipped.
+                
+        Returns:
+            int: Number of faces labeled
+        """
+        labeled = 0
+        with self.store.transaction():
+            for (face_id, photo_path, face_encoding, face_location), name in assignments:
+                if not self.store.take_unlabeled(face_id):
+                    continue
+                self.store.add_reference(name, face_encoding)
+                self._add_photo_face(photo_path, name, face_location)
+                labeled += 1
         
-        self.save_database()
-        return True
+        if labeled:
+            self.save_database()
+        return labeled
     
     def show_unlabeled_face(self, index):
         """
@@ -202,19 +788,19 @@ class FaceRecognitionExplorer:
         Args:
             index (int): Index of unlabeled face
         """
-        if index >= len(self.face_database['unlabeled_faces']):
+        unlabeled_faces = self.store.unlabeled_faces(encodings=False)
+        if index >= len(unlabeled_faces):
             print(f"Invalid index: {index}")
             return
             
-        photo_path, _, face_location = self.face_database['unlabeled_faces'][index]
-        full_path = self.photos_dir / photo_path
+        _, photo_path, _, face_location = unlabeled_faces[index]
         
-        if not full_path.exists():
-            print(f"Photo file not found: {full_path}")
+        # Load image and highlight face
+        image = self._load_photo_bgr(photo_path)
+        if image is None:
+            print(f"Photo file not found: {self.photos_dir / photo_path}")
             return
             
-        # Load image and highlight face
-        image = cv2.imread(str(full_path))
         top, right, bottom, left = face_location
         cv2.rectangle(image, (left, top), (right, bottom), (0, 0, 255), 2)
         
@@ -222,217 +808,428 @@ class FaceRecognitionExplorer:
         cv2.imshow(f"Face #{index}", image)
         cv2.waitKey(0)
         cv2.destroyAllWindows()
-        def recognize_faces(self, tolerance=0.6, model="hog"):
-            """
-            Recognize and label all faces in photos using the current database
-            
-            Args:
-                tolerance (float): Face matching tolerance (lower=stricter)
-                model (str): Face detection model ('hog' or 'cnn')
-            """
-            print("Recognizing faces in all photos...")
-            
-            # Reset photo_faces
-            self.face_database['photo_faces'] = {}
-            
-            photo_paths = []
-            for ext in ['*.jpg', '*.jpeg', '*.png', '*.bmp', '*.gif']:
-                photo_paths.extend(list(self.photos_dir.glob(f"**/{ext}")))
-            
-            # Get all known face encodings and names
-            known_face_encodings = []
-            known_face_names = []
-            
-            for name, encodings in self.face_database['faces'].items():
-                for encoding in encodings:
-                    known_face_encodings.append(encoding)
-                    known_face_names.append(name)
-            
-            if not known_face_encodings:
-                print("No known faces in database. Please label some faces first.")
+    def recognize_faces(self, tolerance=0.6, model="hog", parallel=True, progress=None,
+                        backend=None, **pipeline_options):
+        """
+        Recognize and label all faces in photos using the current database
+        
+        Args:
+            tolerance (float): Face matching tolerance (lower=stricter)
+            model (str): Face detection model ('hog' or 'cnn')
+            parallel (bool): Whether to use parallel processing
+            progress (callable, optional): Called as progress(done, total)
+                after every photo
+            backend (FaceBackend, optional): Detects and encodes faces; must
+                be the one the database was scanned with (default:
+                face_backend())
+            **pipeline_options: Passed on to ScanPipeline (stage_workers,
+                memory_budget_mb, read_ahead_mb, queue_size, governor,
+                quality_gate, dedup, cancel_event)
+        """
+        backend = backend or self.face_backend(model)
+        self._use_backend(backend)
+        print(f"Recognizing faces in all photos with {backend.describe()}...")
+        
+        # Get all known face encodings and names
+        known_face_encodings = []
+        known_face_names = []
+        
+        for name, encodings in self.store.reference_encodings().items():
+            for encoding in encodings:
+                known_face_encodings.append(encoding)
+                known_face_names.append(name)
+        
+        if not known_face_encodings:
+            print("No known faces in database. Please label some faces first.")
+            return
+        
+        # Compared in float32 whatever precision they are stored with
+        known_face_encodings = np.array(known_face_encodings, dtype=np.float32)
+        
+        # Photos keep their previous results until they are recognized again,
+        # so a cancelled run or another process never sees them missing
+        previously_recognized = {photo_path for photo_path, _ in self.store.iter_photo_faces()}
+        processed = set()
+        
+        # Unknown faces that are already waiting for a label aren't added twice
+        unlabeled = {
+            (photo_path, tuple(face_location))
+            for _, photo_path, _, face_location in self.store.unlabeled_faces(encodings=False)
+        }
+        
+        pipeline = ScanPipeline(model=model, parallel=parallel, backend=backend, **pipeline_options)
+        
+        def commit(item):
+            print(f"Processing image {pipeline.committed}/{pipeline.discovered}: {item.rel_path}")
+            processed.add(item.rel_path)
+            if progress is not None:
+                progress(pipeline.committed, pipeline.discovered)
+            
+            if item.error is not None:
+                print(f"Error processing {item.rel_path}: {item.error}")
                 return
             
-            for i, photo_path in enumerate(photo_paths):
-                rel_path = photo_path.relative_to(self.photos_dir)
-                print(f"Processing image {i+1}/{len(photo_paths)}: {rel_path}")
+            faces_in_photo = []
+            
+            # Each photo's results are committed in one short transaction
+            with self.store.transaction():
+                if item.metadata is not None:
+                    self._set_photo_metadata(item.rel_path, item.metadata)
                 
-                try:
-                    # Load image
-                    image = face_recognition.load_image_file(photo_path)
-                    
-                    # Find all faces
-                    face_locations = face_recognition.face_locations(image)
-                    face_encodings = face_recognition.face_encodings(image, face_locations)
+                for face_encoding, face_location in zip(item.face_encodings, item.face_locations):
+                    # Use the closest known face if it is within tolerance
+                    face_distances = face_recognition.face_distance(known_face_encodings, face_encoding)
+                    best_match_index = np.argmin(face_distances)
                     
-                    faces_in_photo = []
-                    
-                    for face_encoding, face_location in zip(face_encodings, face_locations):
-                        # Compare face to known faces
-                        matches = face_recognition.compare_faces(known_face_encodings, face_encoding)
-                        face_distances = face_recognition.face_distance(known_face_encodings, face_encoding)
-                        
-                        if not any(matches):
-                            # Unknown face
-                            self.face_database['unlabeled_faces'].append((str(rel_path), face_encoding, face_location))
-                            continue
-                        
-                        # Use the closest match
-                        best_match_index = np.argmin(face_distances)
-                        if matches[best_match_index]:
-                            name = known_face_names[best_match_index]
-                            faces_in_photo.append((name, face_location))
-                    
-                    if faces_in_photo:
-                        self.face_database['photo_faces'][str(rel_path)] = faces_in_photo
-                        
-                    # Save progress periodically
-                    if i % 10 == 0:
-                        self.save_database()
-                        
-                except Exception as e:
-                    print(f"Error processing {rel_path}: {e}")
-                    
-            self.save_database()
+                    if face_distances[best_match_index] <= tolerance:
+                        faces_in_photo.append((known_face_names[best_match_index], face_location))
+                    elif (item.rel_path, tuple(face_location)) not in unlabeled:
+                        # Unknown face
+                        self.store.add_unlabeled(item.rel_path, self._stored_encoding(face_encoding),
+                                                 face_location)
+                
+                self._replace_photo_faces(item.rel_path, faces_in_photo)
+        
+        pipeline.run(self._iter_scan_items(), commit)
+        
+        if not pipeline.cancelled:
+            processed |= self._recognize_videos(known_face_encodings, known_face_names, tolerance, unlabeled)
+            
+            # Photos that are no longer in the photos directory
+            for photo_path in previously_recognized - processed:
+                self._replace_photo_faces(photo_path, [])
+                
+        self.save_database()
+        print(pipeline.format_stats())
+        if pipeline.cancelled:
+            print(f"Recognition cancelled after {pipeline.committed} photos.")
+        else:
             print("Recognition complete.")
+        
+    def _recognize_videos(self, known_face_encodings, known_face_names, tolerance, unlabeled):
+        """
+        Recognize the face tracks stored for videos
+        
+        Tracks keep their encodings, so videos are never decoded again.
+        
+        Returns:
+            set: Frame keys the tracks are shown by
+        """
+        frames = set()
+        for video_path, tracks in list(self.store.iter_video_tracks()):
+            if not (self.photos_dir / video_path).exists():
+                self.store.set_video_tracks(video_path, [])
+                continue
             
-    def create_windows_search_files(self, output_dir=None):
+            faces_by_frame = {}
+            with self.store.transaction():
+                for photo_path, start, end, encoding, face_location in tracks:
+                    faces_in_frame = faces_by_frame.setdefault(photo_path, [])
+                    face_distances = face_recognition.face_distance(known_face_encodings, encoding)
+                    best_match_index = np.argmin(face_distances)
+                    
+                    if face_distances[best_match_index] <= tolerance:
+                        faces_in_frame.append((known_face_names[best_match_index], face_location))
+                    elif (photo_path, tuple(face_location)) not in unlabeled:
+                        self.store.add_unlabeled(photo_path, encoding, face_location)
+                
+                for photo_path, faces_in_frame in faces_by_frame.items():
+                    self._replace_photo_faces(photo_path, faces_in_frame)
+            frames.update(faces_by_frame)
+            print(f"Recognized {len(tracks)} face tracks in {video_path}")
+        return frames
+        
+    def create_windows_search_files(self, output_dir=None, formats='properties', mode='auto',
+                                    max_workers=None):
         """
-        Create Windows search property files for all photos with faces
+        Create search sidecar files for all photos with faces
+        
+        Every photo gets one sidecar listing everyone recognized in it.
+        Sidecars that are already up to date are left untouched.
         
         Args:
-            output_dir (str, optional): Directory to copy photos and property files to
+            output_dir (str, optional): Directory to place photos and sidecars
+                in; without it sidecars are written next to the originals
+            formats (str): 'properties' (Windows Search), 'xmp' (IPTC
+                PersonInImage) or 'both'
+            mode (str): How photos are placed in output_dir: 'auto', 'reflink',
+                'hardlink', 'symlink' or 'copy'
+            max_workers (int, optional): Threads placing photos and writing
+                sidecars in parallel
         """
+        # Everyone in each photo, in the order they were recognized
+        photo_people = {
+            photo_path: list(dict.fromkeys(name for name, _ in faces))
+            for photo_path, faces in self.store.iter_photo_faces()
+        }
+        
         if output_dir:
             output_path = Path(output_dir)
-            output_path.mkdir(parents=True, exist_ok=True)
+            # Photos keep their place in the directory structure
+            stats = sync_outputs(output_path, {photo_path: photo_path for photo_path in photo_people},
+                                 self.photo_reader, mode=mode, max_workers=max_workers)
+            print(f"  Photos: {stats['added']} added, {stats['updated']} updated, "
+                  f"{stats['removed']} removed, {stats['unchanged']} unchanged, {stats['errors']} errors")
         else:
             output_path = self.photos_dir
-            
-        # Group photos by person
-        person_photos = {}
-        for photo_path, faces in self.face_database['photo_faces'].items():
-            for name, _ in faces:
-                if name not in person_photos:
-                    person_photos[name] = []
-                person_photos[name].append(photo_path)
-                
-        # Create search property files
-        for name, photos in person_photos.items():
-            print(f"Creating search files for {name} with {len(photos)} photos")
-            
-            for photo_path in photos:
-                src_path = self.photos_dir / photo_path
-                if not src_path.exists():
-                    print(f"Source photo not found: {src_path}")
-                    continue
-                    
-                # Copy photo to output directory if needed
-                if output_dir:
-                    # Preserve directory structure
-                    dst_dir = output_path / Path(photo_path).parent
-                    dst_dir.mkdir(parents=True, exist_ok=True)
-                    dst_path = output_path / photo_path
-                    shutil.copy2(src_path, dst_path)
-                else:
-                    dst_path = src_path
-                
-                # Create property file (.properties) with person tags
-                prop_path = dst_path.parent / f"{dst_path.stem}.properties"
-                with open(prop_path, 'w') as f:
-                    f.write(f"Person={name}")
+            for photo_path in [p for p in photo_people if self.photo_reader.local_path(p) is None]:
+                print(f"Skipping archived photo {photo_path}: use an output directory to tag it")
+                del photo_people[photo_path]
         
-        print(f"Created Windows search files for {len(person_photos)} people.")
+        stats = write_sidecars(output_path, photo_people, formats, max_workers=max_workers)
+        print(f"  Sidecars: {stats['written']} written, {stats['unchanged']} up to date, "
+              f"{stats['removed']} removed, {stats['skipped']} skipped, {stats['errors']} errors")
+        
+        people = {name for names in photo_people.values() for name in names}
+        print(f"Created search files for {len(photo_people)} photos of {len(people)} people.")
     
-    def export_face_data(self, output_file='face_data.json'):
+    def export_face_data(self, output_file='face_data.json', since=None, until=None):
         """
         Export face data to JSON for other applications
         
         Args:
             output_file (str): JSON file to export to
+            since (str, optional): Only export photos taken on or after this date
+            until (str, optional): Only export photos taken on or before this date
         """
         export_data = {
             'people': {},
             'photos': {}
         }
         
+        dated = None
+        if since or until:
+            dated = set(self.query_photos(since=since, until=until))
+        
         # Export people data
-        for name in self.face_database['faces'].keys():
+        for name in self.store.reference_counts():
+            photos = self.person_index.photos(name)
+            if dated is not None:
+                photos = [photo_path for photo_path in photos if photo_path in dated]
             export_data['people'][name] = {
-                'photo_count': 0,
-                'photos': []
+                'photo_count': len(photos),
+                'photos': photos
             }
         
         # Export photo data
-        for photo_path, faces in self.face_database['photo_faces'].items():
-            people_in_photo = []
-            for name, _ in faces:
-                people_in_photo.append(name)
-                export_data['people'][name]['photo_count'] += 1
-                export_data['people'][name]['photos'].append(photo_path)
-                
+        for photo_path, faces in self.store.iter_photo_faces():
+            if dated is not None and photo_path not in dated:
+                continue
             export_data['photos'][photo_path] = {
-                'people': people_in_photo
+                'people': [name for name, _ in faces],
+                **self.timeline.get(photo_path)
             }
             
         with open(output_file, 'w') as f:
             json.dump(export_data, f, indent=2)
             
         print(f"Exported face data to {output_file}")
+    
+    def export_face_records(self, output_path, format='ndjson', since=None, until=None,
+                            include_encodings=True):
+        """
+        Stream every face, with its box and encoding, to disk
+        
+        Unlike export_face_data, records are written one at a time, so memory
+        use doesn't grow with the size of the database.
+        
+        Args:
+            output_path (str): NDJSON file ('.gz' or '.zst' compresses) or,
+                for the columnar format, a directory
+            format (str): 'ndjson' or 'columnar' (faces.csv + embeddings.npy)
+            since (str, optional): Only export photos taken on or after this date
+            until (str, optional): Only export photos taken on or before this date
+            include_encodings (bool): Include encodings in NDJSON records
+        """
+        photos = None
+        if since or until:
+            photos = set(self.query_photos(since=since, until=until))
+        records = iter_face_records(self.store, self.timeline, photos)
+        
+        if format == 'columnar':
+            embedding_count = sum(
+                1 for _, photo_path, _, _ in self.store.unlabeled_faces(encodings=False)
+                if photos is None or photo_path in photos
+            )
+            if photos is None:
+                embedding_count += sum(self.store.reference_counts().values())
+            faces, rows = export_columnar(records, output_path, embedding_count)
+            print(f"Exported {faces} faces and {rows} embeddings to {output_path}")
+        else:
+            faces = export_ndjson(records, output_path, include_encodings)
+            print(f"Exported {faces} faces to {output_path}")
+    
+    def query_photos(self, expression=None, since=None, until=None):
+        """
+        Find photos by who is in them and when they were taken
+        
+        Args:
+            expression (str, optional): Person names combined with AND, OR,
+                NOT and parentheses, e.g. 'Alice AND Bob AND NOT Carol'.
+                Quote names that contain those words
+            since (str, optional): Earliest capture date, e.g. '2019-06'
+            until (str, optional): Latest capture date, inclusive, e.g. '2019-08'
             
-    def visualize_faces(self, output_dir):
+        Returns:
+            list: Matching photo paths, relative to the photos directory.
+            Oldest first when a date range is given
+        """
+        return select_photos(self.person_index, self.timeline, expression, since, until)
+    
+    def top_companions(self, name, limit=10):
+        """
+        People who appear most often in photos with a person
+        
+        Args:
+            name (str): Person to look up
+            limit (int): Number of companions to return
+            
+        Returns:
+            list: (name, photos together) pairs, most frequent first
+        """
+        return self.cooccurrence.companions(name, limit)
+    
+    def export_cooccurrence(self, output_file='cooccurrence.graphml', min_count=1):
+        """
+        Export who appears with whom as a graph
+        
+        Args:
+            output_file (str): .graphml for GraphML, anything else for JSON
+            min_count (int): Leave out pairs seen together fewer times
+        """
+        self.cooccurrence.export(output_file, min_count)
+        print(f"Exported co-occurrence graph to {output_file}")
+            
+    def visualize_faces(self, output_dir, max_dimension=1600, max_workers=None, quality=85):
         """
         Create visualizations of recognized faces
         
+        Output mirrors the folders of the photos directory, so photos with the
+        same name in different folders don't overwrite each other. Reruns only
+        redraw photos whose faces or source file changed.
+        
         Args:
             output_dir (str): Directory to save visualizations
+            max_dimension (int): Longest side of the saved JPEGs in pixels
+            max_workers (int, optional): Threads drawing photos in parallel
+            quality (int): JPEG quality of the saved images
         """
         out_path = Path(output_dir)
         out_path.mkdir(parents=True, exist_ok=True)
+        manifest = OutputManifest(out_path, '.visualize_manifest.json')
+        stats = {'drawn': 0, 'unchanged': 0, 'removed': 0, 'errors': 0}
         
-        # Create individual face visualizations
-        for photo_path, faces in self.face_database['photo_faces'].items():
-            if not faces:
-                continue
-                
+        # Work out which annotated images are missing or out of date
+        wanted = {}
+        todo = []
+        for photo_path, faces in self.store.iter_photo_faces():
+            rel_out = self._visualization_name(photo_path)
+            wanted[rel_out] = photo_path
             try:
-                full_path = self.photos_dir / photo_path
-                if not full_path.exists():
+                signature = source_signature(self.photo_reader, photo_path)
+            except OSError:
+                stats['errors'] += 1
+                continue
+            annotations = hashlib.sha1(
+                json.dumps([[name, [int(v) for v in loc]] for name, loc in faces]).encode('utf-8')
+            ).hexdigest()
+            entry = {'source': photo_path, 'signature': signature, 'annotations': annotations,
+                     'max_dimension': max_dimension, 'quality': quality}
+            if manifest.files.get(rel_out) == entry and (out_path / rel_out).exists():
+                stats['unchanged'] += 1
+            else:
+                todo.append((rel_out, photo_path, faces, entry))
+        
+        # Remove images of photos that no longer have recognized faces
+        for rel_out in list(manifest.files):
+            if rel_out not in wanted:
+                try:
+                    (out_path / rel_out).unlink()
+                except FileNotFoundError:
+                    pass
+                del manifest.files[rel_out]
+                stats['removed'] += 1
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(self._draw_visualization, photo_path, faces,
+                                out_path / rel_out, max_dimension, quality): (rel_out, photo_path, entry)
+                for rel_out, photo_path, faces, entry in todo
+            }
+            for future in concurrent.futures.as_completed(futures):
+                rel_out, photo_path, entry = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Error visualizing {photo_path}: {e}")
+                    manifest.files.pop(rel_out, None)
+                    stats['errors'] += 1
                     continue
-                    
-                image = Image.open(full_path)
-                draw = ImageDraw.Draw(image)
-                
-                # Draw rectangles and names
-                for name, face_location in faces:
-                    top, right, bottom, left = face_location
-                    draw.rectangle(((left, top), (right, bottom)), outline=(0, 0, 255), width=2)
-                    draw.text((left, top - 20), name, fill=(0, 0, 255))
-                
-                # Save annotated image
-                out_file = out_path / f"annotated_{Path(photo_path).name}"
-                image.save(out_file)
-                
-            except Exception as e:
-                print(f"Error visualizing {photo_path}: {e}")
-                
+                manifest.files[rel_out] = entry
+                stats['drawn'] += 1
+        
+        manifest.save()
+        print(f"  {stats['drawn']} drawn, {stats['unchanged']} unchanged, "
+              f"{stats['removed']} removed, {stats['errors']} errors")
         print(f"Saved face visualizations to {output_dir}")
     
-    def cluster_faces(self, tolerance=0.6):
+    @staticmethod
+    def _visualization_name(photo_path):
+        """Output path of a photo's visualization, relative to the output directory"""
+        archive, member = split_archive_path(photo_path)
+        rel_path = archive if member is None else f"{archive}/{member}"
+        rel_path = Path(rel_path.replace('\\', '/'))
+        # Keep other extensions in the name so img.png and img.jpg don't collide
+        stem = rel_path.stem if rel_path.suffix.lower() == '.jpg' else rel_path.name
+        return (rel_path.parent / f"annotated_{stem}.jpg").as_posix()
+    
+    def _draw_visualization(self, photo_path, faces, out_file, max_dimension, quality):
+        """Draw face boxes and names on a downscaled copy of a photo"""
+        with self.photo_reader.open(photo_path) as f, Image.open(f) as image:
+            original_size = image.size
+            # JPEGs can be decoded straight at a fraction of their size
+            image.draft('RGB', (max_dimension, max_dimension))
+            image = image.convert('RGB')
+            image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        
+        scale_x = image.size[0] / original_size[0]
+        scale_y = image.size[1] / original_size[1]
+        draw = ImageDraw.Draw(image)
+        
+        # Draw rectangles and names
+        for name, face_location in faces:
+            top, right, bottom, left = face_location
+            box = (left * scale_x, top * scale_y), (right * scale_x, bottom * scale_y)
+            draw.rectangle(box, outline=(0, 0, 255), width=2)
+            draw.text((box[0][0], box[0][1] - 20), name, fill=(0, 0, 255))
+        
+        # Save annotated image
+        out_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = out_file.with_name(out_file.name + '.tmp')
+        image.save(tmp_file, 'JPEG', quality=quality)
+        os.replace(tmp_file, out_file)
+    
+    def cluster_faces(self, tolerance=0.6, faces=None):
         """
         Cluster unlabeled faces to group similar faces together
         
         Args:
             tolerance (float): Threshold for face similarity (lower = stricter)
+            faces (list, optional): Unlabeled faces from store.unlabeled_faces()
+                to cluster; all of them are loaded if not given
             
         Returns:
-            list: List of clusters, where each cluster is a list of face indices
+            list: List of clusters, where each cluster is a list of indices into faces
         """
-        if not self.face_database['unlabeled_faces']:
+        unlabeled_faces = self.store.unlabeled_faces() if faces is None else faces
+        if not unlabeled_faces:
             print("No unlabeled faces to cluster.")
             return []
             
-        # Extract face encodings from unlabeled faces
-        encodings = [face[1] for face in self.face_database['unlabeled_faces']]
+        # One contiguous float32 array rather than a list of per-face arrays
+        encodings = np.empty((len(unlabeled_faces), 128), dtype=np.float32)
+        for i, face in enumerate(unlabeled_faces):
+            encodings[i] = face[2]
         
         # Cluster faces using DBSCAN
         clustering = DBSCAN(metric="euclidean", n_jobs=-1, 
@@ -449,120 +1246,94 @@ class FaceRecognitionExplorer:
         sorted_clusters = sorted(clusters.values(), key=len, reverse=True)
         
         return sorted_clusters
-        def interactive_labeling(self, tolerance=0.6, max_faces_per_prompt=5):
-            """
-            Interactive mode to label faces with a GUI
-            
-            Args:
-                tolerance (float): Threshold for face similarity (lower = stricter)
-                max_faces_per_prompt (int): Maximum number of faces to show per prompt
-            """
-            if not self.face_database['unlabeled_faces']:
-                print("No unlabeled faces found. Run scan first.")
-                return
-                
-            # Initialize tkinter for GUI dialogs
-            if self._tk_root is None:
-                self._tk_root = tk.Tk()
-                self._tk_root.withdraw()  # Hide the main window
-                
-            # Show instructions
-            messagebox.showinfo(
-                "Interactive Labeling",
-                "You'll be shown groups of similar faces.\n\n"
-                "For each group:\n"
-                "- Enter a person's name to label all faces in the group\n"
-                "- Type 'skip' to skip the current group\n"
-                "- Close the dialog or press Cancel to end the session\n\n"
-                "Press OK to begin."
-            )
-                
-            # Cluster similar faces
-            print("Clustering similar faces...")
-            clusters = self.cluster_faces(tolerance)
-            print(f"Found {len(clusters)} distinct face clusters")
-            
-            # Process each cluster
-            for i, cluster in enumerate(clusters):
-                if not cluster:
-                    continue
-                    
-                print(f"Processing cluster {i+1}/{len(clusters)} with {len(cluster)} faces")
-                
-                # Show representative faces from this cluster
-                faces_to_show = min(len(cluster), max_faces_per_prompt)
-                sample_indices = cluster[:faces_to_show]
-                
-                # Create a composite image of sample faces
-                composite = self._create_cluster_composite(sample_indices)
-                
-                # Show composite image
-                cv2.imshow(f"Face Cluster #{i+1}", composite)
-                cv2.waitKey(100)  # Short delay to ensure window shows up
-                
-                # Ask for name
-                name = simpledialog.askstring("Label Face", 
-                                            f"Enter name for these faces (Cluster #{i+1}) or 'skip' to skip:",
-                                            parent=self._tk_root)
-                
-                cv2.destroyAllWindows()
-                
-                if not name or name.lower() == 'skip':
-                    print(f"Skipping cluster #{i+1}")
-                    continue
-                    
-                # Label all faces in this cluster
-                for idx in cluster:
-                    photo_path, face_encoding, face_location = self.face_database['unlabeled_faces'][idx]
-                    
-                    # Add to named faces
-                    if name not in self.face_database['faces']:
-                        self.face_database['faces'][name] = []
-                    self.face_database['faces'][name].append(face_encoding)
-                    
-                    # Add to photo_faces
-                    if photo_path not in self.face_database['photo_faces']:
-                        self.face_database['photo_faces'][photo_path] = []
-                    self.face_database['photo_faces'][photo_path].append((name, face_location))
-                
-                # Remove labeled faces from unlabeled (in reverse order to avoid index issues)
-                for idx in sorted(cluster, reverse=True):
-                    # Adjust index for any previous removals
-                    adjusted_idx = idx
-                    for removed_idx in cluster:
-                        if removed_idx < idx and removed_idx in self.face_database['unlabeled_faces']:
-                            adjusted_idx -= 1
-                    
-                    if adjusted_idx < len(self.face_database['unlabeled_faces']):
-                        self.face_database['unlabeled_faces'].pop(adjusted_idx)
-                
-                # Save after each cluster
-                self.save_database()
+    def interactive_labeling(self, tolerance=0.6, max_faces_per_prompt=5):
+        """
+        Interactive mode to label faces with a GUI
+        
+        Args:
+            tolerance (float): Threshold for face similarity (lower = stricter)
+            max_faces_per_prompt (int): Maximum number of faces to show per prompt
+        """
+        # Cluster indices refer to this snapshot of the unlabeled faces
+        unlabeled_faces = self.store.unlabeled_faces()
+        if not unlabeled_faces:
+            print("No unlabeled faces found. Run scan first.")
+            return
+            
+        # Initialize tkinter for GUI dialogs
+        if self._tk_root is None:
+            self._tk_root = tk.Tk()
+            self._tk_root.withdraw()  # Hide the main window
+            
+        # Show instructions
+        messagebox.showinfo(
+            "Interactive Labeling",
+            "You'll be shown groups of similar faces.\n\n"
+            "For each group:\n"
+            "- Enter a person's name to label all faces in the group\n"
+            "- Type 'skip' to skip the current group\n"
+            "- Close the dialog or press Cancel to end the session\n\n"
+            "Press OK to begin."
+        )
+            
+        # Cluster similar faces
+        print("Clustering similar faces...")
+        clusters = self.cluster_faces(tolerance, faces=unlabeled_faces)
+        print(f"Found {len(clusters)} distinct face clusters")
+        
+        # Process each cluster
+        for i, cluster in enumerate(clusters):
+            if not cluster:
+                continue
                 
-            print(f"Interactive labeling complete. {len(self.face_database['unlabeled_faces'])} faces remain unlabeled.")
+            print(f"Processing cluster {i+1}/{len(clusters)} with {len(cluster)} faces")
+            
+            # Show representative faces from this cluster
+            faces_to_show = min(len(cluster), max_faces_per_prompt)
+            sample_indices = cluster[:faces_to_show]
+            
+            # Create a composite image of sample faces
+            composite = self._create_cluster_composite(sample_indices, faces=unlabeled_faces)
+            
+            # Show composite image
+            cv2.imshow(f"Face Cluster #{i+1}", composite)
+            cv2.waitKey(100)  # Short delay to ensure window shows up
+            
+            # Ask for name
+            name = simpledialog.askstring("Label Face", 
+                                        f"Enter name for these faces (Cluster #{i+1}) or 'skip' to skip:",
+                                        parent=self._tk_root)
             
-            # Clean up
-            if self._tk_root:
-                self._tk_root.destroy()
-                self._tk_root = None
+            cv2.destroyAllWindows()
             
-    def _create_cluster_composite(self, face_indices, size=(150, 150), cols=3):
+            if not name or name.lower() == 'skip':
+                print(f"Skipping cluster #{i+1}")
+                continue
+                
+            # Label all faces in this cluster; saves after each cluster
+            self.label_faces([(unlabeled_faces[idx], name) for idx in cluster])
+            
+        print(f"Interactive labeling complete. {self.store.unlabeled_count()} faces remain unlabeled.")
+        
+        # Clean up
+        if self._tk_root:
+            self._tk_root.destroy()
+            self._tk_root = None
+        
+    def _create_cluster_composite(self, face_indices, size=(150, 150), cols=3, faces=None):
         """Create a composite image of multiple faces from a cluster"""
+        unlabeled_faces = self.store.unlabeled_faces(encodings=False) if faces is None else faces
         faces = []
         
         for idx in face_indices:
-            if idx >= len(self.face_database['unlabeled_faces']):
+            if idx >= len(unlabeled_faces):
                 continue
                 
-            photo_path, _, face_location = self.face_database['unlabeled_faces'][idx]
-            full_path = self.photos_dir / photo_path
+            _, photo_path, _, face_location = unlabeled_faces[idx]
             
-            if not full_path.exists():
-                continue
-                
             try:
                 # Load image and extract face
-                image = cv2.imread(str(full_path))
+                image = self._load_photo_bgr(photo_path)
                 if image is None:
                     continue
                     
@@ -595,58 +1366,80 @@ class FaceRecognitionExplorer:
             
         return composite
 
-    def group_photos_by_person(self, output_dir):
+    def group_photos_by_person(self, output_dir, mode='auto', max_workers=None, cancel_event=None,
+                               progress=None):
         """
         Group photos by person and organize them in folders
         
+        Reruns are incremental: a manifest in output_dir records what was
+        placed, so only new or changed photos are added and photos that no
+        longer belong to a person are removed.
+        
         Args:
             output_dir (str): Directory to save organized photos
+            mode (str): How photos are placed: 'auto' (reflink, then hardlink,
+                then copy), 'reflink', 'hardlink', 'symlink' or 'copy'
+            max_workers (int, optional): Threads placing photos in parallel
+            cancel_event (threading.Event, optional): Stop early once set;
+                photos placed so far are kept
+            progress (callable, optional): Called as progress(done, total)
+                while photos are placed and again while thumbnails are made
         """
         print(f"Grouping photos by person in {output_dir}...")
         output_path = Path(output_dir)
         output_path.mkdir(parents=True, exist_ok=True)
         
-        # Create mapping of people to photos
-        person_photos = {}
-        for photo_path, faces in self.face_database['photo_faces'].items():
-            for name, _ in faces:
-                if name not in person_photos:
-                    person_photos[name] = []
-                person_photos[name].append(photo_path)
+        # Mapping of people to photos, straight from the index
+        person_photos = self.person_index.person_photos()
         
-        # Create person folders and copy photos
+        # Every photo gets a stable name in each of its people's folders
+        wanted = {}
         for name, photos in person_photos.items():
-            # Create folder for person
-            person_dir = output_path / name
-            person_dir.mkdir(exist_ok=True)
-            
-            print(f"Copying {len(photos)} photos of {name} to {person_dir}")
-            
-            # Copy each photo
-            for i, photo_path in enumerate(photos):
-                src_path = self.photos_dir / photo_path
-                if not src_path.exists():
-                    print(f"  Source photo not found: {src_path}")
-                    continue
-                    
-                # Use a numbered filename to avoid conflicts
-                extension = src_path.suffix
-                dst_path = person_dir / f"{name}_{i+1}{extension}"
-                
-                try:
-                    shutil.copy2(src_path, dst_path)
-                except Exception as e:
-                    print(f"  Error copying {src_path}: {e}")
+            for photo_path in photos:
+                wanted[f"{name}/{output_name(photo_path)}"] = photo_path
+        
+        stats = sync_outputs(output_path, wanted, self.photo_reader, mode=mode, max_workers=max_workers,
+                             cancel_event=cancel_event, progress=progress)
+        print(f"  {stats['added']} added, {stats['updated']} updated, {stats['removed']} removed, "
+              f"{stats['unchanged']} unchanged, {stats['errors']} errors")
+        if cancel_event is not None and cancel_event.is_set():
+            print("Grouping cancelled.")
+            return
+        
+        # Drop folders of people who no longer have any photos
+        for person_dir in output_path.iterdir():
+            if person_dir.is_dir() and person_dir.name not in person_photos:
+                leftovers = [f for f in person_dir.iterdir() if f.name not in ("index.html", "photos.js")]
+                if not leftovers:
+                    shutil.rmtree(person_dir)
                     
         print(f"Grouped photos for {len(person_photos)} people in {output_dir}")
         
         # Create an index.html file to make it easy to browse the photos
-        self._create_group_index_html(output_path, person_photos)
+        self._create_group_index_html(output_path, person_photos, max_workers=max_workers,
+                                      cancel_event=cancel_event, progress=progress)
         
-    def _create_group_index_html(self, output_dir, person_photos):
+    def _create_group_index_html(self, output_dir, person_photos, max_workers=None, cancel_event=None,
+                                 progress=None):
         """Create an HTML index for browsing grouped photos"""
         html_path = output_dir / "index.html"
         
+        # Thumbnails are shared by everyone who appears in a photo
+        thumbnail_store = ThumbnailStore(output_dir / THUMBNAIL_DIR, self.photo_reader)
+        all_photos = [photo_path for photos in person_photos.values() for photo_path in photos]
+        thumbnail_keys, stats = thumbnail_store.ensure(all_photos, max_workers=max_workers,
+                                                       cancel_event=cancel_event, progress=progress)
+        print(f"Thumbnails: {stats['created']} created, {stats['existing']} up to date, "
+              f"{stats['errors']} errors")
+        if cancel_event is not None and cancel_event.is_set():
+            print("Gallery not updated: grouping was cancelled.")
+            return
+        
+        # Only now is every photo still in the gallery known
+        removed = thumbnail_store.prune(thumbnail_keys.values())
+        if removed:
+            print(f"Thumbnails: {removed} outdated removed")
+        
         html_content = f"""<!DOCTYPE html>
 <html>
 <head>
@@ -675,6 +1468,12 @@ class FaceRecognitionExplorer:
             margin-top: 0;
             color: #2c3e50;
         }}
+        .person-card img {{
+            width: 100%;
+            height: 180px;
+            object-fit: cover;
+            border-radius: 3px;
+        }}
         .photo-count {{
             color: #7f8c8d;
             margin-bottom: 10px;
@@ -688,11 +1487,20 @@ class FaceRecognitionExplorer:
     <div class="person-grid">
 """
         
+        small = thumbnail_store.sizes[0]
         for name, photos in person_photos.items():
+            cover = ""
+            for photo_path in photos:
+                if photo_path in thumbnail_keys:
+                    key = thumbnail_keys[photo_path]
+                    cover = (f'<img src="{THUMBNAIL_DIR}/{key[:2]}/{key}_{small}.jpg" '
+                             f'alt="{html.escape(name)}" loading="lazy">')
+                    break
             html_content += f"""
-        <a href="{name}/">
+        <a href="{quote(name)}/index.html">
             <div class="person-card">
-                <h2>{name}</h2>
+                {cover}
+                <h2>{html.escape(name)}</h2>
                 <div class="photo-count">{len(photos)} photos</div>
             </div>
         </a>
@@ -711,23 +1519,52 @@ class FaceRecognitionExplorer:
         
         # Create individual person pages
         for name, photos in person_photos.items():
-            self._create_person_gallery(output_dir / name, name, photos)
+            self._create_person_gallery(output_dir / name, name, photos, thumbnail_keys,
+                                        thumbnail_store.sizes)
     
-    def _create_person_gallery(self, person_dir, name, photo_paths):
-        """Create an HTML gallery for a specific person"""
+    def _create_person_gallery(self, person_dir, name, photo_paths, thumbnail_keys, sizes,
+                               page_size=120):
+        """
+        Create a paginated HTML gallery for a specific person
+        
+        The page itself is static; the photo list lives in a compact JSON
+        index (photos.js) that the page renders one page at a time, with
+        lazily loaded thumbnails linking to the full-resolution photos.
+        """
+        person_dir.mkdir(parents=True, exist_ok=True)
+        
+        # One row per photo: [thumbnail key, full-resolution link, caption]
+        rows = [
+            [thumbnail_keys[photo_path], quote(output_name(photo_path)), photo_path]
+            for photo_path in photo_paths
+            if photo_path in thumbnail_keys
+        ]
+        index = {
+            'thumbs': f"../{THUMBNAIL_DIR}/",
+            'sizes': list(sizes),
+            'photos': rows,
+        }
+        # Loaded through a script tag so the gallery also works from file://
+        with open(person_dir / "photos.js", "w", encoding="utf-8") as f:
+            f.write("var GALLERY = ")
+            json.dump(index, f, separators=(',', ':'))
+            f.write(";\n")
+        
         html_path = person_dir / "index.html"
         
         html_content = f"""<!DOCTYPE html>
 <html>
 <head>
-    <title>Photos of {name}</title>
+    <title>Photos of {html.escape(name)}</title>
     <style>
         body {{ font-family: Arial, sans-serif; margin: 0; padding: 20px; }}
         h1 {{ color: #333; }}
         .back-link {{ margin-bottom: 20px; }}
+        .pager {{ margin: 15px 0; }}
+        .pager a {{ margin: 0 10px; }}
         .photo-grid {{ 
             display: grid;
-            grid-template-columns: repeat(auto-fill, minmax(300px, 1fr));
+            grid-template-columns: repeat(auto-fill, minmax(240px, 1fr));
             gap: 15px;
         }}
         .photo-card {{
@@ -737,12 +1574,15 @@ class FaceRecognitionExplorer:
         }}
         .photo-card img {{
             width: 100%;
-            height: auto;
+            height: 240px;
+            object-fit: cover;
             display: block;
         }}
         .photo-info {{
             padding: 10px;
             background-color: #f9f9f9;
+            font-size: 12px;
+            overflow-wrap: anywhere;
         }}
     </style>
 </head>
@@ -750,30 +1590,70 @@ class FaceRecognitionExplorer:
     <div class="back-link">
         <a href="../index.html">← Back to all people</a>
     </div>
-    <h1>Photos of {name}</h1>
+    <h1>Photos of {html.escape(name)}</h1>
     
-    <div class="photo-grid">
-"""
+    <div class="pager"></div>
+    <div class="photo-grid" id="grid"></div>
+    <div class="pager"></div>
+    
+    <script src="photos.js"></script>
+    <script>
+        var PAGE_SIZE = {page_size};
         
-        # List all files in person directory
-        files = [f for f in person_dir.iterdir() if f.is_file() and f.suffix.lower() in ('.jpg', '.jpeg', '.png')]
+        function thumbUrl(key, size) {{
+            return GALLERY.thumbs + key.substring(0, 2) + "/" + key + "_" + size + ".jpg";
+        }}
         
-        for photo_file in files:
-            if photo_file.name == "index.html":
-                continue
-                
-            rel_path = photo_file.name
-            html_content += f"""
-        <div class="photo-card">
-            <img src="{rel_path}" alt="Photo of {name}">
-            <div class="photo-info">
-                {rel_path}
-            </div>
-        </div>
-"""
+        function currentPage(pageCount) {{
+            var match = /page=(\\d+)/.exec(window.location.hash);
+            var page = match ? parseInt(match[1], 10) : 1;
+            return Math.min(Math.max(page, 1), pageCount);
+        }}
         
-        html_content += """
-    </div>
+        function render() {{
+            var photos = GALLERY.photos;
+            var pageCount = Math.max(1, Math.ceil(photos.length / PAGE_SIZE));
+            var page = currentPage(pageCount);
+            var small = GALLERY.sizes[0];
+            var large = GALLERY.sizes[GALLERY.sizes.length - 1];
+            
+            var grid = document.getElementById("grid");
+            grid.innerHTML = "";
+            photos.slice((page - 1) * PAGE_SIZE, page * PAGE_SIZE).forEach(function (photo) {{
+                var card = document.createElement("div");
+                card.className = "photo-card";
+                var link = document.createElement("a");
+                link.href = photo[1];
+                var img = document.createElement("img");
+                img.loading = "lazy";
+                img.src = thumbUrl(photo[0], small);
+                img.srcset = thumbUrl(photo[0], small) + " " + small + "w, " +
+                             thumbUrl(photo[0], large) + " " + large + "w";
+                img.sizes = "(max-width: 600px) 100vw, 240px";
+                img.alt = photo[2];
+                link.appendChild(img);
+                card.appendChild(link);
+                var info = document.createElement("div");
+                info.className = "photo-info";
+                info.textContent = photo[2];
+                card.appendChild(info);
+                grid.appendChild(card);
+            }});
+            
+            var pagers = document.getElementsByClassName("pager");
+            for (var i = 0; i < pagers.length; i++) {{
+                var html = "";
+                if (page > 1) html += '<a href="#page=' + (page - 1) + '">← Previous</a>';
+                html += "Page " + page + " of " + pageCount + " (" + photos.length + " photos)";
+                if (page < pageCount) html += '<a href="#page=' + (page + 1) + '">Next →</a>';
+                pagers[i].innerHTML = html;
+            }}
+            window.scrollTo(0, 0);
+        }}
+        
+        window.addEventListener("hashchange", render);
+        render();
+    </script>
 </body>
 </html>
 """
@@ -784,11 +1664,23 @@ class FaceRecognitionExplorer:
 def main():
     parser = argparse.ArgumentParser(description='Face Recognition File Explorer')
     parser.add_argument('--photos_dir', type=str, required=True, help='Directory with photos')
+    parser.add_argument('--database', type=str, default='face_database.db', help='Face database file')
     parser.add_argument('--scan', action='store_true', help='Scan photos for faces')
     parser.add_argument('--force_rescan', action='store_true', help='Force rescan of already processed photos')
     parser.add_argument('--parallel', action='store_true', help='Use parallel processing for scanning')
     parser.add_argument('--model', type=str, choices=['hog', 'cnn'], default='hog', 
                        help='Face detection model (hog is faster, cnn is more accurate)')
+    parser.add_argument('--backend', type=str, choices=BACKENDS,
+                       help='Face detection and encoding backend (default: the one the database was scanned '
+                            'with, dlib for a new database); opencv runs YuNet and SFace through cv2.dnn')
+    parser.add_argument('--detector_model', type=str,
+                       help='YuNet ONNX model file for the opencv backend, which it implies '
+                            '(default: models/ next to this script)')
+    parser.add_argument('--recognizer_model', type=str,
+                       help='SFace ONNX model file for the opencv backend, which it implies '
+                            '(default: models/ next to this script)')
+    parser.add_argument('--backend_report', action='store_true',
+                       help='Compare the speed and accuracy of the backends on the photos labeled so far')
     parser.add_argument('--label', type=int, help='Label a face by index')
     parser.add_argument('--name', type=str, help='Name for labeling a face')
     parser.add_argument('--show', type=int, help='Show an unlabeled face by index')
@@ -797,16 +1689,213 @@ def main():
     parser.add_argument('--recognize', action='store_true', help='Recognize faces in photos')
     parser.add_argument('--create_search', action='store_true', help='Create Windows search files')
     parser.add_argument('--output_dir', type=str, help='Output directory for copied photos with search properties')
+    parser.add_argument('--sidecar_format', type=str, choices=SIDECAR_FORMATS, default='properties',
+                       help='Sidecars written by --create_search: Windows .properties, XMP, or both')
     parser.add_argument('--visualize', action='store_true', help='Create visualizations of recognized faces')
+    parser.add_argument('--max_dimension', type=int, default=1600,
+                       help='Longest side in pixels of images saved by --visualize')
     parser.add_argument('--export', action='store_true', help='Export face data to JSON')
+    parser.add_argument('--export_format', type=str, choices=EXPORT_FORMATS, default='json',
+                       help='json: one summary file; ndjson: one record per face, streamed; '
+                            'columnar: faces.csv + memory-mappable embeddings.npy')
+    parser.add_argument('--export_file', type=str,
+                       help='Export destination (a directory for the columnar format)')
     parser.add_argument('--group', action='store_true', help='Group photos by person name')
+    parser.add_argument('--query', type=str,
+                       help='List photos matching a query such as "Alice AND Bob AND NOT Carol"')
+    parser.add_argument('--since', type=str,
+                       help='Only photos taken on or after this date (YYYY, YYYY-MM or YYYY-MM-DD)')
+    parser.add_argument('--until', type=str,
+                       help='Only photos taken on or before this date (YYYY, YYYY-MM or YYYY-MM-DD)')
+    parser.add_argument('--index_dates', action='store_true',
+                       help='Read capture dates of photos scanned before dates were recorded')
+    parser.add_argument('--companions', type=str, help='List the people who appear most often with this person')
+    parser.add_argument('--export_graph', type=str,
+                       help='Export the co-occurrence graph to this file (.graphml or .json)')
+    parser.add_argument('--serve', action='store_true',
+                       help='Run a local gallery and query server over the face database')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Interface the server listens on')
+    parser.add_argument('--port', type=int, default=8765, help='Port the server listens on')
+    parser.add_argument('--match_mode', type=str, choices=MATCH_MODES, default='float32',
+                       help='How the server holds encodings for face search: exact float32, float16, '
+                            'or product-quantized codes re-ranked exactly')
+    parser.add_argument('--pq_bytes', type=int, default=16,
+                       help='Bytes per face in the pq match mode (must divide 128)')
+    parser.add_argument('--encoding_report', action='store_true',
+                       help='Compare memory and match agreement of the compact match modes')
+    parser.add_argument('--encoding_precision', type=str, choices=ENCODING_PRECISIONS,
+                       help='Convert the encodings stored in the database to this precision')
+    parser.add_argument('--output_mode', type=str, choices=OUTPUT_MODES, default='auto',
+                       help='How grouped or search photos are placed (auto tries reflink, then hardlink, then copy)')
+    parser.add_argument('--output_workers', type=int,
+                       help='Threads writing grouped photos or visualizations in parallel')
+    parser.add_argument('--stage_workers', type=str,
+                       help='Scan workers per pipeline stage, e.g. "read=2,decode=2,detect=8,encode=4"')
+    parser.add_argument('--memory_budget_mb', type=float, default=1024,
+                       help='Memory allowed for decoded images in flight while scanning')
+    parser.add_argument('--readers', type=int,
+                       help='Threads reading photo files ahead of the decoders (same as --stage_workers read=N)')
+    parser.add_argument('--read_ahead_mb', type=float, default=256,
+                       help='Raw photo bytes read ahead of the decoders while scanning')
+    parser.add_argument('--queue_size', type=int, default=8,
+                       help='Capacity of the queues between scan pipeline stages')
+    parser.add_argument('--adaptive', action='store_true',
+                       help='Scale scan workers with CPU load and memory pressure')
+    parser.add_argument('--min_workers', type=int, default=1, help='Fewest active workers in adaptive mode')
+    parser.add_argument('--max_workers', type=int, help='Most active workers in adaptive mode (default: CPU count)')
+    parser.add_argument('--min_free_mb', type=float, default=1024,
+                       help='Shed workers when available memory drops below this (adaptive mode)')
+    parser.add_argument('--pause_free_mb', type=float, default=512,
+                       help='Pause reading new photos when available memory drops below this (adaptive mode)')
+    parser.add_argument('--max_rss_mb', type=float,
+                       help='Shed workers and pause reading when this process uses more memory (adaptive mode)')
+    parser.add_argument('--quality_gate', action='store_true',
+                       help='Skip tiny, blurry and extreme-pose faces before encoding')
+    parser.add_argument('--min_face_size', type=int, default=40,
+                       help='Smallest face box side in pixels accepted by the quality gate')
+    parser.add_argument('--min_sharpness', type=float, default=50.0,
+                       help='Lowest Laplacian sharpness accepted by the quality gate')
+    parser.add_argument('--max_yaw', type=float, default=0.5,
+                       help='Largest head turn accepted by the quality gate (0 = frontal, 1 = profile)')
+    parser.add_argument('--dedup', action='store_true',
+                       help='Reuse face results for burst shots and other near-duplicate photos')
+    parser.add_argument('--dedup_distance', type=int, default=4,
+                       help='Largest perceptual hash distance in bits treated as a near-duplicate')
+    parser.add_argument('--hash_method', type=str, choices=['dhash', 'phash'], default='dhash',
+                       help='Perceptual hash used to find near-duplicates')
+    parser.add_argument('--tile_mp', type=float, default=TILE_THRESHOLD_MP,
+                       help='Detect faces in overlapping tiles in images with more megapixels than this (0 disables)')
+    parser.add_argument('--tile_size', type=int, default=TILE_SIZE,
+                       help='Side in pixels of a detection tile')
+    parser.add_argument('--scan_order', type=str, choices=SCAN_ORDERS, default='disk',
+                       help='disk reads fastest; priority scans a sample of every folder first, then '
+                            '--priority_folders, then the newest photos, starting big files early')
+    parser.add_argument('--sample_first', type=int, default=SAMPLE_FIRST,
+                       help='Photos in the stratified sample scanned first with --scan_order priority')
+    parser.add_argument('--priority_folders', type=str, nargs='+', default=[],
+                       help='Folders, relative to the photos directory, scanned first with --scan_order priority')
+    parser.add_argument('--preview', type=int, metavar='N',
+                       help='Scan a stratified random sample of N photos and estimate what a full scan will find '
+                            'and how long each profile takes')
+    parser.add_argument('--preview_profiles', type=str, nargs='+', choices=list(SCAN_PROFILES),
+                       help='Scan profiles timed by --preview (default: all)')
+    parser.add_argument('--preview_seed', type=int, help='Seed of the --preview sample, to repeat it')
+    parser.add_argument('--shards', type=int,
+                       help='Split the scan into this many shards, each scanned by its own process')
+    parser.add_argument('--shard_by', type=str, choices=SHARD_MODES, default='hash',
+                       help='hash spreads photos evenly; subtree keeps each folder in one shard')
+    parser.add_argument('--shard', type=int,
+                       help='Scan only this shard (1 to --shards) without merging, e.g. on another machine')
+    parser.add_argument('--shard_processes', type=int,
+                       help='Shards scanned at once (default: all of them)')
+    parser.add_argument('--merge_shards', action='store_true',
+                       help='Merge the shard databases next to the database into it')
+    parser.add_argument('--federated', action='store_true',
+                       help='Answer queries across the shard databases without merging them')
     
     args = parser.parse_args()
+    if args.shard is not None and not (args.shards and 1 <= args.shard <= args.shards):
+        parser.error('--shard must be between 1 and --shards')
+    if args.federated:
+        # Shard databases stay read-only until they are merged
+        writes = [flag for flag, given in (
+            ('--scan', args.scan), ('--merge_shards', args.merge_shards), ('--interactive', args.interactive),
+            ('--label', args.label is not None), ('--recognize', args.recognize),
+            ('--index_dates', args.index_dates), ('--encoding_precision', args.encoding_precision))
+            if given]
+        if writes:
+            parser.error(f"--federated is read-only and can't be combined with {', '.join(writes)}")
     
-    explorer = FaceRecognitionExplorer(args.photos_dir)
+    model_files = args.detector_model or args.recognizer_model
+    if model_files and args.backend == 'dlib':
+        parser.error('--detector_model and --recognizer_model are for the opencv backend')
+    
+    backend = None
+    if args.backend or model_files:
+        # Model files mean the opencv backend, even for a database that
+        # already records it and would otherwise load the default files
+        try:
+            backend = create_backend(args.backend or 'opencv', args.model, args.detector_model,
+                                     args.recognizer_model)
+        except FileNotFoundError as e:
+            print(e)
+            return
+    
+    if args.federated:
+        try:
+            store = FederatedStore.open(args.database)
+        except FileNotFoundError as e:
+            print(e)
+            return
+        explorer = FaceRecognitionExplorer(args.photos_dir, args.database, store=store, backend=backend)
+    else:
+        explorer = FaceRecognitionExplorer(args.photos_dir, args.database, backend=backend)
+    
+    if args.scan or args.recognize:
+        # Refuse before any work is done rather than halfway through
+        try:
+            explorer._use_backend(explorer.face_backend(args.model))
+        except (ValueError, FileNotFoundError) as e:
+            print(e)
+            return
+    
+    governor_options = None
+    if args.adaptive:
+        governor_options = {'min_workers': args.min_workers, 'max_workers': args.max_workers,
+                            'min_free_mb': args.min_free_mb, 'pause_free_mb': args.pause_free_mb,
+                            'max_rss_mb': args.max_rss_mb}
+    quality_gate_options = None
+    if args.quality_gate:
+        quality_gate_options = {'min_face_size': args.min_face_size, 'min_sharpness': args.min_sharpness,
+                                'max_yaw': args.max_yaw}
+    
+    def pipeline_options():
+        stage_workers = parse_stage_workers(args.stage_workers)
+        if args.readers:
+            stage_workers['read'] = max(1, args.readers)
+        return {
+            'stage_workers': stage_workers,
+            'memory_budget_mb': args.memory_budget_mb,
+            'read_ahead_mb': args.read_ahead_mb,
+            'queue_size': args.queue_size,
+            'dedup': args.dedup,
+            'dedup_distance': args.dedup_distance,
+            'hash_method': args.hash_method,
+            'tile_threshold_mp': args.tile_mp,
+            'tile_size': args.tile_size,
+        }
+    
+    def local_pipeline_options():
+        options = pipeline_options()
+        options['governor'] = ResourceGovernor(**governor_options) if governor_options else None
+        if quality_gate_options:
+            options['quality_gate'] = QualityGate(**quality_gate_options)
+        return options
+    
+    if args.preview:
+        explorer.preview_scan(args.preview, args.tolerance, args.preview_profiles, args.preview_seed,
+                              args.parallel, args.model, **local_pipeline_options())
     
     if args.scan:
-        explorer.scan_photos(args.force_rescan, args.parallel, args.model)
+        schedule = None
+        if args.scan_order == 'priority':
+            schedule = ScanSchedule(args.sample_first, args.priority_folders)
+        if args.shards:
+            # Shard processes build their own governor and quality gate
+            shard_options = dict(pipeline_options(), parallel=args.parallel, model=args.model,
+                                 force_rescan=args.force_rescan, governor=governor_options,
+                                 quality_gate=quality_gate_options, schedule=schedule, backend=backend)
+            if args.shard:
+                scan_shard(args.photos_dir, explorer.database_file, args.shard - 1, args.shards,
+                           args.shard_by, **shard_options)
+            else:
+                explorer.scan_sharded(args.shards, args.shard_by, args.shard_processes, **shard_options)
+        else:
+            explorer.scan_photos(args.force_rescan, args.parallel, args.model, schedule=schedule,
+                                 **local_pipeline_options())
+    
+    if args.merge_shards:
+        explorer.merge_shards()
     
     if args.show is not None:
         explorer.show_unlabeled_face(args.show)
@@ -819,21 +1908,75 @@ def main():
             print(f"Face #{args.label} labeled as '{args.name}'")
     
     if args.recognize:
-        explorer.recognize_faces()
+        explorer.recognize_faces(args.tolerance, args.model, **local_pipeline_options())
     
     if args.create_search:
-        explorer.create_windows_search_files(args.output_dir)
+        explorer.create_windows_search_files(args.output_dir, formats=args.sidecar_format,
+                                             mode=args.output_mode, max_workers=args.output_workers)
         
     if args.group:
         output_dir = args.output_dir or os.path.join(str(explorer.photos_dir), "grouped")
-        explorer.group_photos_by_person(output_dir)
+        explorer.group_photos_by_person(output_dir, mode=args.output_mode, max_workers=args.output_workers)
         
     if args.visualize:
         output_dir = args.output_dir or "visualizations"
-        explorer.visualize_faces(output_dir)
+        explorer.visualize_faces(output_dir, max_dimension=args.max_dimension,
+                                 max_workers=args.output_workers)
+        
+    if args.index_dates:
+        explorer.index_photo_dates()
+        
+    if args.encoding_precision:
+        explorer.set_encoding_precision(args.encoding_precision)
+        
+    if args.encoding_report:
+        explorer.encoding_report(tolerance=args.tolerance, pq_bytes=args.pq_bytes)
+        
+    if args.backend_report:
+        backends = [DlibBackend(args.model)]
+        try:
+            backends.append(OpenCVBackend(args.detector_model, args.recognizer_model))
+        except FileNotFoundError as e:
+            print(f"Leaving out the opencv backend: {e}")
+        explorer.backend_report(backends, tolerance=args.tolerance)
         
     if args.export:
-        explorer.export_face_data()
+        try:
+            if args.export_format == 'json':
+                explorer.export_face_data(args.export_file or 'face_data.json',
+                                          since=args.since, until=args.until)
+            else:
+                default_file = 'face_export' if args.export_format == 'columnar' else 'faces.ndjson.gz'
+                explorer.export_face_records(args.export_file or default_file, args.export_format,
+                                             since=args.since, until=args.until)
+        except (ValueError, RuntimeError) as e:
+            print(f"Export failed: {e}")
+        
+    if args.query or ((args.since or args.until) and not args.export):
+        try:
+            unknown = [name for name in query_names(parse_query(args.query))
+                       if not explorer.person_index.count(name)] if args.query else []
+            for name in unknown:
+                print(f"Warning: nobody named '{name}' has been recognized")
+            for photo_path in explorer.query_photos(args.query, args.since, args.until):
+                print(photo_path)
+        except ValueError as e:
+            print(f"Invalid query: {e}")
+            
+    if args.companions:
+        companions = explorer.top_companions(args.companions)
+        if not companions:
+            print(f"Nobody has been recognized together with '{args.companions}'")
+        for name, count in companions:
+            print(f"{name}: {count} photos")
+            
+    if args.export_graph:
+        explorer.export_cooccurrence(args.export_graph)
+        
+    if args.serve:
+        from gallery_server import GalleryServer
+        GalleryServer(explorer, host=args.host, port=args.port, match_mode=args.match_mode,
+                      pq_bytes=args.pq_bytes).run()
 
 if __name__ == "__main__":
     main()
@@ -1,16 +1,23 @@
 import os
+import re
 import tkinter as tk
-from tkinter import filedialog, messagebox, simpledialog
+from tkinter import filedialog, messagebox, simpledialog, ttk
 import subprocess
-import threading
 import sys
+import threading
+import time
 import webbrowser
 from pathlib import Path
 import cv2
+from job_scheduler import JobScheduler
 
 # Import the FaceRecognitionExplorer class directly for better integration
 try:
     from face_recognition_explorer import FaceRecognitionExplorer
+    from resource_governor import ResourceGovernor
+    from face_quality import QualityGate
+    from scan_schedule import ScanSchedule
+    from face_review import FaceReviewWindow, ReviewSession
     DIRECT_IMPORT_SUCCESS = True
 except ImportError:
     # Fallback to subprocess if import fails
@@ -18,6 +25,14 @@ except ImportError:
     print("Warning: Could not directly import FaceRecognitionExplorer class.")
     print("Will use subprocess method instead.")
 
+from gallery_client import GalleryClient
+
+# How often the Tk main loop drains progress events from background jobs
+FRAME_INTERVAL_MS = 100
+
+# Progress lines printed by face_recognition_explorer.py
+PROGRESS_LINE = re.compile(r"Processing image (\d+)/(\d+)")
+
 class FaceRecognizerApp:
     def __init__(self, master):
         self.master = master
@@ -32,8 +47,17 @@ class FaceRecognizerApp:
         # Create an instance of the FaceRecognitionExplorer if available
         self.explorer = None
         
+        # A running gallery server (--serve) is used before anything else
+        server_url = os.environ.get("FACE_EXPLORER_SERVER", "http://127.0.0.1:8765")
+        self.server = GalleryClient(server_url)
+        
+        # Long-running work runs one job at a time in the background
+        self.scheduler = JobScheduler()
+        self.job_callbacks = {}
+        
         # Set up the UI
         self.setup_ui()
+        self.master.after(FRAME_INTERVAL_MS, self.poll_events)
     
     def create_explorer_instance(self):
         """Create or update the FaceRecognitionExplorer instance"""
@@ -111,6 +135,26 @@ class FaceRecognizerApp:
         tk.Checkbutton(options_frame, text="Use parallel processing (faster but uses more memory)", 
                       variable=self.parallel_var, bg="#f5f5f5").pack(anchor=tk.W, pady=5)
         
+        # Adaptive worker count
+        self.adaptive_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(options_frame, text="Adapt number of workers to CPU load and free memory", 
+                      variable=self.adaptive_var, bg="#f5f5f5").pack(anchor=tk.W, pady=5)
+        
+        # Face quality gate
+        self.quality_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(options_frame, text="Skip tiny, blurry and turned-away faces", 
+                      variable=self.quality_var, bg="#f5f5f5").pack(anchor=tk.W, pady=5)
+        
+        # Near-duplicate collapsing
+        self.dedup_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(options_frame, text="Reuse results for burst shots and near-duplicate photos", 
+                      variable=self.dedup_var, bg="#f5f5f5").pack(anchor=tk.W, pady=5)
+        
+        # Scan order
+        self.priority_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(options_frame, text="Scan a sample of every folder first, then the newest photos", 
+                      variable=self.priority_var, bg="#f5f5f5").pack(anchor=tk.W, pady=5)
+        
         # Force rescan
         self.rescan_var = tk.BooleanVar(value=False)
         tk.Checkbutton(options_frame, text="Force rescan of already processed photos", 
@@ -158,6 +202,54 @@ class FaceRecognizerApp:
         self.status_var.set("Ready")
         status_bar = tk.Label(main_frame, textvariable=self.status_var, bd=1, relief=tk.SUNKEN, anchor=tk.W)
         status_bar.pack(side=tk.BOTTOM, fill=tk.X)
+        
+        # Progress of the running job, with a way to stop it
+        progress_frame = tk.Frame(main_frame, bg="#f5f5f5")
+        progress_frame.pack(side=tk.BOTTOM, fill=tk.X, pady=(0, 5))
+        
+        self.progress_bar = ttk.Progressbar(progress_frame, orient=tk.HORIZONTAL, mode="determinate")
+        self.progress_bar.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        
+        self.queue_var = tk.StringVar()
+        tk.Label(progress_frame, textvariable=self.queue_var, bg="#f5f5f5", fg="#666666").pack(side=tk.LEFT, padx=10)
+        
+        tk.Button(progress_frame, text="Cancel", command=self.cancel_jobs).pack(side=tk.RIGHT)
+    
+    def submit_job(self, name, func, callback=None):
+        """Queue background work; callback runs on the Tk thread if it completes"""
+        job = self.scheduler.submit(name, func)
+        if callback:
+            self.job_callbacks[job] = callback
+        return job
+    
+    def cancel_jobs(self):
+        """Cancel the running job and any queued behind it"""
+        if self.scheduler.current is None and not self.scheduler.pending():
+            return
+        self.scheduler.cancel_all()
+        self.status_var.set("Cancelling...")
+    
+    def poll_events(self):
+        """Apply progress from background jobs; runs on the Tk thread every frame"""
+        events = self.scheduler.drain()
+        
+        # Only the newest status is worth drawing
+        for event in events:
+            if event.kind == 'progress' and event.total:
+                self.progress_bar.configure(maximum=event.total, value=event.done)
+            elif event.kind == 'started':
+                self.progress_bar.configure(value=0)
+            elif event.kind in ('completed', 'cancelled', 'failed'):
+                self.progress_bar.configure(value=0)
+                callback = self.job_callbacks.pop(event.job, None)
+                if callback and event.kind == 'completed':
+                    callback()
+        if events:
+            self.status_var.set(events[-1].describe())
+        
+        pending = len(self.scheduler.pending())
+        self.queue_var.set(f"{pending} queued" if pending else "")
+        self.master.after(FRAME_INTERVAL_MS, self.poll_events)
     
     def browse_photos_dir(self):
         directory = filedialog.askdirectory(title="Select Photos Directory")
@@ -191,6 +283,94 @@ class FaceRecognizerApp:
         
         return True
     
+    def server_job_for(self, command):
+        """Translate command-line arguments into a server job, if there is one"""
+        if "--scan" in command:
+            return "scan", {
+                "model": self.model_var.get(),
+                "parallel": self.parallel_var.get(),
+                "force_rescan": self.rescan_var.get(),
+            }
+        if "--recognize" in command:
+            return "recognize", {
+                "tolerance": float(self.tolerance_var.get()),
+                "model": self.model_var.get(),
+                "parallel": self.parallel_var.get(),
+            }
+        if "--group" in command:
+            output_dir = self.output_dir_var.get() or os.path.join(self.photos_dir_var.get(), "grouped")
+            return "group", {"output_dir": os.path.abspath(output_dir)}
+        # Interactive labeling needs local windows, so it can't run on the server
+        return None
+    
+    def run_server_job(self, job, kind, params):
+        """Run a job on the warm gallery server and follow it until it finishes"""
+        self.server.start_job(kind, **params)
+        job.message(f"Running {kind} on the gallery server...")
+        
+        while True:
+            state = self.server.job()
+            if state is None or state["state"] != "running":
+                break
+            if job.cancelled:
+                try:
+                    self.server.cancel_job()
+                except Exception:
+                    pass
+            job.progress(state.get("done", 0), state.get("total", 0))
+            time.sleep(0.5)
+        
+        if state and state["state"] == "failed":
+            raise RuntimeError(f"{kind} failed on the gallery server: {state.get('error')}")
+    
+    def probe_server(self, photos_dir, on_result):
+        """
+        Ask the gallery server whether it serves a photos directory, without blocking
+        
+        An unreachable server takes the client's whole timeout to give up on,
+        so the request runs on its own thread, polled from the Tk main loop
+        like job progress. on_result(serves) is called on the Tk thread.
+        """
+        result = []
+        thread = threading.Thread(target=lambda: result.append(self.server.serves(photos_dir)),
+                                  name="server-probe", daemon=True)
+        thread.start()
+        
+        def check():
+            if thread.is_alive():
+                self.master.after(FRAME_INTERVAL_MS, check)
+            else:
+                on_result(bool(result and result[0]))
+        
+        self.master.after(FRAME_INTERVAL_MS, check)
+    
+    def submit_server_job(self, command, fallback, callback=None):
+        """
+        Send a job to a warm gallery server for this photos directory
+        
+        Tried before both the in-process and the subprocess path, since a
+        running server already has the database and models loaded.
+        
+        Args:
+            command (list): Command-line arguments of the job
+            fallback (callable): Runs the job here when no server takes it
+            callback (callable): Called on the Tk thread when the server job completes
+        """
+        photos_dir = self.photos_dir_var.get()
+        server_job = self.server_job_for(command)
+        if not server_job or not os.path.isdir(photos_dir):
+            fallback()
+            return
+        kind, params = server_job
+        
+        def on_result(serves):
+            if not serves:
+                fallback()
+                return
+            self.submit_job(kind.capitalize(), lambda job: self.run_server_job(job, kind, params), callback)
+        
+        self.probe_server(photos_dir, on_result)
+    
     def run_command(self, command, callback=None):
         if not self.validate_inputs():
             return
@@ -212,12 +392,9 @@ class FaceRecognizerApp:
         if output_dir:
             cmd.extend(["--output_dir", output_dir])
         
-        # Update status
-        self.status_var.set(f"Running: {' '.join(cmd)}")
-        self.master.update()
-        
         # Run the process
-        def run_process():
+        def run_process(job):
+            job.message(f"Running: {' '.join(cmd)}")
             process = subprocess.Popen(
                 cmd, 
                 stdout=subprocess.PIPE, 
@@ -230,51 +407,43 @@ class FaceRecognizerApp:
             # Read output in real-time
             for line in iter(process.stdout.readline, ''):
                 print(line, end='')  # Print to console
-                self.status_var.set(line.strip())
-                self.master.update_idletasks()
+                if job.cancelled and process.poll() is None:
+                    process.terminate()
+                match = PROGRESS_LINE.search(line)
+                if match:
+                    job.progress(int(match.group(1)), int(match.group(2)))
+                else:
+                    job.message(line.strip())
             
             process.stdout.close()
             return_code = process.wait()
             
-            if return_code == 0:
-                self.status_var.set("Command completed successfully")
-            else:
-                self.status_var.set(f"Command failed with return code {return_code}")
-            
-            if callback:
-                callback()
+            if return_code != 0 and not job.cancelled:
+                raise RuntimeError(f"Command failed with return code {return_code}")
         
-        # Run in a separate thread to not block the GUI
-        thread = threading.Thread(target=run_process)
-        thread.daemon = True
-        thread.start()
+        self.submit_job(command[0].lstrip("-").capitalize(), run_process, callback)
     
     def scan_photos(self):
+        self.submit_server_job(["--scan"], self.scan_photos_locally)
+    
+    def scan_photos_locally(self):
         if self.create_explorer_instance():
-            try:
-                # Direct integration mode
-                self.status_var.set("Scanning photos for faces...")
-                self.master.update()
-                
-                model = self.model_var.get()
-                parallel = self.parallel_var.get()
-                force_rescan = self.rescan_var.get()
-                
-                # Run in a separate thread to avoid freezing the UI
-                def run_scan():
-                    try:
-                        self.explorer.scan_photos(force_rescan=force_rescan, parallel=parallel, model=model)
-                        self.status_var.set("Scan completed successfully")
-                    except Exception as e:
-                        self.status_var.set(f"Error during scan: {e}")
-                
-                thread = threading.Thread(target=run_scan)
-                thread.daemon = True
-                thread.start()
-            except Exception as e:
-                self.status_var.set(f"Error: {e}")
-                # Fallback to subprocess
-                self.use_subprocess_scan()
+            model = self.model_var.get()
+            parallel = self.parallel_var.get()
+            force_rescan = self.rescan_var.get()
+            governor = ResourceGovernor() if self.adaptive_var.get() else None
+            quality_gate = QualityGate() if self.quality_var.get() else None
+            dedup = self.dedup_var.get()
+            schedule = ScanSchedule() if self.priority_var.get() else None
+            
+            # Direct integration mode
+            def run_scan(job):
+                self.explorer.scan_photos(force_rescan=force_rescan, parallel=parallel, model=model,
+                                          governor=governor, quality_gate=quality_gate, dedup=dedup,
+                                          schedule=schedule, progress=job.progress,
+                                          cancel_event=job.cancel_event)
+            
+            self.submit_job("Scan", run_scan)
         else:
             # Use subprocess method
             self.use_subprocess_scan()
@@ -287,6 +456,14 @@ class FaceRecognizerApp:
         command = ["--scan", "--model", model]
         if parallel:
             command.append(parallel)
+        if self.adaptive_var.get():
+            command.append("--adaptive")
+        if self.quality_var.get():
+            command.append("--quality_gate")
+        if self.dedup_var.get():
+            command.append("--dedup")
+        if self.priority_var.get():
+            command.extend(["--scan_order", "priority"])
         if force_rescan:
             command.append(force_rescan)
         
@@ -294,92 +471,76 @@ class FaceRecognizerApp:
     
     def interactive_labeling(self):
         if self.create_explorer_instance():
-            try:
-                # Direct integration mode
-                self.status_var.set("Starting interactive face labeling...")
-                self.master.update()
-                
-                tolerance = float(self.tolerance_var.get())
-                
-                # Run in a separate thread
-                def run_labeling():
-                    try:
-                        self.explorer.interactive_labeling(tolerance=tolerance)
-                        self.status_var.set("Interactive labeling completed")
-                    except Exception as e:
-                        self.status_var.set(f"Error during labeling: {e}")
-                
-                thread = threading.Thread(target=run_labeling)
-                thread.daemon = True
-                thread.start()
-            except Exception as e:
-                self.status_var.set(f"Error: {e}")
-                # Fallback to subprocess
-                tolerance = self.tolerance_var.get()
-                command = ["--interactive", "--tolerance", str(tolerance)]
-                self.run_command(command)
+            tolerance = float(self.tolerance_var.get())
+            
+            # Direct integration mode: cluster in the background, review in-app
+            result = {}
+            
+            def run_clustering(job):
+                result['faces'] = self.explorer.store.unlabeled_faces()
+                result['clusters'] = self.explorer.cluster_faces(tolerance, faces=result['faces'])
+            
+            def open_review():
+                if not result['clusters']:
+                    messagebox.showinfo("Label Faces", "No unlabeled faces found. Run scan first.")
+                    return
+                session = ReviewSession(result['faces'], result['clusters'], tolerance)
+                FaceReviewWindow(self.master, session, self.explorer.face_crops, self.commit_labels)
+            
+            self.submit_job("Clustering", run_clustering, open_review)
         else:
             # Use subprocess method
             tolerance = self.tolerance_var.get()
             command = ["--interactive", "--tolerance", str(tolerance)]
             self.run_command(command)
     
+    def commit_labels(self, batch):
+        """Save labels from the review window without blocking it"""
+        def run_commit(job):
+            labeled = self.explorer.label_faces(batch)
+            job.message(f"Saved {labeled} labeled faces")
+        
+        self.submit_job("Saving labels", run_commit)
+    
     def recognize_faces(self):
+        self.submit_server_job(["--recognize"], self.recognize_faces_locally)
+    
+    def recognize_faces_locally(self):
         if self.create_explorer_instance():
-            try:
-                # Direct integration mode
-                self.status_var.set("Recognizing faces in photos...")
-                self.master.update()
-                
-                # Run in a separate thread
-                def run_recognition():
-                    try:
-                        self.explorer.recognize_faces()
-                        self.status_var.set("Recognition completed successfully")
-                    except Exception as e:
-                        self.status_var.set(f"Error during recognition: {e}")
-                
-                thread = threading.Thread(target=run_recognition)
-                thread.daemon = True
-                thread.start()
-            except Exception as e:
-                self.status_var.set(f"Error: {e}")
-                # Fallback to subprocess
-                command = ["--recognize"]
-                self.run_command(command)
+            tolerance = float(self.tolerance_var.get())
+            model = self.model_var.get()
+            parallel = self.parallel_var.get()
+            governor = ResourceGovernor() if self.adaptive_var.get() else None
+            quality_gate = QualityGate() if self.quality_var.get() else None
+            dedup = self.dedup_var.get()
+            
+            # Direct integration mode
+            def run_recognition(job):
+                self.explorer.recognize_faces(tolerance=tolerance, model=model, parallel=parallel,
+                                              governor=governor, quality_gate=quality_gate, dedup=dedup,
+                                              progress=job.progress, cancel_event=job.cancel_event)
+            
+            self.submit_job("Recognition", run_recognition)
         else:
             # Use subprocess method
             command = ["--recognize"]
             self.run_command(command)
     
     def group_photos(self):
+        self.submit_server_job(["--group"], self.group_photos_locally, self.check_gallery)
+    
+    def group_photos_locally(self):
         if self.create_explorer_instance():
-            try:
-                # Direct integration mode
-                output_dir = self.output_dir_var.get()
-                if not output_dir:
-                    output_dir = os.path.join(str(self.explorer.photos_dir), "grouped")
-                
-                self.status_var.set(f"Grouping photos by person in {output_dir}...")
-                self.master.update()
-                
-                # Run in a separate thread
-                def run_grouping():
-                    try:
-                        self.explorer.group_photos_by_person(output_dir)
-                        self.status_var.set("Grouping completed successfully")
-                        self.check_gallery()
-                    except Exception as e:
-                        self.status_var.set(f"Error during grouping: {e}")
-                
-                thread = threading.Thread(target=run_grouping)
-                thread.daemon = True
-                thread.start()
-            except Exception as e:
-                self.status_var.set(f"Error: {e}")
-                # Fallback to subprocess
-                command = ["--group"]
-                self.run_command(command, self.check_gallery)
+            output_dir = self.output_dir_var.get()
+            if not output_dir:
+                output_dir = os.path.join(str(self.explorer.photos_dir), "grouped")
+            
+            # Direct integration mode
+            def run_grouping(job):
+                self.explorer.group_photos_by_person(output_dir, cancel_event=job.cancel_event,
+                                                     progress=job.progress)
+            
+            self.submit_job("Grouping", run_grouping, self.check_gallery)
         else:
             # Use subprocess method
             command = ["--group"]
@@ -399,6 +560,14 @@ class FaceRecognizerApp:
     
     def browse_gallery(self):
         """Open the generated gallery in the default web browser"""
+        self.probe_server(self.photos_dir_var.get(), self.open_gallery)
+    
+    def open_gallery(self, served):
+        """Open the server's gallery if it is serving these photos, else the static one"""
+        if served:
+            webbrowser.open(self.server.url + "/")
+            return
+        
         output_dir = self.output_dir_var.get()
         if not output_dir:
             output_dir = os.path.join(self.photos_dir_var.get(), "grouped")
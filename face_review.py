@@ -0,0 +1,481 @@
+"""
+Face review grid for the Face Recognition GUI
+
+Clusters of unlabeled faces are shown as a scrollable grid of tiles inside
+the app, replacing the one-cluster-at-a-time OpenCV windows. Only the tiles
+on screen are drawn. Their face crops come from a FaceCropCache and are
+loaded on background threads. Labels are collected in batches and committed
+to the database in the background while reviewing carries on.
+
+Keys:
+    Arrows          Move between clusters (Shift extends the selection)
+    Space           Add or remove the current cluster from the selection
+    Enter / n       Type a name for the selected clusters
+    1-9             Reuse one of the most recent names
+    m               Merge the selected clusters into one
+    x               Split the selected clusters at a stricter tolerance
+    s / Delete      Skip the selected clusters for this session
+    Escape          Clear the selection
+"""
+
+import collections
+import concurrent.futures
+import queue
+import tkinter as tk
+
+from PIL import ImageTk
+from sklearn.cluster import DBSCAN
+
+from face_crops import CROP_SIZE
+
+# Faces shown on each tile, as a square grid
+TILE_FACES = 4
+TILE_PAD = 6
+TILE_TEXT = 18
+
+# Split re-clusters a cluster at this fraction of the session's tolerance
+SPLIT_FACTOR = 0.75
+
+# Names kept for the 1-9 shortcuts
+RECENT_NAMES = 9
+
+# Face crops kept in memory as Tk images
+IMAGE_CACHE_SIZE = 2000
+
+# How often loaded crops are picked up and labels committed
+POLL_INTERVAL_MS = 50
+COMMIT_INTERVAL_MS = 1500
+
+
+class ReviewSession:
+    """Clusters under review and the labels given to them, without any GUI"""
+
+    def __init__(self, faces, clusters, tolerance=0.6):
+        """
+        Args:
+            faces (list): Snapshot of store.unlabeled_faces()
+            clusters (list): Lists of indices into faces, largest first
+            tolerance (float): Tolerance the clusters were made with
+        """
+        self.faces = faces
+        self.clusters = [list(cluster) for cluster in clusters if cluster]
+        self.tolerance = tolerance
+        self.recent_names = []
+        self.pending = []  # (face, name) pairs not yet committed
+        self.labeled = 0
+
+    def label(self, positions, name):
+        """Label every face in the clusters at positions and take them off the grid"""
+        for position in sorted(set(positions), reverse=True):
+            for idx in self.clusters.pop(position):
+                self.pending.append((self.faces[idx], name))
+                self.labeled += 1
+        if name in self.recent_names:
+            self.recent_names.remove(name)
+        self.recent_names.insert(0, name)
+        del self.recent_names[RECENT_NAMES:]
+
+    def skip(self, positions):
+        """Take clusters off the grid without labeling them"""
+        for position in sorted(set(positions), reverse=True):
+            del self.clusters[position]
+
+    def merge(self, positions):
+        """
+        Merge clusters into one, placed where the first of them was
+
+        Returns:
+            int: Position of the merged cluster
+        """
+        positions = sorted(set(positions))
+        merged = [idx for position in positions for idx in self.clusters[position]]
+        for position in reversed(positions):
+            del self.clusters[position]
+        self.clusters.insert(positions[0], merged)
+        return positions[0]
+
+    def _split_cluster(self, cluster):
+        if len(cluster) < 2:
+            return [cluster]
+        encodings = [self.faces[idx][2] for idx in cluster]
+        labels = DBSCAN(metric="euclidean", eps=self.tolerance * SPLIT_FACTOR,
+                        min_samples=1).fit(encodings).labels_
+        parts = collections.defaultdict(list)
+        for idx, label in zip(cluster, labels):
+            parts[label].append(idx)
+        if len(parts) == 1:
+            # Already tight at the stricter tolerance: one face per cluster
+            return [[idx] for idx in cluster]
+        return sorted(parts.values(), key=len, reverse=True)
+
+    def split(self, positions):
+        """
+        Split clusters into tighter ones, in place
+
+        Returns:
+            list: Positions of the resulting clusters
+        """
+        result = []
+        offset = 0
+        for position in sorted(set(positions)):
+            position += offset
+            parts = self._split_cluster(self.clusters[position])
+            self.clusters[position:position + 1] = parts
+            result.extend(range(position, position + len(parts)))
+            offset += len(parts) - 1
+        return result
+
+    def take_pending(self):
+        """Labels given since the last call, ready to commit"""
+        batch, self.pending = self.pending, []
+        return batch
+
+
+class FaceReviewWindow(tk.Toplevel):
+    """Virtualized grid of face clusters with keyboard labeling"""
+
+    def __init__(self, master, session, crops, commit, max_workers=4):
+        """
+        Args:
+            master (tk.Widget): Parent window
+            session (ReviewSession): Clusters to review
+            crops (FaceCropCache): Source of face crops
+            commit (callable): Called on the Tk thread as commit(batch) with
+                (face, name) pairs; should save them in the background
+            max_workers (int): Threads loading face crops
+        """
+        super().__init__(master)
+        self.title("Review Faces")
+        self.geometry("900x700")
+
+        self.session = session
+        self.crops = crops
+        self.commit = commit
+        self.focus_position = 0
+        self.selected = set()
+        self.anchor = 0
+
+        self.grid_side = max(1, int(TILE_FACES ** 0.5))
+        self.tile_width = self.grid_side * CROP_SIZE + 2 * TILE_PAD
+        self.tile_height = self.tile_width + TILE_TEXT
+        self.columns = 1
+
+        # Crops are loaded off the Tk thread and turned into Tk images on it
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self.loaded = queue.Queue()
+        self.images = collections.OrderedDict()  # face index -> PhotoImage
+        self.requested = set()
+        self.wanted = set()
+        self._redraw_pending = False
+        self._closed = False
+
+        self.setup_ui()
+        self.protocol("WM_DELETE_WINDOW", self.close)
+        self.after(POLL_INTERVAL_MS, self.poll_loaded)
+        self.after(COMMIT_INTERVAL_MS, self.commit_tick)
+        self.canvas.focus_set()
+
+    def setup_ui(self):
+        self.info_var = tk.StringVar()
+        tk.Label(self, textvariable=self.info_var, anchor=tk.W).pack(side=tk.TOP, fill=tk.X, padx=8, pady=4)
+
+        name_frame = tk.Frame(self)
+        name_frame.pack(side=tk.BOTTOM, fill=tk.X, padx=8, pady=6)
+        tk.Label(name_frame, text="Name:").pack(side=tk.LEFT)
+        self.name_var = tk.StringVar()
+        self.name_entry = tk.Entry(name_frame, textvariable=self.name_var, width=30)
+        self.name_entry.pack(side=tk.LEFT, padx=5)
+        tk.Button(name_frame, text="Label", command=self.apply_name).pack(side=tk.LEFT)
+        tk.Label(name_frame, fg="#666666",
+                 text="Enter: name  1-9: recent  m: merge  x: split  s: skip  Space/Shift: select").pack(side=tk.RIGHT)
+
+        grid_frame = tk.Frame(self)
+        grid_frame.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+        self.canvas = tk.Canvas(grid_frame, bg="#ffffff", highlightthickness=0, takefocus=True,
+                                yscrollincrement=self.tile_height // 2)
+        scrollbar = tk.Scrollbar(grid_frame, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.canvas.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        self.canvas.bind("<Configure>", lambda e: self.schedule_redraw())
+        self.canvas.bind("<Button-1>", self._on_click)
+        self.canvas.bind("<MouseWheel>", lambda e: self._scroll(-1 if e.delta > 0 else 1))
+        self.canvas.bind("<Button-4>", lambda e: self._scroll(-1))
+        self.canvas.bind("<Button-5>", lambda e: self._scroll(1))
+        self.canvas.bind("<Key>", self._on_key)
+        self.name_entry.bind("<Return>", lambda e: self.apply_name())
+        self.name_entry.bind("<Escape>", lambda e: self.canvas.focus_set())
+
+    # Layout
+
+    def _rows(self):
+        return (len(self.session.clusters) + self.columns - 1) // self.columns
+
+    def _tile_origin(self, position):
+        row, col = divmod(position, self.columns)
+        return col * self.tile_width, row * self.tile_height
+
+    def _visible_positions(self):
+        top = self.canvas.canvasy(0)
+        bottom = top + self.canvas.winfo_height()
+        first_row = max(0, int(top // self.tile_height))
+        last_row = int(bottom // self.tile_height)
+        return range(first_row * self.columns,
+                     min(len(self.session.clusters), (last_row + 1) * self.columns))
+
+    def _on_scrollbar(self, *args):
+        self.canvas.yview(*args)
+        self.schedule_redraw()
+
+    def _scroll(self, rows):
+        self.canvas.yview_scroll(rows, "units")
+        self.schedule_redraw()
+
+    def _ensure_visible(self, position):
+        rows = self._rows()
+        if not rows:
+            return
+        _, y = self._tile_origin(position)
+        top = self.canvas.canvasy(0)
+        height = self.canvas.winfo_height()
+        total = rows * self.tile_height
+        if y < top:
+            self.canvas.yview_moveto(y / total)
+        elif y + self.tile_height > top + height:
+            self.canvas.yview_moveto((y + self.tile_height - height) / total)
+
+    # Drawing
+
+    def schedule_redraw(self):
+        """Redraw once the current burst of events has been handled"""
+        if not self._redraw_pending:
+            self._redraw_pending = True
+            self.after_idle(self.redraw)
+
+    def redraw(self):
+        """Draw only the tiles that are on screen"""
+        self._redraw_pending = False
+        if self._closed:
+            return
+        self.columns = max(1, self.canvas.winfo_width() // self.tile_width)
+        self.canvas.configure(scrollregion=(0, 0, self.columns * self.tile_width,
+                                            max(1, self._rows() * self.tile_height)))
+        self.canvas.delete("tile")
+
+        self.wanted = set()
+        for position in self._visible_positions():
+            self._draw_tile(position)
+
+        session = self.session
+        recent = "  ".join(f"{i}: {name}" for i, name in enumerate(session.recent_names, 1))
+        self.info_var.set(f"{len(session.clusters)} clusters left, {session.labeled} faces labeled"
+                          + (f"    Recent: {recent}" if recent else ""))
+
+    def _draw_tile(self, position):
+        cluster = self.session.clusters[position]
+        x, y = self._tile_origin(position)
+        if position == self.focus_position:
+            outline, width = "#1e88e5", 3
+        elif position in self.selected:
+            outline, width = "#43a047", 3
+        else:
+            outline, width = "#dddddd", 1
+        fill = "#e8f5e9" if position in self.selected else "#fafafa"
+        self.canvas.create_rectangle(x + 2, y + 2, x + self.tile_width - 2, y + self.tile_height - 2,
+                                     outline=outline, width=width, fill=fill, tags="tile")
+
+        shown = cluster[:TILE_FACES]
+        missing = []
+        for i, idx in enumerate(shown):
+            row, col = divmod(i, self.grid_side)
+            fx = x + TILE_PAD + col * CROP_SIZE
+            fy = y + TILE_PAD + row * CROP_SIZE
+            image = self.images.get(idx)
+            if image is not None:
+                self.images.move_to_end(idx)
+                self.canvas.create_image(fx, fy, image=image, anchor=tk.NW, tags="tile")
+            else:
+                self.canvas.create_rectangle(fx + 1, fy + 1, fx + CROP_SIZE - 1, fy + CROP_SIZE - 1,
+                                             fill="#eeeeee", outline="", tags="tile")
+                missing.append(idx)
+            self.wanted.add(idx)
+
+        count = len(cluster)
+        self.canvas.create_text(x + self.tile_width / 2, y + self.tile_height - TILE_TEXT / 2 - 2,
+                                text=f"{count} face{'s' if count != 1 else ''}", tags="tile")
+        if missing:
+            self._request(missing)
+
+    # Loading crops
+
+    def _request(self, indices):
+        indices = [idx for idx in indices if idx not in self.requested]
+        if not indices:
+            return
+        self.requested.update(indices)
+        self.executor.submit(self._load, indices)
+
+    def _load(self, indices):
+        """Worker thread: crop the faces that are still on screen"""
+        by_photo = collections.defaultdict(list)
+        for idx in indices:
+            if idx in self.wanted:
+                by_photo[self.session.faces[idx][1]].append(idx)
+            else:
+                self.loaded.put((idx, None))
+        for photo_path, photo_indices in by_photo.items():
+            try:
+                crops = self.crops.load(photo_path, [self.session.faces[idx][3] for idx in photo_indices])
+            except Exception as e:
+                print(f"Error loading faces from {photo_path}: {e}")
+                crops = [None] * len(photo_indices)
+            for idx, crop in zip(photo_indices, crops):
+                self.loaded.put((idx, crop))
+
+    def poll_loaded(self):
+        """Turn loaded crops into Tk images; runs on the Tk thread"""
+        if self._closed:
+            return
+        changed = False
+        while True:
+            try:
+                idx, crop = self.loaded.get_nowait()
+            except queue.Empty:
+                break
+            self.requested.discard(idx)
+            if crop is None:
+                continue
+            self.images[idx] = ImageTk.PhotoImage(crop)
+            changed = True
+        while len(self.images) > IMAGE_CACHE_SIZE:
+            self.images.popitem(last=False)
+        if changed:
+            self.schedule_redraw()
+        self.after(POLL_INTERVAL_MS, self.poll_loaded)
+
+    # Selection and actions
+
+    def _targets(self):
+        if self.selected:
+            return sorted(self.selected)
+        if self.focus_position < len(self.session.clusters):
+            return [self.focus_position]
+        return []
+
+    def _move_focus(self, position, extend=False):
+        if not self.session.clusters:
+            return
+        position = max(0, min(len(self.session.clusters) - 1, position))
+        if extend:
+            lo, hi = sorted((self.anchor, position))
+            self.selected = set(range(lo, hi + 1))
+        else:
+            self.anchor = position
+        self.focus_position = position
+        self._ensure_visible(position)
+        self.schedule_redraw()
+
+    def _after_change(self, focus=None, selected=()):
+        """Reset focus and selection after clusters were removed or rearranged"""
+        if focus is None:
+            focus = min(self.focus_position, len(self.session.clusters) - 1)
+        self.focus_position = max(0, focus)
+        self.anchor = self.focus_position
+        self.selected = set(selected)
+        self._ensure_visible(self.focus_position)
+        self.schedule_redraw()
+
+    def _on_click(self, event):
+        self.canvas.focus_set()
+        x, y = self.canvas.canvasx(event.x), self.canvas.canvasy(event.y)
+        col = int(x // self.tile_width)
+        if col >= self.columns:
+            return
+        position = int(y // self.tile_height) * self.columns + col
+        if position >= len(self.session.clusters):
+            return
+        if event.state & 0x0001:  # Shift
+            self._move_focus(position, extend=True)
+            return
+        if event.state & 0x0004:  # Control
+            self.selected ^= {position}
+        else:
+            self.selected = set()
+        self._move_focus(position)
+
+    def _on_key(self, event):
+        key = event.keysym
+        shift = bool(event.state & 0x0001)
+        moves = {"Left": -1, "Right": 1, "Up": -self.columns, "Down": self.columns,
+                 "Prior": -self.columns * 4, "Next": self.columns * 4}
+        if key in moves:
+            if not shift:
+                self.selected = set()
+            self._move_focus(self.focus_position + moves[key], extend=shift)
+        elif key == "Home":
+            self._move_focus(0)
+        elif key == "End":
+            self._move_focus(len(self.session.clusters) - 1)
+        elif key == "space":
+            self.selected ^= {self.focus_position}
+            self.schedule_redraw()
+        elif key in ("Return", "n"):
+            self.name_entry.focus_set()
+            self.name_entry.select_range(0, tk.END)
+        elif key.isdigit() and key != "0":
+            recent = self.session.recent_names
+            if int(key) <= len(recent):
+                self.label_targets(recent[int(key) - 1])
+        elif key == "m":
+            targets = self._targets()
+            if len(targets) > 1:
+                self._after_change(self.session.merge(targets))
+        elif key == "x":
+            targets = self._targets()
+            if targets:
+                parts = self.session.split(targets)
+                self._after_change(parts[0], parts)
+        elif key in ("s", "Delete"):
+            targets = self._targets()
+            if targets:
+                self.session.skip(targets)
+                self._after_change(targets[0])
+        elif key == "Escape":
+            self.selected = set()
+            self.schedule_redraw()
+
+    def label_targets(self, name):
+        """Label the selected clusters, or the current one, and move on"""
+        targets = self._targets()
+        if not targets or not name:
+            return
+        self.session.label(targets, name)
+        self._after_change(targets[0])
+
+    def apply_name(self):
+        name = self.name_var.get().strip()
+        if name:
+            self.label_targets(name)
+            self.name_var.set("")
+        self.canvas.focus_set()
+
+    # Committing
+
+    def commit_tick(self):
+        """Hand labels given since the last tick to the background committer"""
+        if self._closed:
+            return
+        self.flush()
+        self.after(COMMIT_INTERVAL_MS, self.commit_tick)
+
+    def flush(self):
+        batch = self.session.take_pending()
+        if batch:
+            self.commit(batch)
+
+    def close(self):
+        self._closed = True
+        self.flush()
+        self.executor.shutdown(wait=False)
+        self.destroy()
@@ -0,0 +1,428 @@
+"""
+Sharded scanning for Face Recognition File Explorer
+
+One scan process is limited to one machine's cores. A library can instead be
+split into a fixed number of shards, each scanned by its own process, or by
+another machine sharing the photos directory, into a shard database of its
+own. Every photo belongs to exactly one shard:
+
+- 'hash' spreads photos evenly by a hash of their path
+- 'subtree' keeps each folder together, which suits folders on different
+  disks and keeps reads of a folder sequential
+
+Members of an archive always go to the archive's shard, so each archive is
+read by one process only. Shard databases are merged into the main database
+afterwards, or queried together without merging through FederatedStore.
+"""
+
+import glob
+import os
+import re
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from face_store import FaceStore, SQLiteStore
+from photo_sources import split_archive_path
+from scan_pipeline import COMPUTE_STAGES, default_stage_workers
+
+SHARD_MODES = ('hash', 'subtree')
+
+# Photos merged per transaction, so other writers are never held up for long
+MERGE_BATCH = 500
+
+
+def shard_of(photo_path, shards, mode='hash'):
+    """
+    The shard a photo belongs to; the same on every machine and every run
+
+    Args:
+        photo_path (str): Photo key, relative to the photos directory
+        shards (int): Number of shards
+        mode (str): One of SHARD_MODES
+
+    Returns:
+        int: Shard number, from 0 to shards - 1
+    """
+    if mode not in SHARD_MODES:
+        raise ValueError(f"Unknown shard mode '{mode}' (expected one of {', '.join(SHARD_MODES)})")
+    archive, _ = split_archive_path(photo_path)
+    key = archive.replace(os.sep, '/')
+    if mode == 'subtree':
+        key = key.rpartition('/')[0]
+    return zlib.crc32(key.encode('utf-8')) % shards
+
+
+def shard_database_path(database_file, shard, shards):
+    """Database file of one shard, next to the main database"""
+    root, _ = os.path.splitext(str(database_file))
+    return f"{root}.shard-{shard + 1:02d}-of-{shards:02d}.db"
+
+
+def find_shard_databases(database_file):
+    """Shard databases present next to the main database, in shard order"""
+    root, _ = os.path.splitext(str(database_file))
+    pattern = re.compile(re.escape(os.path.basename(root)) + r'\.shard-\d+-of-\d+\.db$')
+    return sorted(path for path in glob.glob(glob.escape(root) + '.shard-*-of-*.db')
+                  if pattern.match(os.path.basename(path)))
+
+
+def scan_shard(photos_dir, database_file, shard, shards, mode='hash', force_rescan=False,
+               quality_gate=None, governor=None, **scan_options):
+    """
+    Scan the photos of one shard into its shard database
+
+    Runs in a worker process, or on another machine, so everything it is
+    given must be picklable: the quality gate and resource governor are
+    passed as their keyword arguments and built here.
+
+    Args:
+        photos_dir (str): Directory containing photos
+        database_file (str): Main database; photos already in it are skipped
+        shard (int): Shard to scan, from 0 to shards - 1
+        shards (int): Number of shards
+        mode (str): One of SHARD_MODES
+        force_rescan (bool): Rescan photos that already have faces
+        quality_gate (dict, optional): QualityGate arguments
+        governor (dict, optional): ResourceGovernor arguments
+        **scan_options: Passed on to FaceRecognitionExplorer.scan_photos,
+            including the backend, which is picklable
+
+    Returns:
+        dict: 'shard', 'path', 'photos', 'faces' and 'seconds'
+    """
+    # Imported here: the explorer imports this module
+    from face_quality import QualityGate
+    from face_recognition_explorer import FaceRecognitionExplorer
+    from resource_governor import ResourceGovernor
+
+    if not 0 <= shard < shards:
+        raise ValueError(f"Shard {shard} is outside 0-{shards - 1}")
+    skip = set()
+    settings = {}
+    if os.path.exists(database_file):
+        main = SQLiteStore(database_file)
+        if not force_rescan:
+            skip = main.scanned_photos()
+        for key in ('encoding_precision', 'encoding_backend'):
+            settings[key] = main.get_meta(key)
+        main.close()
+
+    path = shard_database_path(database_file, shard, shards)
+    explorer = FaceRecognitionExplorer(photos_dir, path)
+    for key, value in settings.items():
+        if value is not None:
+            explorer.store.set_meta(key, value)
+    faces_before = explorer.store.unlabeled_count()
+
+    if quality_gate is not None:
+        scan_options['quality_gate'] = QualityGate(**quality_gate)
+    if governor is not None:
+        scan_options['governor'] = ResourceGovernor(**governor)
+
+    def select(photo_path):
+        return shard_of(photo_path, shards, mode) == shard
+
+    start = time.perf_counter()
+    # Skipped photos are checked against the main database one by one:
+    # select only sees an archive's path, never its members
+    photos = explorer.scan_photos(force_rescan, select=select, skip=skip, **scan_options)
+    result = {'shard': shard, 'path': path, 'photos': photos,
+              'faces': explorer.store.unlabeled_count() - faces_before,
+              'seconds': time.perf_counter() - start}
+    explorer.store.close()
+    return result
+
+
+def share_workers(shard_options, processes):
+    """
+    Divide the compute workers of a scan between shard processes running at once
+
+    Each process would otherwise size its stages for the whole machine.
+    Read workers wait on the disk rather than the CPU and are left alone.
+
+    Args:
+        shard_options (dict): scan_shard options
+        processes (int): Shard processes running at the same time
+
+    Returns:
+        dict: The options with per-process 'stage_workers' and governor limit
+    """
+    options = dict(shard_options)
+    stage_workers = default_stage_workers()
+    stage_workers.update(options.get('stage_workers') or {})
+    for name in COMPUTE_STAGES:
+        stage_workers[name] = max(1, stage_workers[name] // processes)
+    options['stage_workers'] = stage_workers
+    if options.get('governor') is not None:
+        governor = dict(options['governor'])
+        max_workers = governor.get('max_workers') or os.cpu_count() or 1
+        governor['max_workers'] = max(1, max_workers // processes)
+        options['governor'] = governor
+    return options
+
+
+def run_sharded_scan(photos_dir, database_file, shards, mode='hash', processes=None, **shard_options):
+    """
+    Scan every shard in its own process
+
+    Args:
+        photos_dir (str): Directory containing photos
+        database_file (str): Main database
+        shards (int): Number of shards
+        mode (str): One of SHARD_MODES
+        processes (int, optional): Shards scanned at once (default: all)
+        **shard_options: Passed on to scan_shard
+
+    Returns:
+        list: scan_shard results of the shards that finished
+    """
+    processes = min(processes or shards, shards)
+    shard_options = share_workers(shard_options, processes)
+    results = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {executor.submit(scan_shard, str(photos_dir), str(database_file), shard, shards,
+                                   mode, **shard_options): shard
+                   for shard in range(shards)}
+        for future in as_completed(futures):
+            shard = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Shard {shard + 1}/{shards} failed: {e}")
+                continue
+            rate = result['photos'] / result['seconds'] if result['seconds'] else 0.0
+            print(f"Shard {shard + 1}/{shards}: {result['photos']} photos, {result['faces']} faces "
+                  f"in {result['seconds']:.1f}s ({rate:.1f} photos/s)")
+            results.append(result)
+
+    elapsed = time.perf_counter() - start
+    photos = sum(result['photos'] for result in results)
+    rate = photos / elapsed if elapsed else 0.0
+    print(f"Sharded scan: {photos} photos in {elapsed:.1f}s across {shards} shards ({rate:.1f} photos/s)")
+    return sorted(results, key=lambda result: result['shard'])
+
+
+def _remove_database(path):
+    for suffix in ('', '-wal', '-shm'):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def merge_shards(store, shard_files, remove=False):
+    """
+    Copy the faces of shard databases into the main database
+
+    Faces get new face IDs from the main database, so IDs stay unique. Each
+    photo's faces replace whatever the main database had for it, which
+    makes merging the same shard twice harmless. Shards scanned with another
+    backend than the main database are left out.
+
+    Args:
+        store (FaceStore): Main database
+        shard_files (list): Shard database files
+        remove (bool): Delete each shard database once it is merged
+
+    Returns:
+        dict: Numbers of 'photos', 'unlabeled' and 'reference' faces merged
+    """
+    counts = {'photos': 0, 'unlabeled': 0, 'reference': 0}
+    known = {(name, encoding.tobytes()) for name, encodings in store.reference_encodings().items()
+             for encoding in encodings}
+    for shard_file in shard_files:
+        shard = SQLiteStore(shard_file)
+        backend = shard.get_meta('encoding_backend')
+        main_backend = store.get_meta('encoding_backend')
+        if main_backend is None and (store.unlabeled_count() or store.reference_counts()):
+            # Databases from before backends were recorded hold dlib encodings
+            main_backend = 'dlib'
+        if backend is not None and main_backend is not None and backend != main_backend:
+            print(f"Skipping {shard_file}: its encodings come from the {backend} backend, "
+                  f"the database's from {main_backend}")
+            shard.close()
+            continue
+        if backend is not None and store.get_meta('encoding_backend') is None:
+            store.set_meta('encoding_backend', backend)
+
+        by_photo = {}
+        for _, photo_path, encoding, face_location in shard.unlabeled_faces():
+            by_photo.setdefault(photo_path, []).append((encoding, face_location))
+        photo_faces = dict(shard.iter_photo_faces())
+        metadata = shard.photo_metadata()
+        scanned = shard.scanned_photos()
+        photos = sorted(set(by_photo) | set(photo_faces) | set(metadata) | scanned)
+
+        for start in range(0, len(photos), MERGE_BATCH):
+            with store.transaction():
+                for photo_path in photos[start:start + MERGE_BATCH]:
+                    if photo_path in metadata:
+                        store.set_photo_metadata(photo_path, metadata[photo_path])
+                    if photo_path in by_photo:
+                        store.clear_unlabeled(photo_path)
+                        for encoding, face_location in by_photo[photo_path]:
+                            store.add_unlabeled(photo_path, encoding, face_location)
+                        counts['unlabeled'] += len(by_photo[photo_path])
+                    if photo_path in photo_faces:
+                        store.set_photo_faces(photo_path, photo_faces[photo_path])
+                    if photo_path in scanned:
+                        store.mark_scanned(photo_path)
+        counts['photos'] += len(photos)
+
+        with store.transaction():
+            for video_path, tracks in list(shard.iter_video_tracks()):
+                store.set_video_tracks(video_path, tracks)
+            for name, encodings in shard.reference_encodings().items():
+                for encoding in encodings:
+                    if (name, encoding.tobytes()) in known:
+                        continue
+                    known.add((name, encoding.tobytes()))
+                    store.add_reference(name, encoding)
+                    counts['reference'] += 1
+
+        shard.close()
+        if remove:
+            _remove_database(shard_file)
+        print(f"Merged {shard_file}: {len(photos)} photos")
+    return counts
+
+
+class FederatedStore(FaceStore):
+    """
+    Read-only FaceStore over several shard databases, without merging them
+
+    Face IDs are made unique across shards by interleaving them: a face
+    with ID i in shard s of n is face i * n + s here.
+    """
+
+    def __init__(self, stores, path):
+        """
+        Args:
+            stores (list): One FaceStore per shard
+            path (str): Name the federation goes by, normally the main database
+        """
+        self.stores = list(stores)
+        self.path = str(path)
+        self.photo_faces_version = None
+
+    @classmethod
+    def open(cls, database_file):
+        """Federate the shard databases found next to a main database"""
+        shard_files = find_shard_databases(database_file)
+        if not shard_files:
+            raise FileNotFoundError(f"No shard databases found next to {database_file}")
+        return cls([SQLiteStore(path) for path in shard_files], database_file)
+
+    def _global_id(self, shard, face_id):
+        return face_id * len(self.stores) + shard
+
+    def transaction(self):
+        raise RuntimeError("Shard databases are read-only until merged")
+
+    # Every change goes through transaction(), which refuses it
+    def set_meta(self, key, value):
+        self.transaction()
+
+    def add_reference(self, name, encoding):
+        self.transaction()
+
+    def add_photo_face(self, photo_path, name, face_location):
+        self.transaction()
+
+    def set_photo_faces(self, photo_path, faces):
+        self.transaction()
+
+    def add_unlabeled(self, photo_path, encoding, face_location):
+        self.transaction()
+
+    def take_unlabeled(self, face_id):
+        self.transaction()
+
+    def clear_unlabeled(self, photo_path):
+        self.transaction()
+
+    def convert_encodings(self, dtype):
+        self.transaction()
+
+    def mark_scanned(self, photo_path):
+        self.transaction()
+
+    def set_photo_metadata(self, photo_path, metadata):
+        self.transaction()
+
+    def set_video_tracks(self, video_path, tracks):
+        self.transaction()
+
+    def close(self):
+        for store in self.stores:
+            store.close()
+
+    def sync_photo_faces_version(self):
+        # Never matches a saved index, so indexes are built from the shards
+        return None
+
+    def get_meta(self, key, default=None):
+        # Settings such as encoding_precision are the same in every shard
+        return self.stores[0].get_meta(key, default)
+
+    def reference_encodings(self):
+        result = {}
+        for store in self.stores:
+            for name, encodings in store.reference_encodings().items():
+                result.setdefault(name, []).extend(encodings)
+        return result
+
+    def reference_counts(self):
+        result = {}
+        for store in self.stores:
+            for name, count in store.reference_counts().items():
+                result[name] = result.get(name, 0) + count
+        return result
+
+    def photo_faces(self, photo_path):
+        return [face for store in self.stores for face in store.photo_faces(photo_path)]
+
+    def iter_photo_faces(self):
+        for store in self.stores:
+            yield from store.iter_photo_faces()
+
+    def photo_count(self):
+        return sum(store.photo_count() for store in self.stores)
+
+    def unlabeled_faces(self, encodings=True):
+        return [(self._global_id(shard, face_id), photo_path, encoding, face_location)
+                for shard, store in enumerate(self.stores)
+                for face_id, photo_path, encoding, face_location in store.unlabeled_faces(encodings)]
+
+    def unlabeled_face(self, face_id):
+        shard = face_id % len(self.stores)
+        face = self.stores[shard].unlabeled_face(face_id // len(self.stores))
+        if face is None:
+            return None
+        return (face_id,) + face[1:]
+
+    def unlabeled_count(self):
+        return sum(store.unlabeled_count() for store in self.stores)
+
+    def scanned_photos(self):
+        return set().union(*(store.scanned_photos() for store in self.stores))
+
+    def photo_metadata(self):
+        result = {}
+        for store in self.stores:
+            result.update(store.photo_metadata())
+        return result
+
+    def video_tracks(self, video_path):
+        # A video is scanned by one shard only, like an archive
+        for store in self.stores:
+            tracks = store.video_tracks(video_path)
+            if tracks:
+                return tracks
+        return []
+
+    def iter_video_tracks(self):
+        for store in self.stores:
+            yield from store.iter_video_tracks()
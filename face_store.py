@@ -0,0 +1,557 @@
+"""
+Face database storage for Face Recognition File Explorer
+
+FaceStore is the interface the explorer reads and writes faces through.
+SQLiteStore implements it on an SQLite database in WAL mode, so the GUI, a
+CLI run and a scheduled scan can share one database safely:
+
+- Every change happens inside a transaction, so a crash never leaves a
+  half-written database behind.
+- Each thread reads through its own connection, and readers never wait
+  for writers.
+- Writers queue: threads of one process on a lock, other processes on
+  SQLite's write lock. Each writes only the rows it changed, so nobody's
+  work is overwritten by someone else's.
+- Faces are indexed by photo, person and face ID.
+
+Databases written by older versions (face_database.pkl) are imported the
+first time they are opened.
+"""
+
+import abc
+import contextlib
+import itertools
+import os
+import pickle
+import sqlite3
+import threading
+
+import numpy as np
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reference_faces (
+    face_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    encoding BLOB NOT NULL,
+    dtype TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reference_faces_name ON reference_faces (name);
+
+CREATE TABLE IF NOT EXISTS photo_faces (
+    face_id INTEGER PRIMARY KEY,
+    photo TEXT NOT NULL,
+    name TEXT NOT NULL,
+    loc_top INTEGER, loc_right INTEGER, loc_bottom INTEGER, loc_left INTEGER
+);
+CREATE INDEX IF NOT EXISTS photo_faces_photo ON photo_faces (photo);
+CREATE INDEX IF NOT EXISTS photo_faces_name ON photo_faces (name);
+
+CREATE TABLE IF NOT EXISTS unlabeled_faces (
+    face_id INTEGER PRIMARY KEY,
+    photo TEXT NOT NULL,
+    encoding BLOB NOT NULL,
+    dtype TEXT NOT NULL,
+    loc_top INTEGER, loc_right INTEGER, loc_bottom INTEGER, loc_left INTEGER
+);
+CREATE INDEX IF NOT EXISTS unlabeled_faces_photo ON unlabeled_faces (photo);
+
+CREATE TABLE IF NOT EXISTS photo_metadata (
+    photo TEXT PRIMARY KEY,
+    taken INTEGER,
+    camera TEXT,
+    latitude REAL,
+    longitude REAL
+);
+CREATE INDEX IF NOT EXISTS photo_metadata_taken ON photo_metadata (taken);
+
+CREATE TABLE IF NOT EXISTS scanned_photos (
+    photo TEXT PRIMARY KEY
+);
+
+CREATE TABLE IF NOT EXISTS video_tracks (
+    track_id INTEGER PRIMARY KEY,
+    video TEXT NOT NULL,
+    photo TEXT NOT NULL,
+    start_time REAL NOT NULL,
+    end_time REAL NOT NULL,
+    encoding BLOB NOT NULL,
+    dtype TEXT NOT NULL,
+    loc_top INTEGER, loc_right INTEGER, loc_bottom INTEGER, loc_left INTEGER
+);
+CREATE INDEX IF NOT EXISTS video_tracks_video ON video_tracks (video);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value BLOB
+);
+"""
+
+_LOCATION = 'loc_top, loc_right, loc_bottom, loc_left'
+
+
+def _encode(encoding):
+    encoding = np.asarray(encoding)
+    return encoding.tobytes(), encoding.dtype.str
+
+
+def _decode(blob, dtype):
+    return np.frombuffer(blob, dtype=dtype)
+
+
+class FaceStore(abc.ABC):
+    """
+    Interface to the face database
+
+    Faces come in three kinds:
+
+    - Reference faces: labeled encodings that recognition compares against
+    - Photo faces: who was found where in each photo, as (name, location)
+    - Unlabeled faces: detected faces waiting for a name, as
+      (face_id, photo, encoding, location)
+    - Video tracks: one face followed through a video, as (photo, start,
+      end, encoding, location), where photo is the frame it is shown by
+
+    Locations are (top, right, bottom, left) tuples. Methods that change
+    anything are atomic on their own. Several of them can be made one
+    atomic change by calling them inside ``with store.transaction():``.
+    """
+
+    # Database file the store was opened on
+    path = None
+
+    # Version of photo_faces that this process's cached indexes reflect;
+    # None when they must be rebuilt from the store
+    photo_faces_version = None
+
+    @abc.abstractmethod
+    def transaction(self):
+        """Context manager making the changes inside it atomic"""
+
+    def close(self):
+        pass
+
+    # Settings and cached state
+
+    @abc.abstractmethod
+    def get_meta(self, key, default=None):
+        """Stored setting, or default if it was never set"""
+
+    @abc.abstractmethod
+    def set_meta(self, key, value):
+        """Store a setting"""
+
+    @abc.abstractmethod
+    def sync_photo_faces_version(self):
+        """
+        Read the current photo_faces version, as now reflected by this process
+
+        Returns:
+            int: The version, or None if cached indexes can't be trusted
+        """
+
+    # Reference faces
+
+    @abc.abstractmethod
+    def reference_encodings(self):
+        """dict: name -> list of labeled encodings"""
+
+    @abc.abstractmethod
+    def reference_counts(self):
+        """dict: name -> number of labeled encodings"""
+
+    @abc.abstractmethod
+    def add_reference(self, name, encoding):
+        """Add a labeled encoding for a person"""
+
+    # Photo faces
+
+    @abc.abstractmethod
+    def photo_faces(self, photo_path):
+        """list of (name, location) found in one photo"""
+
+    @abc.abstractmethod
+    def iter_photo_faces(self):
+        """Yield (photo, list of (name, location)) for every photo with recognized faces"""
+
+    @abc.abstractmethod
+    def photo_count(self):
+        """Number of photos with recognized faces"""
+
+    @abc.abstractmethod
+    def add_photo_face(self, photo_path, name, face_location):
+        """Add one recognized face to a photo"""
+
+    @abc.abstractmethod
+    def set_photo_faces(self, photo_path, faces):
+        """Replace the recognized faces of a photo; an empty list removes it"""
+
+    # Unlabeled faces
+
+    @abc.abstractmethod
+    def unlabeled_faces(self, encodings=True):
+        """
+        Every unlabeled face, oldest first
+
+        Args:
+            encodings (bool): Load the encodings; None is returned in their
+                place otherwise, which is much quicker
+
+        Returns:
+            list: (face_id, photo, encoding, location) tuples
+        """
+
+    @abc.abstractmethod
+    def unlabeled_face(self, face_id):
+        """One unlabeled face as (face_id, photo, encoding, location), or None"""
+
+    @abc.abstractmethod
+    def unlabeled_count(self):
+        """Number of unlabeled faces"""
+
+    @abc.abstractmethod
+    def add_unlabeled(self, photo_path, encoding, face_location):
+        """Store a new unlabeled face; returns its face ID"""
+
+    @abc.abstractmethod
+    def take_unlabeled(self, face_id):
+        """Remove an unlabeled face; returns False if it was already gone"""
+
+    @abc.abstractmethod
+    def clear_unlabeled(self, photo_path):
+        """Remove every unlabeled face of a photo; returns how many there were"""
+
+    @abc.abstractmethod
+    def convert_encodings(self, dtype):
+        """Rewrite every stored encoding with a new dtype"""
+
+    # Photos
+
+    @abc.abstractmethod
+    def scanned_photos(self):
+        """Set of photos (and videos) scanned, whether they had faces or not"""
+
+    @abc.abstractmethod
+    def mark_scanned(self, photo_path):
+        """Record that a photo was scanned, so later scans leave it out"""
+
+    @abc.abstractmethod
+    def photo_metadata(self):
+        """dict: photo -> (taken, camera, latitude, longitude)"""
+
+    @abc.abstractmethod
+    def set_photo_metadata(self, photo_path, metadata):
+        """Store when, with what and where a photo was taken"""
+
+    # Videos
+
+    @abc.abstractmethod
+    def video_tracks(self, video_path):
+        """list of (photo, start, end, encoding, location) for one video, by start time"""
+
+    @abc.abstractmethod
+    def iter_video_tracks(self):
+        """Yield (video, tracks) for every scanned video"""
+
+    @abc.abstractmethod
+    def set_video_tracks(self, video_path, tracks):
+        """Replace the face tracks of a video"""
+
+
+class SQLiteStore(FaceStore):
+    """FaceStore on an SQLite database in WAL mode"""
+
+    def __init__(self, path, timeout=60.0):
+        """
+        Args:
+            path (str): Database file; created if missing
+            timeout (float): Seconds a writer waits for other processes'
+                transactions to finish before giving up
+        """
+        self.path = str(path)
+        self.timeout = timeout
+        self._local = threading.local()
+        self._write_lock = threading.RLock()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        # Version of photo_faces that this process's cached indexes reflect;
+        # None once another process has changed photo_faces behind our back
+        self.photo_faces_version = None
+
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(_SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.depth = 0
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    @contextlib.contextmanager
+    def transaction(self):
+        conn = self._connection()
+        if self._local.depth:
+            # Nested: part of the transaction that is already open
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+
+        with self._write_lock:
+            conn.execute('BEGIN IMMEDIATE')
+            self._local.depth = 1
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            else:
+                conn.execute('COMMIT')
+            finally:
+                self._local.depth = 0
+
+    def close(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except sqlite3.ProgrammingError:
+                    # Connections of other threads can't be closed from here
+                    pass
+            self._connections = []
+        self._local = threading.local()
+
+    # Settings and cached state
+
+    def get_meta(self, key, default=None):
+        row = self._connection().execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return default if row is None else pickle.loads(row[0])
+
+    def set_meta(self, key, value):
+        with self.transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                         (key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)))
+
+    def sync_photo_faces_version(self):
+        """Read the current photo_faces version, as now reflected by this process"""
+        self.photo_faces_version = self.get_meta('photo_faces_version', 0)
+        return self.photo_faces_version
+
+    def _photo_faces_changed(self, conn):
+        row = conn.execute("SELECT value FROM meta WHERE key = 'photo_faces_version'").fetchone()
+        current = 0 if row is None else pickle.loads(row[0])
+        conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                     ('photo_faces_version', pickle.dumps(current + 1)))
+        in_step = self.photo_faces_version == current
+        self.photo_faces_version = current + 1 if in_step else None
+
+    # Reference faces
+
+    def reference_encodings(self):
+        result = {}
+        for name, blob, dtype in self._connection().execute(
+                'SELECT name, encoding, dtype FROM reference_faces ORDER BY face_id'):
+            result.setdefault(name, []).append(_decode(blob, dtype))
+        return result
+
+    def reference_counts(self):
+        return dict(self._connection().execute(
+            'SELECT name, COUNT(*) FROM reference_faces GROUP BY name ORDER BY MIN(face_id)'))
+
+    def add_reference(self, name, encoding):
+        blob, dtype = _encode(encoding)
+        with self.transaction() as conn:
+            conn.execute('INSERT INTO reference_faces (name, encoding, dtype) VALUES (?, ?, ?)',
+                         (name, blob, dtype))
+
+    # Photo faces
+
+    def photo_faces(self, photo_path):
+        return [(name, tuple(location)) for name, *location in self._connection().execute(
+            f'SELECT name, {_LOCATION} FROM photo_faces WHERE photo = ? ORDER BY face_id', (photo_path,))]
+
+    def iter_photo_faces(self):
+        rows = self._connection().execute(
+            f'SELECT photo, name, {_LOCATION} FROM photo_faces ORDER BY photo, face_id')
+        for photo_path, group in itertools.groupby(rows, key=lambda row: row[0]):
+            yield photo_path, [(name, tuple(location)) for _, name, *location in group]
+
+    def photo_count(self):
+        return self._connection().execute('SELECT COUNT(DISTINCT photo) FROM photo_faces').fetchone()[0]
+
+    def add_photo_face(self, photo_path, name, face_location):
+        with self.transaction() as conn:
+            conn.execute(f'INSERT INTO photo_faces (photo, name, {_LOCATION}) VALUES (?, ?, ?, ?, ?, ?)',
+                         (photo_path, name, *(int(v) for v in face_location)))
+            self._photo_faces_changed(conn)
+
+    def set_photo_faces(self, photo_path, faces):
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM photo_faces WHERE photo = ?', (photo_path,))
+            conn.executemany(f'INSERT INTO photo_faces (photo, name, {_LOCATION}) VALUES (?, ?, ?, ?, ?, ?)',
+                             [(photo_path, name, *(int(v) for v in face_location))
+                              for name, face_location in faces])
+            self._photo_faces_changed(conn)
+
+    # Unlabeled faces
+
+    def unlabeled_faces(self, encodings=True):
+        if encodings:
+            return [(face_id, photo_path, _decode(blob, dtype), tuple(location))
+                    for face_id, photo_path, blob, dtype, *location in self._connection().execute(
+                        f'SELECT face_id, photo, encoding, dtype, {_LOCATION} FROM unlabeled_faces '
+                        'ORDER BY face_id')]
+        return [(face_id, photo_path, None, tuple(location))
+                for face_id, photo_path, *location in self._connection().execute(
+                    f'SELECT face_id, photo, {_LOCATION} FROM unlabeled_faces ORDER BY face_id')]
+
+    def unlabeled_face(self, face_id):
+        row = self._connection().execute(
+            f'SELECT face_id, photo, encoding, dtype, {_LOCATION} FROM unlabeled_faces WHERE face_id = ?',
+            (face_id,)).fetchone()
+        if row is None:
+            return None
+        face_id, photo_path, blob, dtype, *location = row
+        return (face_id, photo_path, _decode(blob, dtype), tuple(location))
+
+    def unlabeled_count(self):
+        return self._connection().execute('SELECT COUNT(*) FROM unlabeled_faces').fetchone()[0]
+
+    def add_unlabeled(self, photo_path, encoding, face_location):
+        blob, dtype = _encode(encoding)
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                f'INSERT INTO unlabeled_faces (photo, encoding, dtype, {_LOCATION}) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (photo_path, blob, dtype, *(int(v) for v in face_location)))
+            return cursor.lastrowid
+
+    def take_unlabeled(self, face_id):
+        with self.transaction() as conn:
+            return conn.execute('DELETE FROM unlabeled_faces WHERE face_id = ?', (face_id,)).rowcount > 0
+
+    def clear_unlabeled(self, photo_path):
+        with self.transaction() as conn:
+            return conn.execute('DELETE FROM unlabeled_faces WHERE photo = ?', (photo_path,)).rowcount
+
+    def convert_encodings(self, dtype):
+        dtype = np.dtype(dtype)
+        with self.transaction() as conn:
+            for table in ('reference_faces', 'unlabeled_faces', 'video_tracks'):
+                rows = conn.execute(f'SELECT rowid, encoding, dtype FROM {table}').fetchall()
+                conn.executemany(f'UPDATE {table} SET encoding = ?, dtype = ? WHERE rowid = ?',
+                                 [(*_encode(_decode(blob, old).astype(dtype)), rowid)
+                                  for rowid, blob, old in rows])
+
+    # Photos
+
+    def scanned_photos(self):
+        # Databases from before scans were recorded only know photos with faces
+        return {photo_path for photo_path, in self._connection().execute(
+            'SELECT photo FROM scanned_photos UNION SELECT photo FROM photo_faces '
+            'UNION SELECT photo FROM unlabeled_faces')}
+
+    def mark_scanned(self, photo_path):
+        with self.transaction() as conn:
+            conn.execute('INSERT OR IGNORE INTO scanned_photos (photo) VALUES (?)', (photo_path,))
+
+    def photo_metadata(self):
+        return {photo_path: tuple(metadata) for photo_path, *metadata in self._connection().execute(
+            'SELECT photo, taken, camera, latitude, longitude FROM photo_metadata')}
+
+    def set_photo_metadata(self, photo_path, metadata):
+        with self.transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO photo_metadata (photo, taken, camera, latitude, longitude) '
+                         'VALUES (?, ?, ?, ?, ?)', (photo_path, *metadata))
+
+    # Videos
+
+    def video_tracks(self, video_path):
+        return [(photo_path, start, end, _decode(blob, dtype), tuple(location))
+                for photo_path, start, end, blob, dtype, *location in self._connection().execute(
+                    f'SELECT photo, start_time, end_time, encoding, dtype, {_LOCATION} FROM video_tracks '
+                    'WHERE video = ? ORDER BY start_time, track_id', (video_path,))]
+
+    def iter_video_tracks(self):
+        rows = self._connection().execute(
+            f'SELECT video, photo, start_time, end_time, encoding, dtype, {_LOCATION} FROM video_tracks '
+            'ORDER BY video, start_time, track_id')
+        for video_path, group in itertools.groupby(rows, key=lambda row: row[0]):
+            yield video_path, [(photo_path, start, end, _decode(blob, dtype), tuple(location))
+                               for _, photo_path, start, end, blob, dtype, *location in group]
+
+    def set_video_tracks(self, video_path, tracks):
+        rows = []
+        for photo_path, start, end, encoding, face_location in tracks:
+            blob, dtype = _encode(encoding)
+            rows.append((video_path, photo_path, start, end, blob, dtype, *(int(v) for v in face_location)))
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM video_tracks WHERE video = ?', (video_path,))
+            conn.executemany('INSERT INTO video_tracks (video, photo, start_time, end_time, encoding, dtype, '
+                             f'{_LOCATION}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    # Older databases
+
+    def import_pickle(self, pickle_file):
+        """
+        Copy a face_database.pkl written by an older version into this store
+
+        Args:
+            pickle_file (str): The pickled database
+
+        Returns:
+            int: Number of faces imported
+        """
+        with open(pickle_file, 'rb') as f:
+            face_database = pickle.load(f)
+
+        count = 0
+        with self.transaction() as conn:
+            for name, encodings in face_database.get('faces', {}).items():
+                for encoding in encodings:
+                    self.add_reference(name, encoding)
+                    count += 1
+            for photo_path, faces in face_database.get('photo_faces', {}).items():
+                conn.executemany(
+                    f'INSERT INTO photo_faces (photo, name, {_LOCATION}) VALUES (?, ?, ?, ?, ?, ?)',
+                    [(photo_path, name, *(int(v) for v in face_location)) for name, face_location in faces])
+                count += len(faces)
+            self._photo_faces_changed(conn)
+            for photo_path, encoding, face_location in face_database.get('unlabeled_faces', []):
+                self.add_unlabeled(photo_path, encoding, face_location)
+                count += 1
+            for photo_path, metadata in face_database.get('timeline', {}).get('records', {}).items():
+                self.set_photo_metadata(photo_path, metadata)
+            if 'encoding_precision' in face_database:
+                self.set_meta('encoding_precision', face_database['encoding_precision'])
+        return count
+
+
+def open_store(database_file):
+    """
+    Open the face database, importing an older pickled one if needed
+
+    Args:
+        database_file (str): SQLite database file. A '.pkl' name from older
+            versions is taken to mean the '.db' file next to it.
+
+    Returns:
+        SQLiteStore: The opened store
+    """
+    root, ext = os.path.splitext(str(database_file))
+    if ext == '.pkl':
+        database_file = root + '.db'
+    pickle_file = root + '.pkl'
+
+    is_new = not os.path.exists(database_file)
+    store = SQLiteStore(database_file)
+    if is_new and os.path.exists(pickle_file):
+        count = store.import_pickle(pickle_file)
+        print(f"Imported {count} faces from {pickle_file} into {database_file}")
+    return store
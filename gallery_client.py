@@ -0,0 +1,90 @@
+"""
+Client for the gallery server of Face Recognition File Explorer
+
+Kept apart from gallery_server so the GUI can find and drive a running
+server with the standard library alone, even when face_recognition can't
+be imported in its own process.
+
+Jobs change the database, so the server only starts them for requests
+carrying the token it wrote to a file only the current user can read when
+it started; a web page the user happens to open can't read that file.
+"""
+
+import json
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+from urllib.parse import quote, urlsplit
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# Where a running server keeps its job token, one file per port
+TOKEN_DIR = Path.home() / '.face_explorer'
+TOKEN_HEADER = 'X-Gallery-Token'
+
+
+def token_path(port):
+    """File holding the job token of the server on this port"""
+    return TOKEN_DIR / f'server-{port}.token'
+
+
+def read_token(port):
+    """The job token of the server on this port, or None if there is none"""
+    try:
+        return token_path(port).read_text(encoding='utf-8').strip() or None
+    except OSError:
+        return None
+
+
+class GalleryClient:
+    """Minimal client the GUI uses to drive a running GalleryServer"""
+
+    def __init__(self, url=f"http://{DEFAULT_HOST}:{DEFAULT_PORT}", timeout=2.0):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def _request(self, path, payload=None):
+        data = json.dumps(payload).encode('utf-8') if payload is not None else None
+        headers = {'Content-Type': 'application/json'}
+        # Read on every request: a restarted server has a new token
+        token = read_token(urlsplit(self.url).port or DEFAULT_PORT)
+        if token:
+            headers[TOKEN_HEADER] = token
+        request = urllib.request.Request(self.url + path, data=data, headers=headers)
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read().decode('utf-8'))
+
+    def status(self):
+        """Server status, or None if no server is reachable"""
+        try:
+            return self._request('/api/status')
+        except (urllib.error.URLError, OSError, ValueError):
+            return None
+
+    def serves(self, photos_dir):
+        """Whether a reachable server is serving this photos directory"""
+        status = self.status()
+        if status is None:
+            return False
+        return Path(status['photos_dir']).resolve() == Path(photos_dir).resolve()
+
+    def start_job(self, kind, **params):
+        return self._request(f'/api/jobs/{quote(kind)}', params)
+
+    def job(self):
+        return self._request('/api/jobs')
+
+    def cancel_job(self):
+        return self._request('/api/jobs/cancel', {})
+
+    def wait_for_job(self, poll_interval=1.0, on_poll=None):
+        """Poll until the current job finishes, then return it"""
+        while True:
+            job = self.job()
+            if job is None or job['state'] != 'running':
+                return job
+            if on_poll:
+                on_poll(job)
+            time.sleep(poll_interval)
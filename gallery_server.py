@@ -0,0 +1,574 @@
+"""
+Local gallery and query server for Face Recognition File Explorer
+
+Loads the face database once and answers people, photo and co-occurrence
+queries as JSON from a warm in-memory index. Thumbnails are rendered on
+demand and kept in an LRU cache, a posted image is matched against every
+known face, and long-running jobs (scan, recognize, group) can be started
+remotely, which lets the GUI use the server as a warm backend.
+
+POST requests from another origin, or naming another host (DNS
+rebinding), are refused. Jobs also need a JSON body and the token the
+server writes for the current user on start (see gallery_client).
+
+Start it with ``face_recognition_explorer.py --photos_dir ... --serve``.
+"""
+
+import asyncio
+import concurrent.futures
+import hmac
+import io
+import json
+import os
+import secrets
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import face_recognition
+
+from cooccurrence import CooccurrenceGraph
+from match_index import FaceMatchIndex
+from person_index import PersonIndex
+from photo_timeline import PhotoTimeline, parse_date, select_photos
+from photo_sources import split_archive_path
+from thumbnails import THUMBNAIL_DIR, THUMBNAIL_SIZES, ThumbnailStore
+from gallery_client import DEFAULT_HOST, DEFAULT_PORT, TOKEN_DIR, TOKEN_HEADER, token_path
+
+# Largest request body accepted (query images)
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+# Hosts that mean "every interface": any Host header may reach them
+_ANY_HOST = ('', '0.0.0.0', '::')
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed',
+            409: 'Conflict', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+_INDEX_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+    <title>Face Recognition - People</title>
+    <style>
+        body { font-family: Arial, sans-serif; margin: 0; padding: 20px; }
+        h1 { color: #333; }
+        .grid { display: grid; grid-template-columns: repeat(auto-fill, minmax(200px, 1fr)); gap: 15px; }
+        .card { border: 1px solid #ddd; border-radius: 5px; overflow: hidden; cursor: pointer; }
+        .card img { width: 100%; height: 200px; object-fit: cover; display: block; }
+        .card div { padding: 8px; background: #f9f9f9; }
+    </style>
+</head>
+<body>
+    <h1 id="title">People</h1>
+    <p><a href="#" id="back" style="display:none">&larr; Back to all people</a></p>
+    <div class="grid" id="grid"></div>
+    <script>
+        var grid = document.getElementById("grid");
+        function card(thumb, text, href) {
+            var el = document.createElement("div");
+            el.className = "card";
+            el.innerHTML = '<img loading="lazy"><div></div>';
+            el.firstChild.src = thumb;
+            el.lastChild.textContent = text;
+            el.onclick = function () { window.location = href; };
+            grid.appendChild(el);
+        }
+        function thumb(path) { return "/thumb?size=240&path=" + encodeURIComponent(path); }
+        function showPeople() {
+            fetch("/api/people").then(function (r) { return r.json(); }).then(function (people) {
+                people.forEach(function (p) {
+                    card(p.cover ? thumb(p.cover) : "", p.name + " (" + p.photo_count + ")",
+                         "#" + encodeURIComponent(p.name));
+                });
+            });
+        }
+        function showPerson(name) {
+            document.getElementById("title").textContent = "Photos of " + name;
+            document.getElementById("back").style.display = "";
+            fetch("/api/people/" + encodeURIComponent(name) + "/photos?limit=100000")
+                .then(function (r) { return r.json(); }).then(function (result) {
+                    result.photos.forEach(function (path) {
+                        card(thumb(path), path, "/photo?path=" + encodeURIComponent(path));
+                    });
+                });
+        }
+        window.onhashchange = function () { window.location.reload(); };
+        if (window.location.hash.length > 1) {
+            showPerson(decodeURIComponent(window.location.hash.substring(1)));
+        } else {
+            showPeople();
+        }
+    </script>
+</body>
+</html>
+"""
+
+
+class HTTPError(Exception):
+    """Raised by handlers to send an error response"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _query_number(query, name, default, convert=int, minimum=0):
+    """A numeric query parameter, or a 400 if it isn't one"""
+    if name not in query:
+        return default
+    try:
+        value = convert(query[name])
+    except ValueError:
+        raise HTTPError(400, f"'{name}' must be a number, not '{query[name]}'")
+    if minimum is not None and value < minimum:
+        raise HTTPError(400, f"'{name}' must be at least {minimum}")
+    return value
+
+
+class ThumbnailCache:
+    """LRU cache of rendered thumbnails, bounded by total bytes"""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        with self._lock:
+            if key in self._items:
+                return
+            self._items[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes and self._items:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class DatabaseSnapshot:
+    """Read-only views of the face database, rebuilt after every change"""
+
+    def __init__(self, store, person_index, cooccurrence, timeline, match_options=None):
+        """
+        Args:
+            store (FaceStore): The explorer's face database
+            person_index (PersonIndex): Person -> photos index
+            cooccurrence (CooccurrenceGraph): Co-occurrence counts
+            timeline (PhotoTimeline): Capture dates
+            match_options (dict, optional): Passed on to FaceMatchIndex
+                (mode, quantizer, pq_bytes, rerank)
+        """
+        self.photo_faces = {
+            photo_path: [(name, [int(v) for v in face_location]) for name, face_location in faces]
+            for photo_path, faces in store.iter_photo_faces()
+        }
+        # A private copy, so jobs updating the live index don't race queries
+        self.person_index = PersonIndex.from_state(person_index.state())
+        self.face_counts = store.reference_counts()
+        self.person_photos = {name: [] for name in self.face_counts}
+        self.person_photos.update(self.person_index.person_photos())
+        self.cooccurrence = CooccurrenceGraph.from_state(cooccurrence.state())
+        self.timeline = PhotoTimeline.from_state(timeline.state())
+        self.unlabeled_count = store.unlabeled_count()
+        self.match_index = FaceMatchIndex.from_database(store, **(match_options or {}))
+        self.built_at = time.time()
+
+
+class GalleryServer:
+    """asyncio HTTP server over a warm FaceRecognitionExplorer"""
+
+    def __init__(self, explorer, host=DEFAULT_HOST, port=DEFAULT_PORT,
+                 thumbnail_cache_mb=64, max_workers=None, match_mode='float32', pq_bytes=16):
+        """
+        Args:
+            explorer (FaceRecognitionExplorer): Explorer whose database is served
+            host (str): Interface to listen on
+            port (int): Port to listen on
+            thumbnail_cache_mb (float): Memory for cached thumbnails
+            max_workers (int, optional): Threads for thumbnails and queries
+            match_mode (str): How the face search index holds encodings,
+                one of match_index.MATCH_MODES
+            pq_bytes (int): Bytes per face in the 'pq' match mode
+        """
+        self.explorer = explorer
+        self.match_options = {'mode': match_mode, 'pq_bytes': pq_bytes}
+        self.host = host
+        self.port = port
+        # Only used to render thumbnails in memory, never to store them
+        self.thumbnails = ThumbnailStore(explorer.photos_dir / THUMBNAIL_DIR, explorer.photo_reader)
+        self.thumbnail_cache = ThumbnailCache(int(thumbnail_cache_mb * 1024 * 1024))
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self.snapshot = self._build_snapshot()
+
+        # Only one job mutates the database at a time
+        self.job = None
+        self._job_lock = threading.Lock()
+        self._cancel_event = threading.Event()
+        self.token = secrets.token_urlsafe(32)
+
+    def _build_snapshot(self):
+        options = dict(self.match_options)
+        previous = getattr(self, 'snapshot', None)
+        if previous is not None and previous.match_index.quantizer is not None:
+            # Codebooks stay good as faces are added; don't retrain every job
+            options['quantizer'] = previous.match_index.quantizer
+        return DatabaseSnapshot(self.explorer.store, self.explorer.person_index,
+                                self.explorer.cooccurrence, self.explorer.timeline, options)
+
+    # Jobs ----------------------------------------------------------------
+
+    def _run_job(self, kind, params, cancel_event):
+        job = self.job
+
+        def progress(done, total):
+            job['done'] = done
+            job['total'] = total
+
+        try:
+            if kind == 'scan':
+                self.explorer.scan_photos(
+                    force_rescan=bool(params.get('force_rescan', False)),
+                    parallel=bool(params.get('parallel', True)),
+                    model=params.get('model', 'hog'),
+                    progress=progress, cancel_event=cancel_event)
+            elif kind == 'recognize':
+                self.explorer.recognize_faces(
+                    tolerance=float(params.get('tolerance', 0.6)),
+                    model=params.get('model', 'hog'),
+                    parallel=bool(params.get('parallel', True)),
+                    progress=progress, cancel_event=cancel_event)
+            elif kind == 'group':
+                self.explorer.group_photos_by_person(
+                    params['output_dir'], mode=params.get('mode', 'auto'),
+                    cancel_event=cancel_event, progress=progress)
+            elif kind == 'reload':
+                self.explorer.reload()
+            job['state'] = 'cancelled' if cancel_event.is_set() else 'completed'
+        except Exception as e:
+            traceback.print_exc()
+            job['state'] = 'failed'
+            job['error'] = str(e)
+        finally:
+            self.snapshot = self._build_snapshot()
+            job['finished_at'] = time.time()
+
+    def start_job(self, kind, params):
+        if kind not in ('scan', 'recognize', 'group', 'reload'):
+            raise HTTPError(404, f"Unknown job '{kind}'")
+        if kind == 'group' and not params.get('output_dir'):
+            raise HTTPError(400, "The group job needs an output_dir")
+        with self._job_lock:
+            if self.job is not None and self.job['state'] == 'running':
+                raise HTTPError(409, f"A {self.job['kind']} job is already running")
+            self.job = {'kind': kind, 'state': 'running', 'started_at': time.time(),
+                        'finished_at': None, 'error': None, 'done': 0, 'total': 0}
+            self._cancel_event = threading.Event()
+            thread = threading.Thread(target=self._run_job, args=(kind, params, self._cancel_event),
+                                      name=f"job-{kind}")
+            thread.daemon = True
+            thread.start()
+            return dict(self.job)
+
+    def cancel_job(self):
+        with self._job_lock:
+            if self.job is None or self.job['state'] != 'running':
+                raise HTTPError(409, "No job is running")
+            self._cancel_event.set()
+            return dict(self.job)
+
+    # Handlers ------------------------------------------------------------
+
+    def _people(self, query):
+        snapshot = self.snapshot
+        return [
+            {'name': name,
+             'photo_count': len(photos),
+             'face_count': snapshot.face_counts.get(name, 0),
+             'cover': photos[0] if photos else None}
+            for name, photos in sorted(snapshot.person_photos.items())
+        ]
+
+    def _person_photos(self, name, query):
+        photos = self.snapshot.person_photos.get(name)
+        if photos is None:
+            raise HTTPError(404, f"Unknown person '{name}'")
+        if query.get('since') or query.get('until'):
+            try:
+                start = parse_date(query['since']) if query.get('since') else None
+                end = parse_date(query['until'], end=True) if query.get('until') else None
+            except ValueError as e:
+                raise HTTPError(400, str(e))
+            photos = self.snapshot.timeline.filter(photos, start, end)
+        offset = _query_number(query, 'offset', 0)
+        limit = _query_number(query, 'limit', 100)
+        return {'name': name, 'total': len(photos), 'offset': offset,
+                'photos': photos[offset:offset + limit]}
+
+    def _photo(self, query):
+        path = query.get('path')
+        faces = self.snapshot.photo_faces.get(path)
+        if faces is None:
+            raise HTTPError(404, f"No recognized faces in '{path}'")
+        return {'path': path, 'faces': [{'name': name, 'location': loc} for name, loc in faces],
+                **self.snapshot.timeline.get(path)}
+
+    def _search(self, query):
+        expression = query.get('q')
+        if not (expression or query.get('since') or query.get('until')):
+            raise HTTPError(400, "Missing 'q', 'since' or 'until' parameter")
+        try:
+            photos = select_photos(self.snapshot.person_index, self.snapshot.timeline, expression,
+                                   query.get('since'), query.get('until'))
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        offset = _query_number(query, 'offset', 0)
+        limit = _query_number(query, 'limit', 100)
+        return {'query': expression, 'total': len(photos), 'offset': offset,
+                'photos': photos[offset:offset + limit]}
+
+    def _cooccurrence(self, query):
+        name = query.get('name')
+        if name not in self.snapshot.person_photos:
+            raise HTTPError(404, f"Unknown person '{name}'")
+        limit = _query_number(query, 'limit', 20)
+        return {'name': name,
+                'companions': [{'name': other, 'photos': count}
+                               for other, count in self.snapshot.cooccurrence.companions(name, limit)]}
+
+    def _status(self, query):
+        snapshot = self.snapshot
+        return {'photos_dir': str(self.explorer.photos_dir),
+                'people': len(snapshot.person_photos),
+                'photos': len(snapshot.photo_faces),
+                'unlabeled_faces': snapshot.unlabeled_count,
+                'indexed_faces': len(snapshot.match_index),
+                'match_mode': snapshot.match_index.mode,
+                'match_index_bytes': snapshot.match_index.memory_bytes(),
+                'thumbnail_cache': {'bytes': self.thumbnail_cache.size,
+                                    'hits': self.thumbnail_cache.hits,
+                                    'misses': self.thumbnail_cache.misses},
+                'job': self.job}
+
+    def _check_photo(self, path):
+        """Refuse paths that are missing or point outside the photos directory"""
+        if not path:
+            raise HTTPError(400, "Missing 'path' parameter")
+        archive, _ = split_archive_path(path)
+        root = self.explorer.photos_dir.resolve()
+        resolved = (root / archive).resolve()
+        if resolved != root and root not in resolved.parents:
+            raise HTTPError(404, f"Photo not found: {path}")
+        if not self.explorer.photo_reader.exists(path):
+            raise HTTPError(404, f"Photo not found: {path}")
+
+    def _thumbnail(self, query):
+        """Runs in the executor: render or fetch a cached thumbnail"""
+        path = query.get('path')
+        size = _query_number(query, 'size', THUMBNAIL_SIZES[0], minimum=1)
+        self._check_photo(path)
+        key = (path, size)
+        data = self.thumbnail_cache.get(key)
+        if data is None:
+            data = self.thumbnails.render(path, [size])[size]
+            self.thumbnail_cache.put(key, data)
+        return data
+
+    def _full_photo(self, query):
+        path = query.get('path')
+        self._check_photo(path)
+        return self.explorer.photo_reader.read_bytes(path)
+
+    def _query_image(self, body, query):
+        """Runs in the executor: detect faces in a posted image and match them"""
+        if not body:
+            raise HTTPError(400, "POST the query image as the request body")
+        k = _query_number(query, 'k', 10, minimum=1)
+        max_distance = _query_number(query, 'max_distance', None, float)
+        try:
+            image = face_recognition.load_image_file(io.BytesIO(body))
+        except Exception as e:
+            raise HTTPError(400, f"Could not decode image: {e}")
+        # Encoded by the backend the database was scanned with, or the
+        # distances would mean nothing
+        backend = self.explorer.face_backend()
+        face_locations = backend.detect(image)
+        face_encodings = backend.encode(image, face_locations)
+        index = self.snapshot.match_index
+        return {'faces': [
+            {'location': [int(v) for v in face_location],
+             'matches': [dict(entry, distance=distance)
+                         for distance, entry in index.search(encoding, k, max_distance)]}
+            for face_location, encoding in zip(face_locations, face_encodings)
+        ]}
+
+    async def _dispatch(self, method, path, query, body):
+        """
+        Route a request
+
+        Returns:
+            tuple: (content type, bytes)
+        """
+        loop = asyncio.get_running_loop()
+        parts = [unquote(part) for part in path.strip('/').split('/') if part]
+
+        if method == 'GET':
+            if not parts:
+                return 'text/html; charset=utf-8', _INDEX_PAGE.encode('utf-8')
+            if parts == ['thumb']:
+                data = await loop.run_in_executor(self.executor, self._thumbnail, query)
+                return 'image/jpeg', data
+            if parts == ['photo']:
+                data = await loop.run_in_executor(self.executor, self._full_photo, query)
+                return 'application/octet-stream', data
+            if parts == ['api', 'status']:
+                return self._json(self._status(query))
+            if parts == ['api', 'people']:
+                return self._json(self._people(query))
+            if len(parts) == 4 and parts[:2] == ['api', 'people'] and parts[3] == 'photos':
+                return self._json(self._person_photos(parts[2], query))
+            if parts == ['api', 'photo']:
+                return self._json(self._photo(query))
+            if parts == ['api', 'search']:
+                return self._json(self._search(query))
+            if parts == ['api', 'cooccurrence']:
+                return self._json(self._cooccurrence(query))
+            if parts == ['api', 'jobs']:
+                return self._json(self.job)
+        elif method == 'POST':
+            if parts == ['api', 'query']:
+                result = await loop.run_in_executor(self.executor, self._query_image, body, query)
+                return self._json(result)
+            if parts == ['api', 'jobs', 'cancel']:
+                return self._json(self.cancel_job())
+            if len(parts) == 3 and parts[:2] == ['api', 'jobs']:
+                try:
+                    params = json.loads(body.decode('utf-8')) if body else {}
+                except ValueError as e:
+                    raise HTTPError(400, f"Job parameters are not valid JSON: {e}")
+                if not isinstance(params, dict):
+                    raise HTTPError(400, "Job parameters must be a JSON object")
+                return self._json(self.start_job(parts[2], params))
+        else:
+            raise HTTPError(405, f"Method {method} not allowed")
+
+        raise HTTPError(404, f"No route for {method} {path}")
+
+    @staticmethod
+    def _json(value):
+        return 'application/json', json.dumps(value).encode('utf-8')
+
+    def _check_post(self, path, headers):
+        """Refuse cross-site POSTs, and jobs without a JSON body and the token"""
+        host = headers.get('host', '')
+        if self.host not in _ANY_HOST:
+            allowed = {f"{name}:{self.port}" for name in ('127.0.0.1', 'localhost', '[::1]', self.host)}
+            if host.lower() not in allowed:
+                raise HTTPError(403, f"Requests for host '{host}' are not served")
+        origin = headers.get('origin')
+        if origin and urlsplit(origin).netloc.lower() != host.lower():
+            raise HTTPError(403, f"Requests from {origin} are not allowed")
+
+        if path.strip('/').split('/')[:2] == ['api', 'jobs']:
+            if headers.get('content-type', '').split(';')[0].strip().lower() != 'application/json':
+                raise HTTPError(400, "Jobs need a Content-Type of application/json")
+            if not hmac.compare_digest(headers.get(TOKEN_HEADER.lower(), ''), self.token):
+                raise HTTPError(403, f"Jobs need the {TOKEN_HEADER} header from {token_path(self.port)}")
+
+    # HTTP plumbing -------------------------------------------------------
+
+    async def _handle(self, reader, writer):
+        status, content_type, payload = 500, 'application/json', b''
+        try:
+            request_line = await reader.readline()
+            if not request_line:
+                return
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                key, _, value = line.decode('latin-1').partition(':')
+                headers[key.strip().lower()] = value.strip()
+
+            length = int(headers.get('content-length', 0))
+            if length > MAX_BODY_BYTES:
+                raise HTTPError(413, "Request body too large")
+            body = await reader.readexactly(length) if length else b''
+
+            url = urlsplit(target)
+            if method.upper() == 'POST':
+                self._check_post(url.path, headers)
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            content_type, payload = await self._dispatch(method.upper(), url.path, query, body)
+            status = 200
+        except HTTPError as e:
+            status, content_type = e.status, 'application/json'
+            payload = json.dumps({'error': e.message}).encode('utf-8')
+        except Exception as e:
+            traceback.print_exc()
+            status, content_type = 500, 'application/json'
+            payload = json.dumps({'error': str(e)}).encode('utf-8')
+
+        try:
+            writer.write(
+                f"HTTP/1.1 {status} {_REASONS.get(status, 'Error')}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                f"Connection: close\r\n\r\n".encode('latin-1') + payload
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def _write_token(self):
+        """Leave the job token where only this user's processes can read it"""
+        TOKEN_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+        path = token_path(self.port)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(self.token)
+
+    def _remove_token(self):
+        path = token_path(self.port)
+        try:
+            # Another server may have started on this port since
+            if path.read_text(encoding='utf-8').strip() == self.token:
+                path.unlink()
+        except OSError:
+            pass
+
+    async def serve_forever(self):
+        server = await asyncio.start_server(self._handle, self.host, self.port)
+        self._write_token()
+        print(f"Serving {self.explorer.photos_dir} at http://{self.host}:{self.port}/")
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        """Serve until interrupted"""
+        try:
+            asyncio.run(self.serve_forever())
+        except KeyboardInterrupt:
+            print("Server stopped.")
+        finally:
+            self._remove_token()
+            self.executor.shutdown(wait=False)
+
@@ -0,0 +1,189 @@
+"""
+Background job scheduler for the Face Recognition GUI
+
+Long-running work (scans, recognition, grouping) runs one job at a time on
+a single worker thread, in the order it was submitted. Jobs never touch Tk
+directly: they report through progress events put on a thread-safe queue,
+which the Tk main loop drains at a fixed frame rate. Each job gets a
+threading.Event it should check now and then to stop early when cancelled.
+"""
+
+import queue
+import threading
+import time
+import traceback
+
+
+class ProgressEvent:
+    """Something that happened to a job, for display by the GUI"""
+
+    __slots__ = ('job', 'kind', 'done', 'total', 'rate', 'eta', 'message')
+
+    # kind is one of 'queued', 'started', 'progress', 'message',
+    # 'completed', 'cancelled' or 'failed'
+    def __init__(self, job, kind, done=0, total=0, rate=0.0, eta=None, message=''):
+        self.job = job
+        self.kind = kind
+        self.done = done
+        self.total = total
+        self.rate = rate            # items per second
+        self.eta = eta              # seconds left, None if unknown
+        self.message = message
+
+    def describe(self):
+        """One-line status text for this event"""
+        if self.kind != 'progress':
+            return self.message or f"{self.job.name}: {self.kind}"
+        text = f"{self.job.name}: {self.done}/{self.total}" if self.total else f"{self.job.name}: {self.done}"
+        if self.rate:
+            text += f" ({self.rate:.1f}/s"
+            if self.eta is not None:
+                text += f", {format_duration(self.eta)} left"
+            text += ")"
+        return text
+
+
+def format_duration(seconds):
+    """Short human-readable duration like '1h 02m' or '45s'"""
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+class Job:
+    """A unit of work queued on the scheduler"""
+
+    def __init__(self, name, func, events, min_interval=0.1):
+        """
+        Args:
+            name (str): Shown in progress messages
+            func (callable): Called as func(job) on the worker thread
+            events (queue.Queue): Where progress events are put
+            min_interval (float): Least time between two progress events
+        """
+        self.name = name
+        self.func = func
+        self.events = events
+        self.min_interval = min_interval
+        self.cancel_event = threading.Event()
+        self.state = 'queued'
+        self.error = None
+        self._started = None
+        self._last_progress = 0.0
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def _emit(self, kind, **fields):
+        self.events.put(ProgressEvent(self, kind, **fields))
+
+    def progress(self, done, total=0):
+        """Report items done so far; throttled so fast loops don't flood the queue"""
+        now = time.perf_counter()
+        if now - self._last_progress < self.min_interval and done != total:
+            return
+        self._last_progress = now
+        elapsed = now - (self._started or now)
+        rate = done / elapsed if elapsed > 0 else 0.0
+        eta = (total - done) / rate if rate and total >= done else None
+        self._emit('progress', done=done, total=total, rate=rate, eta=eta)
+
+    def message(self, text):
+        self._emit('message', message=text)
+
+    def _run(self):
+        if self.cancelled:
+            self.state = 'cancelled'
+            self._emit('cancelled', message=f"{self.name} cancelled")
+            return
+        self.state = 'running'
+        self._started = time.perf_counter()
+        self._emit('started', message=f"{self.name}...")
+        try:
+            self.func(self)
+        except Exception as e:
+            traceback.print_exc()
+            self.state = 'failed'
+            self.error = e
+            self._emit('failed', message=f"{self.name} failed: {e}")
+            return
+        self.state = 'cancelled' if self.cancelled else 'completed'
+        elapsed = format_duration(time.perf_counter() - self._started)
+        self._emit(self.state, message=f"{self.name} {self.state} ({elapsed})")
+
+
+class JobScheduler:
+    """Runs jobs one after another on a background thread"""
+
+    def __init__(self):
+        self.events = queue.Queue()
+        self.current = None
+        self._jobs = queue.Queue()
+        self._pending = []
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._worker, name="job-scheduler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, name, func):
+        """
+        Queue a job
+
+        Args:
+            name (str): Shown in progress messages
+            func (callable): Called as func(job); should check job.cancelled
+                (or pass job.cancel_event on) and call job.progress(done, total)
+
+        Returns:
+            Job: The queued job
+        """
+        job = Job(name, func, self.events)
+        with self._lock:
+            self._pending.append(job)
+        job._emit('queued', message=f"{name} queued")
+        self._jobs.put(job)
+        return job
+
+    def pending(self):
+        """Jobs waiting to run"""
+        with self._lock:
+            return list(self._pending)
+
+    def cancel_current(self):
+        job = self.current
+        if job is not None:
+            job.cancel()
+
+    def cancel_all(self):
+        """Cancel the running job and everything queued behind it"""
+        for job in self.pending():
+            job.cancel()
+        self.cancel_current()
+
+    def drain(self, max_events=1000):
+        """Take up to max_events events off the queue without blocking"""
+        events = []
+        while len(events) < max_events:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                break
+        return events
+
+    def _worker(self):
+        while True:
+            job = self._jobs.get()
+            with self._lock:
+                self._pending.remove(job)
+                self.current = job
+            try:
+                job._run()
+            finally:
+                self.current = None
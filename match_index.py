@@ -0,0 +1,328 @@
+"""
+In-memory face match index for Face Recognition File Explorer
+
+Holds every face encoding of the database in one contiguous array so a
+query face can be compared against all of them with a single vectorized
+distance computation.
+
+Three storage modes trade memory for precision:
+
+- float32: exact, 512 bytes per face
+- float16: 256 bytes per face, distances computed in float32
+- pq: product quantization, one byte per subspace (16-32 bytes per face).
+  Distances are looked up from per-query tables (asymmetric distance
+  computation), and the closest candidates are re-ranked exactly against
+  the database's own encodings, so no second copy of them is kept.
+"""
+
+import sys
+import time
+
+import numpy as np
+
+MATCH_MODES = ('float32', 'float16', 'pq')
+
+# Rows compared per step, bounding the float32 temporaries of compact modes
+_CHUNK_ROWS = 8192
+
+# Faces sampled to train product quantization codebooks
+PQ_TRAINING_SAMPLE = 20000
+
+
+class ProductQuantizer:
+    """Splits encodings into subvectors and codes each with a 256-entry codebook"""
+
+    def __init__(self, subspaces=16, centroids=256):
+        """
+        Args:
+            subspaces (int): Bytes per coded face; must divide the encoding length
+            centroids (int): Codebook entries per subspace, at most 256
+        """
+        self.subspaces = subspaces
+        self.centroids = centroids
+        self.codebooks = None  # (subspaces, centroids, subvector length)
+
+    @classmethod
+    def from_state(cls, state):
+        quantizer = cls(state['subspaces'], state['centroids'])
+        quantizer.codebooks = np.asarray(state['codebooks'], dtype=np.float32)
+        return quantizer
+
+    def state(self):
+        return {'subspaces': self.subspaces, 'centroids': self.centroids, 'codebooks': self.codebooks}
+
+    def _split(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.shape[1] % self.subspaces:
+            raise ValueError(f"{self.subspaces} subspaces don't divide {vectors.shape[1]}-d encodings")
+        return vectors.reshape(len(vectors), self.subspaces, -1)
+
+    def train(self, vectors, iterations=20, seed=0):
+        """
+        Learn one codebook per subspace with k-means
+
+        Args:
+            vectors (array-like): Training encodings, one per row
+            iterations (int): k-means iterations
+            seed (int): Seed for the initial centroids
+        """
+        from sklearn.cluster import KMeans
+
+        parts = self._split(vectors)
+        centroids = min(self.centroids, len(parts))
+        self.codebooks = np.zeros((self.subspaces, self.centroids, parts.shape[2]), dtype=np.float32)
+        for j in range(self.subspaces):
+            kmeans = KMeans(n_clusters=centroids, n_init=1, max_iter=iterations,
+                            random_state=seed).fit(parts[:, j, :])
+            self.codebooks[j, :centroids] = kmeans.cluster_centers_
+            # Unused entries repeat the first centroid so they're never closer
+            self.codebooks[j, centroids:] = kmeans.cluster_centers_[0]
+        return self
+
+    def encode(self, vectors):
+        """Code each encoding as one uint8 per subspace"""
+        parts = self._split(vectors)
+        codes = np.empty((len(parts), self.subspaces), dtype=np.uint8)
+        for j in range(self.subspaces):
+            # |x - c|^2 = |x|^2 - 2 x.c + |c|^2, and |x|^2 doesn't change the argmin
+            codebook = self.codebooks[j]
+            scores = (codebook * codebook).sum(axis=1) - 2 * parts[:, j, :] @ codebook.T
+            codes[:, j] = scores.argmin(axis=1)
+        return codes
+
+    def distance_table(self, query):
+        """Squared distance from each query subvector to every centroid"""
+        parts = np.asarray(query, dtype=np.float32).reshape(self.subspaces, 1, -1)
+        diff = self.codebooks - parts
+        return np.einsum('jkd,jkd->jk', diff, diff)
+
+    def distances(self, table, codes):
+        """Approximate squared distances of coded faces, looked up from table"""
+        offsets = np.arange(self.subspaces) * self.centroids
+        flat = table.ravel()
+        out = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), _CHUNK_ROWS):
+            chunk = codes[start:start + _CHUNK_ROWS].astype(np.intp) + offsets
+            out[start:start + _CHUNK_ROWS] = flat[chunk].sum(axis=1)
+        return out
+
+
+class FaceMatchIndex:
+    """Nearest-neighbour search over the face encodings in a database"""
+
+    def __init__(self, encodings, entries, mode='float32', quantizer=None, pq_bytes=16, rerank=64):
+        """
+        Args:
+            encodings (array-like): One 128-d encoding per face
+            entries (list): Description of each face (same order), returned
+                with search results
+            mode (str): One of MATCH_MODES
+            quantizer (ProductQuantizer, optional): Trained codebooks to
+                reuse in 'pq' mode; trained on a sample when not given
+            pq_bytes (int): Bytes per face when a quantizer is trained
+            rerank (int): Candidates re-ranked exactly in compact modes
+        """
+        if mode not in MATCH_MODES:
+            raise ValueError(f"Unknown match mode '{mode}' (expected one of {', '.join(MATCH_MODES)})")
+        self.entries = list(entries)
+        self.mode = mode
+        self.rerank = rerank
+        self.quantizer = None
+        self.codes = None
+        # Exact encodings for re-ranking are only referenced, never copied
+        self._exact = encodings if mode != 'float32' else None
+
+        if not self.entries:
+            self.encodings = np.zeros((0, 128), dtype=np.float32)
+            return
+
+        if mode == 'pq':
+            self.encodings = None
+            count = len(self.entries)
+            if quantizer is None:
+                sample = range(count)
+                if count > PQ_TRAINING_SAMPLE:
+                    sample = np.random.default_rng(0).choice(count, PQ_TRAINING_SAMPLE, replace=False)
+                quantizer = ProductQuantizer(pq_bytes).train([encodings[i] for i in sample])
+            self.quantizer = quantizer
+            # Coded a chunk at a time, so no full float32 copy is ever made
+            self.codes = np.empty((count, quantizer.subspaces), dtype=np.uint8)
+            for start in range(0, count, _CHUNK_ROWS):
+                chunk = [encodings[i] for i in range(start, min(count, start + _CHUNK_ROWS))]
+                self.codes[start:start + len(chunk)] = quantizer.encode(chunk)
+        else:
+            dtype = np.float16 if mode == 'float16' else np.float32
+            self.encodings = np.asarray(encodings, dtype=dtype).reshape(len(self.entries), -1)
+
+    @classmethod
+    def from_database(cls, store, **options):
+        """
+        Build an index over the labeled and unlabeled faces of a database
+
+        Entries are dicts with 'name' (None for unlabeled faces) and, for
+        unlabeled faces, 'photo', 'location', 'index' into unlabeled_faces() and
+        the store's 'face_id'.
+
+        Args:
+            store (FaceStore): The explorer's face database
+            **options: Passed on to FaceMatchIndex (mode, quantizer, pq_bytes, rerank)
+        """
+        encodings, entries = database_faces(store)
+        return cls(encodings, entries, **options)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def memory_bytes(self):
+        """Bytes held by the index's own encoding storage"""
+        if self.codes is not None:
+            return self.codes.nbytes + self.quantizer.codebooks.nbytes
+        return self.encodings.nbytes
+
+    def _squared_distances(self, query):
+        if self.mode == 'pq':
+            return self.quantizer.distances(self.quantizer.distance_table(query), self.codes)
+        if self.mode == 'float32':
+            diff = self.encodings - query
+            return np.einsum('ij,ij->i', diff, diff)
+        out = np.empty(len(self.encodings), dtype=np.float32)
+        for start in range(0, len(self.encodings), _CHUNK_ROWS):
+            diff = self.encodings[start:start + _CHUNK_ROWS].astype(np.float32) - query
+            out[start:start + _CHUNK_ROWS] = np.einsum('ij,ij->i', diff, diff)
+        return out
+
+    def search(self, encoding, k=10, max_distance=None):
+        """
+        Find the faces closest to a query encoding
+
+        Args:
+            encoding (array-like): Query face encoding
+            k (int): Number of results
+            max_distance (float, optional): Drop results further than this
+
+        Returns:
+            list: (distance, entry) pairs, closest first
+        """
+        if not self.entries:
+            return []
+        query = np.asarray(encoding, dtype=np.float32)
+        distances = self._squared_distances(query)
+
+        # Compact modes shortlist candidates, then re-rank them exactly
+        shortlist = k if self.mode == 'float32' else max(k, self.rerank)
+        shortlist = min(shortlist, len(distances))
+        nearest = np.argpartition(distances, shortlist - 1)[:shortlist]
+        if self.mode == 'float32':
+            distances = np.sqrt(distances[nearest])
+        else:
+            exact = np.asarray([self._exact[i] for i in nearest], dtype=np.float32)
+            distances = np.linalg.norm(exact - query, axis=1)
+        order = np.argsort(distances)[:k]
+
+        results = []
+        for i in order:
+            distance = float(distances[i])
+            if max_distance is not None and distance > max_distance:
+                break
+            results.append((distance, self.entries[nearest[i]]))
+        return results
+
+
+def database_faces(store):
+    """
+    Every encoding of a database with a description of its face
+
+    Returns:
+        tuple: (list of encodings, list of entry dicts), see
+        FaceMatchIndex.from_database
+    """
+    encodings = []
+    entries = []
+    for name, person_encodings in store.reference_encodings().items():
+        for encoding in person_encodings:
+            encodings.append(encoding)
+            entries.append({'name': name})
+    for index, (face_id, photo_path, encoding, face_location) in enumerate(store.unlabeled_faces()):
+        encodings.append(encoding)
+        entries.append({'name': None, 'photo': photo_path,
+                        'location': [int(v) for v in face_location], 'index': index,
+                        'face_id': face_id})
+    return encodings, entries
+
+
+def compare_match_modes(store, modes=('float16', 'pq'), queries=200, k=10,
+                        tolerance=0.6, pq_bytes=16, seed=0):
+    """
+    Measure memory and match agreement of compact modes against exact float32
+
+    Each query is a face from the database itself, left out of its own results.
+
+    Args:
+        store (FaceStore): The explorer's face database
+        modes (iterable): Modes to compare with the float32 baseline
+        queries (int): Faces sampled as queries
+        k (int): Neighbours compared per query
+        tolerance (float): Distance below which the nearest face is a match
+        pq_bytes (int): Bytes per face in 'pq' mode
+        seed (int): Seed for sampling queries
+
+    Returns:
+        dict: 'faces', 'database_bytes' (the encodings as stored in the
+        database, including per-array overhead) and 'modes', a list of dicts
+        with 'mode', 'bytes', 'build_seconds', 'query_ms', 'recall' (share of
+        the exact k nearest that were found), 'top1' (same nearest face) and
+        'decisions' (same match/no-match outcome at tolerance)
+    """
+    encodings, entries = database_faces(store)
+    report = {'faces': len(entries), 'database_bytes': sum(sys.getsizeof(e) for e in encodings),
+              'modes': []}
+    if len(entries) < 2:
+        return report
+
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(len(entries), min(queries, len(entries)), replace=False)
+    k = min(k, len(entries) - 1)
+
+    def neighbours(index, i):
+        # One extra result, since the query finds itself
+        found = [entry for _, entry in index.search(encodings[i], k + 1) if entry is not entries[i]]
+        return found[:k]
+
+    def nearest_distance(index, i):
+        for distance, entry in index.search(encodings[i], 2):
+            if entry is not entries[i]:
+                return distance
+        return None
+
+    started = time.perf_counter()
+    baseline = FaceMatchIndex(encodings, entries)
+    baseline_seconds = time.perf_counter() - started
+    exact = {i: neighbours(baseline, i) for i in sample}
+    exact_match = {i: (nearest_distance(baseline, i) or np.inf) <= tolerance for i in sample}
+
+    for mode in ('float32',) + tuple(modes):
+        if mode == 'float32':
+            index, build_seconds = baseline, baseline_seconds
+        else:
+            started = time.perf_counter()
+            index = FaceMatchIndex(encodings, entries, mode=mode, pq_bytes=pq_bytes)
+            build_seconds = time.perf_counter() - started
+
+        found = 0
+        top1 = 0
+        decisions = 0
+        started = time.perf_counter()
+        for i in sample:
+            result = neighbours(index, i)
+            expected = {id(entry) for entry in exact[i]}
+            found += sum(1 for entry in result if id(entry) in expected)
+            top1 += bool(result) and bool(exact[i]) and result[0] is exact[i][0]
+            decisions += ((nearest_distance(index, i) or np.inf) <= tolerance) == exact_match[i]
+        query_ms = (time.perf_counter() - started) * 1000 / len(sample) / 2
+
+        report['modes'].append({
+            'mode': mode, 'bytes': index.memory_bytes(), 'build_seconds': build_seconds,
+            'query_ms': query_ms, 'recall': found / (k * len(sample)),
+            'top1': top1 / len(sample), 'decisions': decisions / len(sample)
+        })
+    return report
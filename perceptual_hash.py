@@ -0,0 +1,172 @@
+"""
+Perceptual hashing for near-duplicate photos
+
+Burst shots and continuous shooting produce runs of nearly identical frames.
+Each photo gets a 64-bit perceptual hash computed from a tiny thumbnail, and
+a multi-index hash table finds earlier photos within a small Hamming
+distance without comparing against every hash seen so far.
+"""
+
+import io
+import threading
+
+import cv2
+import numpy as np
+from PIL import Image
+
+HASH_BITS = 64
+HASH_METHODS = ('dhash', 'phash')
+
+
+def _thumbnail(data, size):
+    """Decode raw image bytes straight to a small grayscale array"""
+    with Image.open(io.BytesIO(data)) as image:
+        full_size = image.size
+        # Lets the JPEG decoder scale down while decoding, which is far
+        # cheaper than decoding the whole image and resizing it
+        image.draft('L', (size[0] * 4, size[1] * 4))
+        thumb = image.convert('L').resize(size, Image.BILINEAR)
+        return np.asarray(thumb, dtype=np.float32), full_size
+
+
+def _bits_to_int(bits):
+    value = 0
+    for bit in bits.flatten():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def dhash(pixels):
+    """Difference hash of a 9x8 grayscale array"""
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def phash(pixels):
+    """DCT hash of a 32x32 grayscale array"""
+    low = cv2.dct(pixels)[:8, :8]
+    return _bits_to_int(low > np.median(low))
+
+
+def image_hash(data, method='dhash'):
+    """
+    Compute a perceptual hash from raw image bytes
+
+    Args:
+        data (bytes): Encoded image file contents
+        method (str): 'dhash' or 'phash'
+
+    Returns:
+        tuple: (64-bit hash, (width, height) of the full image)
+    """
+    if method == 'dhash':
+        pixels, full_size = _thumbnail(data, (9, 8))
+        return dhash(pixels), full_size
+    if method == 'phash':
+        pixels, full_size = _thumbnail(data, (32, 32))
+        return phash(pixels), full_size
+    raise ValueError(f"Unknown hash method '{method}' (expected one of {', '.join(HASH_METHODS)})")
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+def remap_location(face_location, from_size, to_size):
+    """
+    Scale a (top, right, bottom, left) box between two image sizes
+
+    Args:
+        face_location (tuple): Box in the reference image
+        from_size (tuple): (width, height) of the reference image
+        to_size (tuple): (width, height) of the near-duplicate
+
+    Returns:
+        tuple: Box in the near-duplicate's coordinates
+    """
+    if from_size == to_size:
+        return tuple(face_location)
+
+    scale_x = to_size[0] / from_size[0]
+    scale_y = to_size[1] / from_size[1]
+    top, right, bottom, left = face_location
+    return (
+        min(to_size[1], max(0, int(round(top * scale_y)))),
+        min(to_size[0], max(0, int(round(right * scale_x)))),
+        min(to_size[1], max(0, int(round(bottom * scale_y)))),
+        min(to_size[0], max(0, int(round(left * scale_x)))),
+    )
+
+
+class HashEntry:
+    """A photo whose face results near-duplicates can reuse"""
+
+    __slots__ = ('rel_path', 'size', 'face_locations', 'face_encodings', 'resolved', 'failed')
+
+    def __init__(self, rel_path, size):
+        self.rel_path = rel_path
+        self.size = size
+        self.face_locations = []
+        self.face_encodings = []
+        self.resolved = False   # set once the photo's results are committed
+        self.failed = False
+
+
+class HashIndex:
+    """
+    Multi-index hash table for Hamming-distance lookups
+
+    Hashes are split into max_distance + 1 bands. Two hashes within
+    max_distance bits of each other must agree exactly on at least one
+    band, so only photos sharing a band are compared.
+    """
+
+    def __init__(self, max_distance=4):
+        """
+        Args:
+            max_distance (int): Largest Hamming distance treated as a duplicate
+        """
+        self.max_distance = max(0, int(max_distance))
+        bands = self.max_distance + 1
+        width = HASH_BITS // bands
+        self._bands = []
+        for i in range(bands):
+            start = i * width
+            end = HASH_BITS if i == bands - 1 else start + width
+            self._bands.append((start, (1 << (end - start)) - 1))
+        self._tables = [{} for _ in self._bands]
+        self._lock = threading.Lock()
+        self.size = 0
+
+    def _keys(self, value):
+        return [(value >> shift) & mask for shift, mask in self._bands]
+
+    def _find(self, value, keys):
+        best, best_distance = None, self.max_distance + 1
+        for table, key in zip(self._tables, keys):
+            for other, entry in table.get(key, ()):
+                distance = hamming_distance(value, other)
+                if distance < best_distance:
+                    best, best_distance = entry, distance
+        return best
+
+    def find(self, value):
+        """Closest indexed entry within max_distance, or None"""
+        with self._lock:
+            return self._find(value, self._keys(value))
+
+    def find_or_add(self, value, entry):
+        """
+        Look up a hash and index it if no near-duplicate exists
+
+        Returns:
+            HashEntry: The existing near-duplicate, or None if entry was added
+        """
+        keys = self._keys(value)
+        with self._lock:
+            existing = self._find(value, keys)
+            if existing is not None:
+                return existing
+            for table, key in zip(self._tables, keys):
+                table.setdefault(key, []).append((value, entry))
+            self.size += 1
+            return None
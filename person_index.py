@@ -0,0 +1,245 @@
+"""
+Inverted person -> photo index for Face Recognition File Explorer
+
+Every photo with a labeled face gets a small integer ID, and every person
+gets a sorted int32 array of the IDs of their photos (a posting list).
+Boolean queries such as ``Alice AND Bob AND NOT Carol`` are answered by
+intersecting and subtracting those arrays instead of walking photo_faces.
+"""
+
+import re
+
+import numpy as np
+
+KEYWORDS = ('AND', 'OR', 'NOT')
+
+_TOKEN_RE = re.compile(r'\(|\)|"[^"]*"|\'[^\']*\'|[^\s()]+')
+
+_EMPTY = np.zeros(0, dtype=np.int32)
+
+
+def _contains(haystack, needles):
+    """Mask of needles found in haystack (both sorted int32 arrays)"""
+    if len(haystack) == 0 or len(needles) == 0:
+        return np.zeros(len(needles), dtype=bool)
+    # Binary search each needle: cheap when needles is much shorter
+    positions = np.minimum(np.searchsorted(haystack, needles), len(haystack) - 1)
+    return haystack[positions] == needles
+
+
+def intersect(a, b):
+    """Photo IDs in both sorted posting lists"""
+    if len(a) > len(b):
+        a, b = b, a
+    return a[_contains(b, a)]
+
+
+def subtract(a, b):
+    """Photo IDs in a but not in b"""
+    return a[~_contains(b, a)]
+
+
+def parse_query(expression):
+    """
+    Parse a boolean person query into a tree
+
+    Names are quoted ("Mary Ann") or bare words; consecutive bare words
+    form one name, so ``John Doe AND Alice`` works without quotes. AND
+    binds tighter than OR, and parentheses group.
+
+    Args:
+        expression (str): e.g. 'Alice AND (Bob OR Dave) AND NOT Carol'
+
+    Returns:
+        tuple: ('name', str), ('not', node), ('and', [nodes]) or ('or', [nodes])
+    """
+    tokens = _TOKEN_RE.findall(expression)
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else None
+
+    def take():
+        nonlocal position
+        token = peek()
+        position += 1
+        return token
+
+    def parse_or():
+        nodes = [parse_and()]
+        while peek() == 'OR':
+            take()
+            nodes.append(parse_and())
+        return nodes[0] if len(nodes) == 1 else ('or', nodes)
+
+    def parse_and():
+        nodes = [parse_not()]
+        while peek() == 'AND':
+            take()
+            nodes.append(parse_not())
+        return nodes[0] if len(nodes) == 1 else ('and', nodes)
+
+    def parse_not():
+        token = peek()
+        if token == 'NOT':
+            take()
+            return ('not', parse_not())
+        if token == '(':
+            take()
+            node = parse_or()
+            if take() != ')':
+                raise ValueError(f"Missing ')' in query: {expression}")
+            return node
+        if token is None or token in KEYWORDS or token == ')':
+            raise ValueError(f"Expected a name at '{token or 'end of query'}' in: {expression}")
+        if token[0] in '"\'':
+            take()
+            return ('name', token[1:-1])
+        words = []
+        while peek() is not None and peek() not in KEYWORDS and peek() not in '()':
+            words.append(take())
+        return ('name', ' '.join(words))
+
+    node = parse_or()
+    if peek() is not None:
+        raise ValueError(f"Unexpected '{peek()}' in query: {expression}")
+    return node
+
+
+def query_names(node):
+    """All person names mentioned in a parsed query"""
+    if node[0] == 'name':
+        return [node[1]]
+    if node[0] == 'not':
+        return query_names(node[1])
+    return [name for child in node[1] for name in query_names(child)]
+
+
+class PersonIndex:
+    """Posting lists of photo IDs per person, updated as faces are labeled"""
+
+    def __init__(self):
+        self.photo_paths = []  # photo ID -> photo key
+        self.photo_ids = {}  # photo key -> photo ID
+        self._postings = {}  # name -> sorted int32 array of photo IDs
+        self._pending = {}  # name -> photo IDs added since the last merge
+        self._universe = None  # every indexed photo ID, rebuilt when needed
+
+    @classmethod
+    def from_photo_faces(cls, photo_faces):
+        """Build an index from a database's photo_faces mapping"""
+        index = cls()
+        for photo_path, faces in photo_faces.items():
+            for name, _ in faces:
+                index.add(name, photo_path)
+        return index
+
+    @classmethod
+    def from_state(cls, state):
+        """Restore an index saved with state()"""
+        index = cls()
+        index.photo_paths = list(state['photos'])
+        index.photo_ids = {photo_path: i for i, photo_path in enumerate(index.photo_paths)}
+        index._postings = {name: np.asarray(ids, dtype=np.int32)
+                           for name, ids in state['postings'].items()}
+        return index
+
+    def state(self):
+        """Plain data for storing the index alongside the face database"""
+        return {'photos': list(self.photo_paths),
+                'postings': {name: self.postings(name) for name in self.people()}}
+
+    def clear(self):
+        self.__init__()
+
+    def _photo_id(self, photo_path):
+        photo_id = self.photo_ids.get(photo_path)
+        if photo_id is None:
+            photo_id = len(self.photo_paths)
+            self.photo_paths.append(photo_path)
+            self.photo_ids[photo_path] = photo_id
+        return photo_id
+
+    def add(self, name, photo_path):
+        """Record that name appears in photo_path"""
+        self._pending.setdefault(name, []).append(self._photo_id(photo_path))
+        self._universe = None
+
+    def remove(self, name, photo_path):
+        """Record that name no longer appears in photo_path"""
+        photo_id = self.photo_ids.get(photo_path)
+        if photo_id is None or name not in self._postings and name not in self._pending:
+            return
+        ids = self.postings(name)
+        ids = ids[ids != photo_id]
+        if len(ids):
+            self._postings[name] = ids
+        else:
+            del self._postings[name]
+        self._universe = None
+
+    def postings(self, name):
+        """Sorted int32 photo IDs of a person (empty if unknown)"""
+        pending = self._pending.pop(name, None)
+        if pending:
+            merged = np.union1d(self._postings.get(name, _EMPTY), np.asarray(pending, dtype=np.int32))
+            self._postings[name] = merged.astype(np.int32, copy=False)
+        return self._postings.get(name, _EMPTY)
+
+    def people(self):
+        return sorted(set(self._postings) | set(self._pending))
+
+    def count(self, name):
+        return len(self.postings(name))
+
+    def photos(self, name):
+        """Photo keys of a person, in the order they were first indexed"""
+        return [self.photo_paths[i] for i in self.postings(name)]
+
+    def person_photos(self):
+        """dict name -> photo keys, for every indexed person"""
+        return {name: self.photos(name) for name in self.people()}
+
+    def universe(self):
+        """IDs of every photo that has at least one labeled person"""
+        if self._universe is None:
+            lists = [self.postings(name) for name in self.people()]
+            self._universe = np.unique(np.concatenate(lists)) if lists else _EMPTY
+        return self._universe
+
+    def evaluate(self, node):
+        """Photo IDs matching a parsed query"""
+        kind = node[0]
+        if kind == 'name':
+            return self.postings(node[1])
+        if kind == 'not':
+            return subtract(self.universe(), self.evaluate(node[1]))
+        if kind == 'or':
+            result = _EMPTY
+            for child in node[1]:
+                result = np.union1d(result, self.evaluate(child)).astype(np.int32, copy=False)
+            return result
+
+        # AND: intersect the positive terms shortest first, then remove negatives
+        positives = sorted((self.evaluate(child) for child in node[1] if child[0] != 'not'), key=len)
+        negatives = [self.evaluate(child[1]) for child in node[1] if child[0] == 'not']
+        result = positives[0] if positives else self.universe()
+        for ids in positives[1:]:
+            if not len(result):
+                break
+            result = intersect(result, ids)
+        for ids in negatives:
+            result = subtract(result, ids)
+        return result
+
+    def query(self, expression):
+        """
+        Photos matching a boolean expression of person names
+
+        Args:
+            expression (str): e.g. 'Alice AND Bob AND NOT Carol'
+
+        Returns:
+            list: Matching photo keys
+        """
+        return [self.photo_paths[i] for i in self.evaluate(parse_query(expression))]
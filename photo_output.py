@@ -0,0 +1,220 @@
+"""
+Incremental photo output for Face Recognition File Explorer
+
+Places photos into an output tree (per-person folders, search-file copies)
+using hardlinks, symlinks, reflinks or plain copies. A manifest stored in
+the output directory remembers what was placed from where, so a rerun only
+adds new photos, refreshes changed ones and removes stale ones.
+"""
+
+import concurrent.futures
+import errno
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+from photo_sources import is_video, split_archive_path
+
+OUTPUT_MODES = ('auto', 'reflink', 'hardlink', 'symlink', 'copy')
+
+MANIFEST_NAME = '.output_manifest.json'
+
+# ioctl request number for FICLONE on Linux (btrfs, xfs, ...)
+_FICLONE = 0x40049409
+
+
+def output_name(photo_path):
+    """
+    Stable, collision-free file name for a photo in a flat output folder
+
+    Args:
+        photo_path (str): Photo key, relative to the photos directory
+
+    Returns:
+        str: e.g. 'img_001_3fa2c1d0.jpg'
+    """
+    name = Path(str(photo_path).replace('\\', '/').split('/')[-1])
+    video, seconds = split_archive_path(photo_path)
+    if seconds is not None and is_video(video):
+        # Frames of videos are written out as JPEGs named after the video
+        video_name = Path(video.replace('\\', '/')).stem
+        name = Path(f"{video_name}_{seconds.replace('.', '_')}s.jpg")
+    digest = hashlib.sha1(str(photo_path).encode('utf-8')).hexdigest()[:8]
+    return f"{name.stem}_{digest}{name.suffix}"
+
+
+def _reflink(src, dst):
+    import fcntl
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+
+
+def place_file(src, dst, mode='auto'):
+    """
+    Make dst refer to the contents of src
+
+    Args:
+        src (Path): Existing source file
+        dst (Path): Destination path (must not exist)
+        mode (str): One of OUTPUT_MODES. 'auto' tries reflink, then
+            hardlink, then copy
+
+    Returns:
+        str: The mode that was actually used
+    """
+    if mode == 'symlink':
+        os.symlink(os.path.abspath(src), dst)
+        return 'symlink'
+
+    if mode in ('auto', 'reflink'):
+        try:
+            _reflink(src, dst)
+            return 'reflink'
+        except (OSError, ImportError):
+            # Not supported here; don't leave an empty file behind
+            if os.path.exists(dst):
+                os.remove(dst)
+            if mode == 'reflink':
+                shutil.copy2(src, dst)
+                return 'copy'
+
+    if mode in ('auto', 'hardlink'):
+        try:
+            os.link(src, dst)
+            return 'hardlink'
+        except OSError as e:
+            # Different filesystem or no link support: fall back to a copy
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP, errno.EACCES):
+                raise
+
+    shutil.copy2(src, dst)
+    return 'copy'
+
+
+def source_signature(reader, photo_path):
+    """Size and mtime of the file a photo lives in (the archive for members)"""
+    path = reader.local_path(photo_path)
+    if path is None:
+        path = reader.photos_dir / split_archive_path(photo_path)[0]
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class OutputManifest:
+    """Record of files placed in an output directory"""
+
+    def __init__(self, output_dir, name=MANIFEST_NAME):
+        self.path = Path(output_dir) / name
+        self.files = {}  # output path (relative) -> {'source', 'signature', 'requested', 'mode'}
+        if self.path.exists():
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.files = json.load(f).get('files', {})
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable manifest {self.path}: {e}")
+
+    def save(self):
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'files': self.files}, f)
+        os.replace(tmp_path, self.path)
+
+
+def sync_outputs(output_dir, wanted, reader, mode='auto', max_workers=None,
+                 manifest_name=MANIFEST_NAME, cancel_event=None, progress=None):
+    """
+    Bring an output directory in line with the files it should contain
+
+    Args:
+        output_dir (Path): Directory to place files in
+        wanted (dict): Output path relative to output_dir -> photo key
+        reader (PhotoReader): Reads photos, including archive members
+        mode (str): One of OUTPUT_MODES
+        max_workers (int, optional): Threads placing files in parallel
+        manifest_name (str): File name of the manifest in output_dir
+        cancel_event (threading.Event, optional): Stop placing files once set;
+            files placed so far are kept in the manifest
+        progress (callable, optional): Called as progress(done, total)
+
+    Returns:
+        dict: Counts of 'added', 'updated', 'removed', 'unchanged' and 'errors'
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest = OutputManifest(output_dir, manifest_name)
+    stats = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0, 'errors': 0}
+
+    # Remove files that are no longer wanted
+    for rel_dst in list(manifest.files):
+        if rel_dst not in wanted:
+            dst = output_dir / rel_dst
+            try:
+                if dst.is_symlink() or dst.exists():
+                    dst.unlink()
+                stats['removed'] += 1
+            except OSError as e:
+                print(f"  Error removing {dst}: {e}")
+                stats['errors'] += 1
+                continue
+            del manifest.files[rel_dst]
+
+    # Work out which wanted files are missing or out of date
+    todo = []
+    for rel_dst, photo_path in wanted.items():
+        try:
+            signature = source_signature(reader, photo_path)
+        except OSError:
+            print(f"  Source photo not found: {reader.photos_dir / photo_path}")
+            stats['errors'] += 1
+            continue
+        entry = manifest.files.get(rel_dst)
+        dst = output_dir / rel_dst
+        if (entry and entry['source'] == photo_path and entry['signature'] == signature
+                and entry.get('requested') == mode and (dst.exists() or dst.is_symlink())):
+            stats['unchanged'] += 1
+        else:
+            todo.append((rel_dst, photo_path, signature, entry is not None))
+
+    def place(rel_dst, photo_path):
+        dst = output_dir / rel_dst
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        if dst.exists() or dst.is_symlink():
+            dst.unlink()
+        src = reader.local_path(photo_path)
+        if src is None:
+            # Archive members can't be linked, only extracted
+            with open(dst, 'wb') as f:
+                f.write(reader.read_bytes(photo_path))
+            return 'copy'
+        return place_file(src, dst, mode)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(place, rel_dst, photo_path): (rel_dst, photo_path, signature, existed)
+            for rel_dst, photo_path, signature, existed in todo
+        }
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            if cancel_event is not None and cancel_event.is_set():
+                # Drop work that hasn't started; running placements finish
+                for pending in futures:
+                    pending.cancel()
+            if future.cancelled():
+                continue
+            if progress is not None:
+                progress(done, len(futures))
+            rel_dst, photo_path, signature, existed = futures[future]
+            try:
+                used_mode = future.result()
+            except Exception as e:
+                print(f"  Error placing {photo_path}: {e}")
+                stats['errors'] += 1
+                manifest.files.pop(rel_dst, None)
+                continue
+            manifest.files[rel_dst] = {'source': photo_path, 'signature': signature,
+                                       'requested': mode, 'mode': used_mode}
+            stats['updated' if existed else 'added'] += 1
+
+    manifest.save()
+    return stats
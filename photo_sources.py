@@ -0,0 +1,281 @@
+"""
+Photo sources for Face Recognition File Explorer
+
+Zip and tar archives inside the photos directory are treated as virtual
+directories. Their members are streamed straight out of the archive during
+a scan, and are addressed everywhere else by keys like
+``2019/holiday.zip!/beach/img_001.jpg`` so grouping, visualization and
+galleries can read them on demand without extracting anything to disk.
+
+Frames of videos are addressed the same way, by keys like
+``clips/party.mp4#t=12.400`` holding the frame's time in seconds, and are
+decoded from the video when read.
+"""
+
+import contextlib
+import io
+import os
+import tarfile
+import threading
+import zipfile
+from collections import OrderedDict
+from pathlib import Path
+
+import cv2
+
+# Separates the archive's path from the member's path inside it
+ARCHIVE_SEPARATOR = '!/'
+
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+# Separates a video's path from the time of one of its frames
+VIDEO_SEPARATOR = '#t='
+
+VIDEO_SUFFIXES = ('.mp4', '.mov', '.m4v', '.avi', '.mkv', '.3gp', '.webm', '.mts')
+
+
+def is_archive(path):
+    """Whether a file name looks like a supported archive"""
+    name = str(path).lower()
+    return name.endswith(ARCHIVE_SUFFIXES)
+
+
+def is_video(path):
+    """Whether a file name looks like a supported video"""
+    return str(path).lower().endswith(VIDEO_SUFFIXES)
+
+
+def split_archive_path(rel_path):
+    """
+    Split a photo key into its archive and member parts
+
+    Frames of videos split the same way, into the video and the frame's
+    time in seconds. A separator only counts after an archive or video
+    name, so folders like ``Party!/`` stay part of an ordinary path.
+
+    Returns:
+        tuple: (archive_rel_path, member_name), or (rel_path, None) for
+        photos that are ordinary files
+    """
+    key = str(rel_path)
+    start = 0
+    while True:
+        found = [(key.find(separator, start), separator) for separator in (ARCHIVE_SEPARATOR, VIDEO_SEPARATOR)]
+        found = [(index, separator) for index, separator in found if index >= 0]
+        if not found:
+            return key, None
+        index, separator = min(found)
+        prefix = key[:index]
+        if is_archive(prefix) if separator == ARCHIVE_SEPARATOR else is_video(prefix):
+            return prefix, key[index + len(separator):]
+        start = index + 1
+
+
+def member_key(archive_rel_path, member_name):
+    """Photo key for a member inside an archive"""
+    return f"{archive_rel_path}{ARCHIVE_SEPARATOR}{member_name}"
+
+
+def frame_key(video_rel_path, seconds):
+    """Photo key for the frame of a video at a given time"""
+    return f"{video_rel_path}{VIDEO_SEPARATOR}{seconds:.3f}"
+
+
+def read_video_frame(video_path, seconds):
+    """
+    Decode the frame of a video shown at a given time
+
+    Returns:
+        ndarray: The frame as BGR pixels
+    """
+    capture = cv2.VideoCapture(str(video_path))
+    try:
+        if not capture.isOpened():
+            raise OSError(f"Can't open video {video_path}")
+        capture.set(cv2.CAP_PROP_POS_MSEC, float(seconds) * 1000)
+        ok, frame = capture.read()
+        if not ok:
+            raise OSError(f"No frame at {seconds}s in {video_path}")
+        return frame
+    finally:
+        capture.release()
+
+
+def iter_archive_members(archive_path, extensions):
+    """
+    Stream image members out of an archive in a single sequential pass
+
+    Args:
+        archive_path (Path): Archive file to read
+        extensions (tuple): Lower-case file extensions to yield
+
+    Yields:
+        tuple: (member_name, bytes)
+    """
+    def wanted(name):
+        return os.path.splitext(name)[1].lower() in extensions
+
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as zf:
+            # Reading in the order members are stored keeps the file read
+            # sequential, whatever order the central directory lists them in
+            members = sorted(
+                (info for info in zf.infolist() if not info.is_dir() and wanted(info.filename)),
+                key=lambda info: info.header_offset
+            )
+            for info in members:
+                yield info.filename, zf.read(info)
+        return
+
+    # Stream mode never seeks, so compressed tars are read exactly once
+    with tarfile.open(archive_path, 'r|*') as tf:
+        for info in tf:
+            if not info.isfile() or not wanted(info.name):
+                continue
+            f = tf.extractfile(info)
+            if f is not None:
+                yield info.name, f.read()
+
+
+class _OpenArchive:
+    """An archive kept open for random access to its members"""
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        # Reads in progress, and whether the archive has left the reader's
+        # cache; the last read of an evicted archive closes it
+        self.users = 0
+        self.evicted = False
+        if zipfile.is_zipfile(path):
+            self.zip = zipfile.ZipFile(path)
+            self.tar = None
+        else:
+            self.zip = None
+            self.tar = tarfile.open(path, 'r:*')
+
+    def read(self, member):
+        with self.lock:
+            if self.zip is not None:
+                return self.zip.read(member)
+            f = self.tar.extractfile(member)
+            if f is None:
+                raise KeyError(member)
+            return f.read()
+
+    def has(self, member):
+        with self.lock:
+            if self.zip is not None:
+                try:
+                    self.zip.getinfo(member)
+                    return True
+                except KeyError:
+                    return False
+            try:
+                self.tar.getmember(member)
+                return True
+            except KeyError:
+                return False
+
+    def close(self):
+        if self.zip is not None:
+            self.zip.close()
+        if self.tar is not None:
+            self.tar.close()
+
+
+class PhotoReader:
+    """
+    Read photos by key, whether they are files, archive members or frames of videos
+
+    Archives are opened lazily and a few are kept open so repeated reads
+    from the same archive don't reparse its index. An archive pushed out
+    while another thread reads from it is closed when that read finishes.
+    Random access into a
+    compressed tar has to decompress up to the member, so zip archives
+    are the better choice for libraries browsed this way.
+    """
+
+    def __init__(self, photos_dir, max_open_archives=8):
+        """
+        Args:
+            photos_dir (Path): Root the photo keys are relative to
+            max_open_archives (int): Archives kept open at the same time
+        """
+        self.photos_dir = Path(photos_dir)
+        self.max_open_archives = max_open_archives
+        self._archives = OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _archive(self, archive_rel_path):
+        """Open archive, kept open until the with block ends"""
+        with self._lock:
+            archive = self._archives.get(archive_rel_path)
+            if archive is not None:
+                self._archives.move_to_end(archive_rel_path)
+            else:
+                archive = _OpenArchive(self.photos_dir / archive_rel_path)
+                self._archives[archive_rel_path] = archive
+                while len(self._archives) > self.max_open_archives:
+                    _, oldest = self._archives.popitem(last=False)
+                    self._evict(oldest)
+            archive.users += 1
+        try:
+            yield archive
+        finally:
+            with self._lock:
+                archive.users -= 1
+                if archive.evicted and not archive.users:
+                    archive.close()
+
+    @staticmethod
+    def _evict(archive):
+        # Called with the lock held
+        archive.evicted = True
+        if not archive.users:
+            archive.close()
+
+    def local_path(self, rel_path):
+        """Filesystem path of a photo, or None if it lives inside an archive"""
+        archive, member = split_archive_path(rel_path)
+        if member is not None:
+            return None
+        return self.photos_dir / archive
+
+    def exists(self, rel_path):
+        archive, member = split_archive_path(rel_path)
+        path = self.photos_dir / archive
+        if member is None or is_video(archive):
+            return path.exists()
+        if not path.exists():
+            return False
+        try:
+            with self._archive(archive) as open_archive:
+                return open_archive.has(member)
+        except (OSError, tarfile.TarError, zipfile.BadZipFile):
+            return False
+
+    def read_bytes(self, rel_path):
+        """Raw file contents of a photo; frames of videos are returned as JPEG"""
+        archive, member = split_archive_path(rel_path)
+        if member is None:
+            with open(self.photos_dir / archive, 'rb') as f:
+                return f.read()
+        if is_video(archive):
+            frame = read_video_frame(self.photos_dir / archive, float(member))
+            return cv2.imencode('.jpg', frame)[1].tobytes()
+        with self._archive(archive) as open_archive:
+            return open_archive.read(member)
+
+    def open(self, rel_path):
+        """Binary file object for a photo, suitable for PIL.Image.open"""
+        path = self.local_path(rel_path)
+        if path is not None:
+            return open(path, 'rb')
+        return io.BytesIO(self.read_bytes(rel_path))
+
+    def close(self):
+        with self._lock:
+            for archive in self._archives.values():
+                self._evict(archive)
+            self._archives.clear()
@@ -0,0 +1,221 @@
+"""
+Capture-date timeline for Face Recognition File Explorer
+
+Capture time, camera and GPS position are read from a photo's EXIF header
+while it is scanned and kept in the database, so date-range questions
+("Alice, summer 2019") are answered from a sorted array of capture times
+without opening any image files again.
+"""
+
+import calendar
+import re
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# EXIF tags and sub-IFDs
+_EXIF_IFD = 0x8769
+_GPS_IFD = 0x8825
+_DATETIME_ORIGINAL = 36867
+_DATETIME_DIGITIZED = 36868
+_DATETIME = 306
+_MAKE = 271
+_MODEL = 272
+
+_EPOCH = datetime(1970, 1, 1)
+
+_DATE_RE = re.compile(r'^(\d{4})(?:-(\d{1,2})(?:-(\d{1,2})(?:[ T](\d{1,2}):(\d{2})(?::(\d{2}))?)?)?)?$')
+
+
+def _gps_degrees(value, ref):
+    degrees, minutes, seconds = (float(v) for v in value)
+    result = degrees + minutes / 60 + seconds / 3600
+    return -result if ref in ('S', 'W') else result
+
+
+def read_photo_metadata(image):
+    """
+    Pull capture time, camera and GPS position out of an opened image
+
+    Only the header is parsed; the pixels are never decoded.
+
+    Args:
+        image (PIL.Image.Image): Image opened with Image.open
+
+    Returns:
+        tuple: (taken, camera, latitude, longitude), where taken is seconds
+        since 1970 in the camera's local time; missing fields are None
+    """
+    try:
+        exif = image.getexif()
+    except Exception:
+        return (None, None, None, None)
+    if not exif:
+        return (None, None, None, None)
+
+    taken = None
+    exif_ifd = exif.get_ifd(_EXIF_IFD)
+    stamp = exif_ifd.get(_DATETIME_ORIGINAL) or exif_ifd.get(_DATETIME_DIGITIZED) or exif.get(_DATETIME)
+    if stamp:
+        try:
+            parsed = datetime.strptime(str(stamp).strip('\x00 ')[:19], '%Y:%m:%d %H:%M:%S')
+            taken = calendar.timegm(parsed.timetuple())
+        except ValueError:
+            pass
+
+    make = str(exif.get(_MAKE) or '').strip('\x00 ')
+    model = str(exif.get(_MODEL) or '').strip('\x00 ')
+    if make and model.lower().startswith(make.lower()):
+        make = ''
+    camera = ' '.join(part for part in (make, model) if part) or None
+
+    latitude = longitude = None
+    gps = exif.get_ifd(_GPS_IFD)
+    if gps and 2 in gps and 4 in gps:
+        try:
+            latitude = round(_gps_degrees(gps[2], gps.get(1)), 6)
+            longitude = round(_gps_degrees(gps[4], gps.get(3)), 6)
+        except (TypeError, ValueError, ZeroDivisionError):
+            latitude = longitude = None
+
+    return (taken, camera, latitude, longitude)
+
+
+def parse_date(text, end=False):
+    """
+    Parse a date such as '2019', '2019-07', '2019-07-14' or '2019-07-14 18:30'
+
+    Args:
+        text (str): Date to parse
+        end (bool): Return the end of the period the date names instead of
+            its start, so '2019-08' as an end date includes all of August
+
+    Returns:
+        int: Seconds since 1970, in the same local-time convention as
+        read_photo_metadata
+    """
+    match = _DATE_RE.match(text.strip())
+    if not match:
+        raise ValueError(f"Unrecognized date '{text}' (expected YYYY, YYYY-MM, YYYY-MM-DD or YYYY-MM-DD HH:MM)")
+    year, month, day, hour, minute, second = match.groups()
+    parts = [int(year), int(month or 1), int(day or 1), int(hour or 0), int(minute or 0), int(second or 0)]
+    start = datetime(*parts)
+    if not end:
+        return calendar.timegm(start.timetuple())
+
+    # Step to the start of the next period at the precision that was given
+    if second is not None:
+        step = 1
+    elif minute is not None:
+        step = 60
+    elif day is not None:
+        step = 86400
+    else:
+        if month is not None:
+            nxt = datetime(parts[0] + parts[1] // 12, parts[1] % 12 + 1, 1)
+        else:
+            nxt = datetime(parts[0] + 1, 1, 1)
+        return calendar.timegm(nxt.timetuple())
+    return calendar.timegm(start.timetuple()) + step
+
+
+class PhotoTimeline:
+    """Per-photo EXIF metadata plus a sorted capture-time index"""
+
+    def __init__(self):
+        self.records = {}  # photo key -> (taken, camera, latitude, longitude)
+        self._times = None  # sorted capture times, rebuilt after changes
+        self._photos = None  # photo keys in the same order as _times
+
+    @classmethod
+    def from_state(cls, state):
+        timeline = cls()
+        timeline.records = dict(state['records'])
+        return timeline
+
+    def state(self):
+        """Plain data for storing the timeline alongside the face database"""
+        return {'records': self.records}
+
+    def __contains__(self, photo_path):
+        return photo_path in self.records
+
+    def set(self, photo_path, metadata):
+        """Store the (taken, camera, latitude, longitude) tuple of a photo"""
+        self.records[photo_path] = tuple(metadata)
+        self._times = None
+
+    def get(self, photo_path):
+        """dict of a photo's metadata, empty if it has none"""
+        record = self.records.get(photo_path)
+        if record is None:
+            return {}
+        taken, camera, latitude, longitude = record
+        result = {}
+        if taken is not None:
+            result['taken'] = (_EPOCH + timedelta(seconds=taken)).isoformat()
+        if camera:
+            result['camera'] = camera
+        if latitude is not None:
+            result['gps'] = [latitude, longitude]
+        return result
+
+    def taken(self, photo_path):
+        record = self.records.get(photo_path)
+        return record[0] if record else None
+
+    def _index(self):
+        if self._times is None:
+            dated = sorted((record[0], photo_path) for photo_path, record in self.records.items()
+                           if record[0] is not None)
+            self._times = np.fromiter((t for t, _ in dated), dtype=np.int64, count=len(dated))
+            self._photos = [photo_path for _, photo_path in dated]
+        return self._times, self._photos
+
+    def between(self, start=None, end=None):
+        """
+        Photos taken in [start, end), oldest first
+
+        Args:
+            start (int, optional): Seconds since 1970, see parse_date
+            end (int, optional): Seconds since 1970, exclusive
+        """
+        times, photos = self._index()
+        lo = 0 if start is None else int(np.searchsorted(times, start, 'left'))
+        hi = len(times) if end is None else int(np.searchsorted(times, end, 'left'))
+        return photos[lo:hi]
+
+    def filter(self, photo_paths, start=None, end=None):
+        """Those of photo_paths taken in [start, end), oldest first"""
+        dated = []
+        for photo_path in photo_paths:
+            taken = self.taken(photo_path)
+            if taken is None or (start is not None and taken < start) or (end is not None and taken >= end):
+                continue
+            dated.append((taken, photo_path))
+        dated.sort()
+        return [photo_path for _, photo_path in dated]
+
+
+def select_photos(person_index, timeline, expression=None, since=None, until=None):
+    """
+    Photos matching a person query and/or a capture date range
+
+    Args:
+        person_index (PersonIndex): Answers the person query
+        timeline (PhotoTimeline): Answers the date range
+        expression (str, optional): e.g. 'Alice AND NOT Bob'
+        since (str, optional): Earliest capture date, see parse_date
+        until (str, optional): Latest capture date, inclusive
+
+    Returns:
+        list: Photo keys, oldest first when a date range is given
+    """
+    if not (since or until):
+        return person_index.query(expression) if expression else []
+
+    start = parse_date(since) if since else None
+    end = parse_date(until, end=True) if until else None
+    if not expression:
+        return timeline.between(start, end)
+    return timeline.filter(person_index.query(expression), start, end)
@@ -0,0 +1,252 @@
+"""
+Adaptive resource governor for Face Recognition File Explorer
+
+Watches the process RSS, available system memory and load average while a
+scan or recognition pass runs, and scales the number of active compute
+workers between user-set limits. When memory gets tight it also pauses
+ingestion so no new photos are read until in-flight work drains.
+"""
+
+import os
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def _read_meminfo():
+    """Parse /proc/meminfo into a dict of kB values"""
+    values = {}
+    with open('/proc/meminfo') as f:
+        for line in f:
+            key, _, rest = line.partition(':')
+            parts = rest.split()
+            if parts:
+                values[key] = int(parts[0])
+    return values
+
+
+def available_memory_mb():
+    """Memory available to new allocations, in MB (None if unknown)"""
+    if psutil is not None:
+        return psutil.virtual_memory().available / (1024 * 1024)
+    try:
+        meminfo = _read_meminfo()
+        return meminfo.get('MemAvailable', meminfo.get('MemFree', 0)) / 1024
+    except OSError:
+        return None
+
+
+def process_rss_mb():
+    """Resident set size of this process, in MB (None if unknown)"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def load_per_cpu():
+    """One-minute load average divided by the CPU count (None if unknown)"""
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (OSError, AttributeError):
+        return None
+
+
+class WorkerGate:
+    """Context manager limiting how many workers compute at the same time"""
+
+    def __init__(self, limit):
+        self.limit = max(1, int(limit))
+        self.active = 0
+        self._cond = threading.Condition()
+
+    def set_limit(self, limit):
+        with self._cond:
+            self.limit = max(1, int(limit))
+            self._cond.notify_all()
+
+    def __enter__(self):
+        with self._cond:
+            while self.active >= self.limit:
+                self._cond.wait()
+            self.active += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+        return False
+
+
+class ResourceGovernor:
+    """
+    Scale active workers up and down based on CPU and memory pressure
+
+    The governor samples resources every ``interval`` seconds from a
+    background thread. Every decision that changes the worker count or
+    pauses ingestion is recorded together with its reason.
+    """
+
+    def __init__(self, min_workers=1, max_workers=None, min_free_mb=1024,
+                 pause_free_mb=512, max_rss_mb=None, max_load=1.0, interval=2.0):
+        """
+        Args:
+            min_workers (int): Never run fewer compute workers than this
+            max_workers (int, optional): Never run more (default: CPU count)
+            min_free_mb (float): Shed workers when available memory drops below this
+            pause_free_mb (float): Pause ingestion when available memory drops below this
+            max_rss_mb (float, optional): Shed workers and pause when RSS exceeds this
+            max_load (float): Shed workers when load per CPU exceeds this
+            interval (float): Seconds between samples
+        """
+        self.min_workers = max(1, int(min_workers))
+        self.max_workers = max(self.min_workers, int(max_workers or os.cpu_count() or 1))
+        self.min_free_mb = min_free_mb
+        self.pause_free_mb = pause_free_mb
+        self.max_rss_mb = max_rss_mb
+        self.max_load = max_load
+        self.interval = interval
+
+        # Start small and ramp up while there is headroom
+        self.gate = WorkerGate(self.min_workers)
+        # Set while ingestion may continue, cleared to pause it
+        self.ingest_open = threading.Event()
+        self.ingest_open.set()
+
+        # Callable returning how many items are in flight; set by the pipeline
+        # so a pause never outlives the work it is waiting for
+        self.in_flight = None
+
+        self.history = []  # list of (elapsed seconds, workers, reason)
+        self.last_sample = {}
+        self._started_at = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def workers(self):
+        return self.gate.limit
+
+    @property
+    def paused(self):
+        return not self.ingest_open.is_set()
+
+    def start(self):
+        """Start sampling in a background thread"""
+        self._started_at = time.monotonic()
+        self._stop.clear()
+        self._record(self.gate.limit, f"start with {self.gate.limit} workers "
+                                      f"(limits {self.min_workers}-{self.max_workers})")
+        self._thread = threading.Thread(target=self._run, name="resource-governor")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling and reopen ingestion"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.ingest_open.set()
+
+    def wait_for_ingest(self):
+        """Block the caller while ingestion is paused"""
+        self.ingest_open.wait()
+
+    def sample(self):
+        """Take one resource sample"""
+        self.last_sample = {
+            'rss_mb': process_rss_mb(),
+            'available_mb': available_memory_mb(),
+            'load_per_cpu': load_per_cpu(),
+        }
+        return self.last_sample
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.adjust(self.sample())
+
+    def adjust(self, sample):
+        """
+        Apply one control step for a resource sample
+
+        Args:
+            sample (dict): Values as returned by sample()
+        """
+        available = sample.get('available_mb')
+        rss = sample.get('rss_mb')
+        load = sample.get('load_per_cpu')
+        workers = self.gate.limit
+
+        memory_critical = (
+            (available is not None and available < self.pause_free_mb) or
+            (rss is not None and self.max_rss_mb is not None and rss > self.max_rss_mb)
+        )
+
+        if memory_critical:
+            if workers > self.min_workers:
+                self._set_workers(self.min_workers, self._describe("memory critical", available, rss, load))
+            # Pausing only helps while there is in-flight work to drain
+            if self.in_flight is not None and self.in_flight() == 0:
+                if self.paused:
+                    self.ingest_open.set()
+                    self._record(self.gate.limit, self._describe("resume ingestion, nothing left to drain",
+                                                                 available, rss, load))
+                return
+            if not self.paused:
+                self.ingest_open.clear()
+                self._record(self.gate.limit, self._describe("pause ingestion", available, rss, load))
+            return
+
+        if self.paused:
+            self.ingest_open.set()
+            self._record(workers, self._describe("resume ingestion", available, rss, load))
+
+        if available is not None and available < self.min_free_mb:
+            if workers > self.min_workers:
+                self._set_workers(workers - 1, self._describe("low memory", available, rss, load))
+        elif load is not None and load > self.max_load:
+            if workers > self.min_workers:
+                self._set_workers(workers - 1, self._describe("high load", available, rss, load))
+        elif workers < self.max_workers:
+            self._set_workers(workers + 1, self._describe("headroom", available, rss, load))
+
+    def _set_workers(self, workers, reason):
+        self.gate.set_limit(workers)
+        self._record(self.gate.limit, reason)
+
+    def _record(self, workers, reason):
+        elapsed = time.monotonic() - self._started_at if self._started_at else 0.0
+        self.history.append((elapsed, workers, reason))
+
+    @staticmethod
+    def _describe(action, available, rss, load):
+        details = []
+        if available is not None:
+            details.append(f"available={available:.0f}MB")
+        if rss is not None:
+            details.append(f"rss={rss:.0f}MB")
+        if load is not None:
+            details.append(f"load/cpu={load:.2f}")
+        return f"{action} ({', '.join(details)})" if details else action
+
+    def format_stats(self, max_changes=20):
+        """Human readable summary of worker changes"""
+        lines = [f"Governor: {self.gate.limit} active workers "
+                 f"(limits {self.min_workers}-{self.max_workers}), "
+                 f"{len(self.history)} changes"]
+        shown = self.history[-max_changes:]
+        if len(shown) < len(self.history):
+            lines.append(f"  ... {len(self.history) - len(shown)} earlier changes omitted")
+        for elapsed, workers, reason in shown:
+            lines.append(f"  [{elapsed:7.1f}s] workers={workers:<3} {reason}")
+        return "\n".join(lines)
@@ -0,0 +1,648 @@
+"""
+Staged scan pipeline for Face Recognition File Explorer
+
+Photos flow through a fixed chain of stages (discovery -> read -> dedup ->
+decode -> detect -> quality -> encode -> commit). Every stage has its own pool of worker threads
+and stages are connected by bounded queues, so a slow stage pushes back on
+the ones before it instead of letting work pile up in memory. Decoded images
+are the expensive part, so they are additionally charged against a global
+memory budget before they are decoded. Very large images are never decoded
+whole; they are detected in tiles (see tiled_detection).
+
+The read stage is the pipeline's only I/O. Its readers run ahead of the
+decoders, holding raw file bytes in a read-ahead buffer bounded in bytes
+rather than photos, so network shares and spinning disks are kept busy
+while the CPU works on photos already read.
+"""
+
+import contextlib
+import io
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import face_recognition
+from PIL import Image
+
+from face_backends import DlibBackend
+from perceptual_hash import HashEntry, HashIndex, image_hash, remap_location
+from photo_timeline import read_photo_metadata
+from tiled_detection import (TILE_SIZE, TILE_THRESHOLD_MP, RegionReader, detect_faces_tiled,
+                             region_decoding_available, tile_memory)
+
+# Marks the end of the stream on a stage queue
+_SENTINEL = object()
+
+STAGE_NAMES = ('read', 'dedup', 'decode', 'detect', 'quality', 'encode')
+
+# Stages whose work is CPU bound and limited by the resource governor
+COMPUTE_STAGES = ('dedup', 'decode', 'detect', 'quality', 'encode')
+
+# Most photos the read-ahead buffer holds, however small they are
+READ_AHEAD_ITEMS = 256
+
+# Page cache hints; posix_fadvise is missing on Windows and macOS
+_FADVISE = hasattr(os, 'posix_fadvise')
+
+
+def default_stage_workers():
+    """Worker counts used for stages the caller doesn't configure"""
+    cpus = os.cpu_count() or 1
+    return {
+        'read': 2,
+        'dedup': 1,
+        'decode': max(1, cpus // 4),
+        'detect': max(1, cpus // 2),
+        'quality': max(1, cpus // 8),
+        'encode': max(1, cpus // 4),
+    }
+
+
+def parse_stage_workers(spec):
+    """
+    Parse a stage worker specification like "read=2,detect=8"
+
+    Args:
+        spec (str): Comma separated stage=count pairs
+
+    Returns:
+        dict: Stage name -> worker count
+    """
+    workers = {}
+    if not spec:
+        return workers
+
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, count = part.partition('=')
+        name = name.strip()
+        if name not in STAGE_NAMES:
+            raise ValueError(f"Unknown pipeline stage '{name}' (expected one of {', '.join(STAGE_NAMES)})")
+        workers[name] = max(1, int(count))
+    return workers
+
+
+def _is_image(data):
+    """Whether Pillow recognizes bytes as an image; only the header is parsed"""
+    try:
+        with Image.open(io.BytesIO(data)) as probe:
+            return probe.format is not None
+    except OSError:
+        return False
+
+
+def _advise(fd, advice):
+    """
+    Give the kernel a page cache hint for a whole file, where it takes them
+
+    Args:
+        fd (int): Open file descriptor
+        advice (str): Name of the hint, e.g. 'POSIX_FADV_SEQUENTIAL'
+    """
+    if not _FADVISE:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, getattr(os, advice))
+    except OSError:
+        # Some network filesystems refuse hints; they are only hints
+        pass
+
+
+class ScanItem:
+    """A single photo moving through the scan pipeline"""
+
+    __slots__ = ('path', 'rel_path', 'data', 'image', 'size', 'face_locations',
+                 'face_encodings', 'reserved', 'error', 'done', 'hash_entry',
+                 'duplicate_of', 'metadata', 'regions', 'buffered')
+
+    def __init__(self, path, rel_path):
+        self.path = path
+        self.rel_path = rel_path
+        self.data = None            # raw file bytes
+        self.image = None           # decoded RGB array
+        self.size = None            # (width, height) read from the header
+        self.face_locations = []
+        self.face_encodings = []
+        self.reserved = 0           # bytes charged to the memory budget
+        self.error = None
+        self.done = False           # no further stage needs to touch it
+        self.hash_entry = None      # results near-duplicates can reuse
+        self.duplicate_of = None    # HashEntry whose results this reuses
+        self.metadata = None        # (taken, camera, latitude, longitude) from EXIF
+        self.regions = None         # RegionReader for images detected in tiles
+        self.buffered = 0           # bytes charged to the read-ahead buffer
+
+    @property
+    def face_count(self):
+        return len(self.face_encodings)
+
+
+class MemoryBudget:
+    """Caps the number of bytes held by decoded images in flight"""
+
+    def __init__(self, budget_bytes):
+        """
+        Args:
+            budget_bytes (int): Maximum bytes of decoded images at any time
+        """
+        self.budget_bytes = max(1, int(budget_bytes))
+        self.in_use = 0
+        self.peak = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, nbytes):
+        """
+        Block until nbytes fit in the budget and reserve them
+
+        An image larger than the whole budget is still admitted, but only
+        once nothing else is in flight.
+        """
+        with self._cond:
+            while self.in_use > 0 and self.in_use + nbytes > self.budget_bytes:
+                self._cond.wait()
+            self.in_use += nbytes
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_use)
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        return nbytes
+
+    def release(self, nbytes):
+        """Return previously reserved bytes to the budget"""
+        if not nbytes:
+            return
+        with self._cond:
+            self.in_use -= nbytes
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+
+class PipelineStage:
+    """A pool of worker threads applying one function between two queues"""
+
+    def __init__(self, name, func, workers, in_queue, out_queue, on_error):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.on_error = on_error
+        self.processed = 0
+        self.busy_seconds = 0.0
+        self.idle_seconds = 0.0     # waiting for input, summed over workers
+        self._alive = 0
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        self._alive = self.workers
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"scan-{self.name}-{i}")
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            waited = time.perf_counter()
+            item = self.in_queue.get()
+            waited = time.perf_counter() - waited
+            with self._lock:
+                self.idle_seconds += waited
+
+            if item is _SENTINEL:
+                with self._lock:
+                    self._alive -= 1
+                    last = self._alive == 0
+                # Let sibling workers see the end of the stream too, and
+                # forward it downstream once the whole stage has drained
+                if last:
+                    self.out_queue.put(_SENTINEL)
+                else:
+                    self.in_queue.put(_SENTINEL)
+                return
+
+            if not item.done:
+                start = time.perf_counter()
+                try:
+                    self.func(item)
+                except Exception as e:
+                    item.error = e
+                    item.done = True
+                    self.on_error(item)
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self.processed += 1
+                    self.busy_seconds += elapsed
+
+            self.out_queue.put(item)
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+
+class ScanPipeline:
+    """
+    Bounded-memory producer/consumer pipeline for face scanning
+
+    Discovery runs in its own thread, the read/decode/detect/encode stages
+    run on per-stage worker pools and the commit callback runs in the calling
+    thread, so it can mutate the face database without extra locking.
+    """
+
+    def __init__(self, model="hog", stage_workers=None, queue_size=8,
+                 memory_budget_mb=1024, read_ahead_mb=256, parallel=True, governor=None,
+                 quality_gate=None, dedup=False, dedup_distance=4, hash_method='dhash',
+                 cancel_event=None, tile_threshold_mp=TILE_THRESHOLD_MP, tile_size=TILE_SIZE,
+                 backend=None):
+        """
+        Args:
+            model (str): Face detection model ('hog' or 'cnn') of the
+                default dlib backend
+            stage_workers (dict, optional): Stage name -> worker count
+            queue_size (int): Capacity of each queue between stages
+            memory_budget_mb (float): Budget for decoded images in flight
+            read_ahead_mb (float): Budget for raw file bytes read ahead of
+                the decoders
+            parallel (bool): Whether to use more than one worker per stage
+            governor (ResourceGovernor, optional): Scales the number of
+                active compute workers and pauses ingestion under pressure
+            quality_gate (QualityGate, optional): Drops tiny, blurry and
+                extreme-pose faces before they are encoded
+            dedup (bool): Reuse face results for near-duplicate photos
+                instead of running detection on them again
+            dedup_distance (int): Largest perceptual hash distance in bits
+                that counts as a near-duplicate
+            hash_method (str): Perceptual hash to use ('dhash' or 'phash')
+            cancel_event (threading.Event, optional): Once set, no new photos
+                enter the pipeline; photos already in flight are finished
+            tile_threshold_mp (float): Images with more megapixels than this
+                are detected in overlapping tiles (0 disables)
+            tile_size (int): Side in pixels of a detection tile
+            backend (FaceBackend, optional): Detects and encodes faces
+                (default: dlib with the given model)
+        """
+        self.model = model
+        self.backend = backend if backend is not None else DlibBackend(model)
+        self.queue_size = max(1, int(queue_size))
+        self.stage_workers = default_stage_workers()
+        if stage_workers:
+            self.stage_workers.update(stage_workers)
+        if not parallel:
+            self.stage_workers = {name: 1 for name in STAGE_NAMES}
+
+        # The governor decides how many compute workers are active, so every
+        # compute stage needs enough threads to reach its upper limit
+        self.governor = governor
+        self.quality_gate = quality_gate
+        if governor is not None:
+            for name in COMPUTE_STAGES:
+                self.stage_workers[name] = max(self.stage_workers[name], governor.max_workers)
+
+        self.cancel_event = cancel_event
+        self.hash_index = HashIndex(dedup_distance) if dedup else None
+        self.hash_method = hash_method
+        self.skipped_detections = 0
+        self.tile_pixels = (tile_threshold_mp or 0) * 1e6
+        self.tile_size = tile_size
+        self.tiled_images = 0
+        self._tile_executor = None
+        # Near-duplicates that reached commit before the photo they copy
+        self._waiting = {}
+
+        self.memory = MemoryBudget(memory_budget_mb * 1024 * 1024)
+        self.read_ahead = MemoryBudget(read_ahead_mb * 1024 * 1024)
+        self.bytes_read = 0
+        self.read_seconds = 0.0
+        self._read_lock = threading.Lock()
+        self.stages = []
+        self.discovered = 0
+        self.committed = 0
+        self.errors = 0
+        self.elapsed = 0.0
+
+    # Stage functions -----------------------------------------------------
+
+    def _compute(self):
+        """Context holding one of the governor's active worker slots"""
+        if self.governor is None:
+            return contextlib.nullcontext()
+        return self.governor.gate
+
+    def _read(self, item):
+        if self.governor is not None:
+            self.governor.wait_for_ingest()
+
+        if item.data is None:
+            with open(item.path, 'rb') as f:
+                fd = f.fileno()
+                # Waits here while the decoders are far enough behind
+                item.buffered = self.read_ahead.acquire(max(1, os.fstat(fd).st_size))
+                start = time.perf_counter()
+                _advise(fd, 'POSIX_FADV_SEQUENTIAL')
+                item.data = f.read()
+                # Each photo is read once; leave the page cache to others
+                _advise(fd, 'POSIX_FADV_DONTNEED')
+                elapsed = time.perf_counter() - start
+            with self._read_lock:
+                self.bytes_read += len(item.data)
+                self.read_seconds += elapsed
+        elif not item.buffered:
+            # Archive members arrive with their bytes already read. They are
+            # charged here, in queue order like files: charged earlier, one
+            # could wait in the queue behind a file waiting for its bytes
+            item.buffered = self.read_ahead.acquire(max(1, len(item.data)))
+
+        # Verify this is really an image file
+        if not _is_image(item.data):
+            self._drop_data(item)
+            item.done = True
+
+    def _dedup(self, item):
+        if self.hash_index is None:
+            return
+        with self._compute():
+            value, item.size = image_hash(item.data, self.hash_method)
+
+        entry = HashEntry(item.rel_path, item.size)
+        existing = self.hash_index.find_or_add(value, entry)
+        if existing is None:
+            item.hash_entry = entry
+        else:
+            # Burst shots share faces but not capture times
+            item.metadata = self._read_metadata(item.data)
+            item.duplicate_of = existing
+            self._drop_data(item)
+            item.done = True
+
+    @staticmethod
+    def _read_metadata(data):
+        with Image.open(io.BytesIO(data)) as probe:
+            return read_photo_metadata(probe)
+
+    def _decode(self, item):
+        # Opening only parses the header: enough to size the image and read EXIF
+        try:
+            with Image.open(io.BytesIO(item.data)) as probe:
+                item.size = item.size or probe.size
+                item.metadata = read_photo_metadata(probe)
+        except Image.DecompressionBombError:
+            # Too big for PIL to open at all; only region decoding can read it
+            if not (self.tile_pixels and region_decoding_available()):
+                raise
+            item.regions = RegionReader(item.data)
+            item.size = item.regions.size
+        width, height = item.size
+
+        if self.tile_pixels and width * height > self.tile_pixels:
+            # Decoded a tile at a time later on, by the detect stage
+            if item.regions is None:
+                item.regions = RegionReader(item.data)
+            if item.regions.streaming:
+                nbytes = tile_memory(self.tile_size, self.stage_workers['detect'])
+            else:
+                nbytes = width * height * 3
+            item.reserved = self.memory.acquire(nbytes)
+            self.tiled_images += 1
+        else:
+            item.reserved = self.memory.acquire(max(1, width * height * 3))
+            with self._compute():
+                item.image = face_recognition.load_image_file(io.BytesIO(item.data))
+        self._drop_data(item)
+
+    def _detect(self, item):
+        if item.regions is not None:
+            # Tiles hold compute slots themselves, while they run in parallel
+            item.face_locations = detect_faces_tiled(item.regions, self.backend, self._tile_executor,
+                                                     self.tile_size, compute=self._compute)
+        else:
+            with self._compute():
+                item.face_locations = self.backend.detect(item.image)
+        if not item.face_locations:
+            self._release(item)
+            item.done = True
+
+    def _quality(self, item):
+        if self.quality_gate is None:
+            return
+        with self._compute():
+            if item.regions is not None:
+                kept = []
+                for face_location in item.face_locations:
+                    crop, crop_location = item.regions.face_crop(face_location)
+                    if self.quality_gate.filter(crop, [crop_location]):
+                        kept.append(face_location)
+                item.face_locations = kept
+            else:
+                item.face_locations = self.quality_gate.filter(item.image, item.face_locations)
+        if not item.face_locations:
+            self._release(item)
+            item.done = True
+
+    def _encode(self, item):
+        with self._compute():
+            if item.regions is not None:
+                item.face_encodings = []
+                for face_location in item.face_locations:
+                    crop, crop_location = item.regions.face_crop(face_location)
+                    item.face_encodings.extend(self.backend.encode(crop, [crop_location]))
+            else:
+                item.face_encodings = self.backend.encode(item.image, item.face_locations)
+        self._release(item)
+        item.done = True
+
+    def _drop_data(self, item):
+        """Drop the raw file bytes and give them back to the read-ahead buffer"""
+        item.data = None
+        buffered, item.buffered = item.buffered, 0
+        self.read_ahead.release(buffered)
+
+    def _release(self, item):
+        """Drop the decoded image and give its memory back to the budget"""
+        item.image = None
+        self._drop_data(item)
+        if item.regions is not None:
+            item.regions.close()
+            item.regions = None
+        reserved, item.reserved = item.reserved, 0
+        self.memory.release(reserved)
+
+    # Running -------------------------------------------------------------
+
+    def _build(self):
+        funcs = {
+            'read': self._read,
+            'dedup': self._dedup,
+            'decode': self._decode,
+            'detect': self._detect,
+            'quality': self._quality,
+            'encode': self._encode,
+        }
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(STAGE_NAMES) + 1)]
+        # Readers run ahead as far as the read-ahead buffer allows
+        queues[1] = queue.Queue(maxsize=max(self.queue_size, READ_AHEAD_ITEMS))
+        self.stages = [
+            PipelineStage(name, funcs[name], self.stage_workers[name],
+                          queues[i], queues[i + 1], self._release)
+            for i, name in enumerate(STAGE_NAMES)
+        ]
+        return queues[0], queues[-1]
+
+    @property
+    def cancelled(self):
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+    def run(self, items, commit):
+        """
+        Push items through the pipeline
+
+        Args:
+            items (iterable): ScanItems to process, consumed lazily
+            commit (callable): Called with every finished ScanItem in the
+                calling thread, in completion order
+        """
+        start = time.perf_counter()
+        first_queue, last_queue = self._build()
+
+        def discover():
+            try:
+                for item in items:
+                    if self.cancelled:
+                        break
+                    if self.governor is not None:
+                        self.governor.wait_for_ingest()
+                    self.discovered += 1
+                    first_queue.put(item)
+            finally:
+                first_queue.put(_SENTINEL)
+
+        if self.governor is not None:
+            self.governor.in_flight = lambda: self.memory.in_flight
+            self.governor.start()
+        if self.tile_pixels:
+            self._tile_executor = ThreadPoolExecutor(max_workers=self.stage_workers['detect'],
+                                                     thread_name_prefix="scan-tile")
+        discovery = threading.Thread(target=discover, name="scan-discovery")
+        discovery.daemon = True
+        discovery.start()
+        for stage in self.stages:
+            stage.start()
+
+        try:
+            while True:
+                item = last_queue.get()
+                if item is _SENTINEL:
+                    break
+                self._release(item)
+                for finished in self._resolve(item):
+                    if finished.error is not None:
+                        self.errors += 1
+                    self.committed += 1
+                    commit(finished)
+
+            discovery.join()
+            for stage in self.stages:
+                stage.join()
+        finally:
+            if self.governor is not None:
+                self.governor.stop()
+            if self._tile_executor is not None:
+                self._tile_executor.shutdown()
+                self._tile_executor = None
+        self.elapsed = time.perf_counter() - start
+
+    def _resolve(self, item):
+        """
+        Match finished items with near-duplicate bookkeeping
+
+        Returns the items that are ready to commit: the item itself, unless
+        it is a near-duplicate of a photo that hasn't finished yet, plus any
+        near-duplicates that were waiting for it.
+        """
+        entry = item.duplicate_of
+        if entry is not None:
+            if not entry.resolved:
+                self._waiting.setdefault(id(entry), []).append(item)
+                return []
+            self._copy_results(item, entry)
+            return [item]
+
+        entry = item.hash_entry
+        if entry is None:
+            return [item]
+
+        entry.face_locations = item.face_locations
+        entry.face_encodings = item.face_encodings
+        entry.failed = item.error is not None
+        entry.resolved = True
+
+        ready = [item]
+        for duplicate in self._waiting.pop(id(entry), []):
+            self._copy_results(duplicate, entry)
+            ready.append(duplicate)
+        return ready
+
+    def _copy_results(self, item, entry):
+        """Give a near-duplicate the face results of the photo it matches"""
+        if entry.failed:
+            item.error = RuntimeError(f"near-duplicate of {entry.rel_path}, which failed to process")
+            return
+        item.face_locations = [
+            remap_location(face_location, entry.size, item.size)
+            for face_location in entry.face_locations
+        ]
+        item.face_encodings = list(entry.face_encodings)
+        self.skipped_detections += 1
+
+    def _format_io_stats(self):
+        """I/O wait versus compute time of the last run"""
+        if not self.stages:
+            return []
+        stages = {stage.name: stage for stage in self.stages}
+        megabytes = self.bytes_read / (1024 * 1024)
+        rate = megabytes / self.read_seconds if self.read_seconds else 0.0
+        compute = sum(stages[name].busy_seconds for name in COMPUTE_STAGES)
+        # Decoders with nothing to decode are waiting on the readers
+        decode = stages['decode']
+        waiting = decode.idle_seconds / decode.workers
+        share = 100 * waiting / self.elapsed if self.elapsed else 0.0
+        return [
+            f"  I/O: {megabytes:.0f} MB read in {self.read_seconds:.1f}s of reader time "
+            f"({rate:.1f} MB/s), peak read-ahead {self.read_ahead.peak / (1024 * 1024):.0f} MB of "
+            f"{self.read_ahead.budget_bytes / (1024 * 1024):.0f} MB",
+            f"  I/O wait vs compute: decoders waited {waiting:.1f}s ({share:.0f}% of the run) "
+            f"for photos to be read; compute stages busy {compute:.1f}s",
+        ]
+
+    def format_stats(self):
+        """Human readable summary of the last run"""
+        lines = [
+            f"Pipeline: {self.committed} photos in {self.elapsed:.1f}s "
+            f"({self.errors} errors)",
+            f"  Peak decoded images in flight: {self.memory.peak_in_flight} "
+            f"({self.memory.peak / (1024 * 1024):.0f} MB of "
+            f"{self.memory.budget_bytes / (1024 * 1024):.0f} MB budget)",
+        ]
+        for stage in self.stages:
+            lines.append(
+                f"  {stage.name:<7} workers={stage.workers:<3} processed={stage.processed:<7} "
+                f"busy={stage.busy_seconds:.1f}s"
+            )
+        lines.extend(self._format_io_stats())
+        if self.hash_index is not None:
+            lines.append(f"Near-duplicates: {self.skipped_detections} detections skipped "
+                         f"({self.hash_index.size} distinct photos hashed)")
+        if self.tiled_images:
+            decoding = "region by region" if region_decoding_available() else "whole (install pyvips to decode regions)"
+            lines.append(f"Tiled detection: {self.tiled_images} large images, decoded {decoding}")
+        if self.quality_gate is not None:
+            lines.append(self.quality_gate.format_stats())
+        if self.governor is not None:
+            lines.append(self.governor.format_stats())
+        return "\n".join(lines)
@@ -0,0 +1,157 @@
+"""
+Preview scans for Face Recognition File Explorer
+
+Before a scan that may take days, a few hundred photos picked by stratified
+random sampling are scanned with the normal pipeline into a throwaway
+database, and the results are scaled up to the whole library:
+
+- Faces, photos with faces and near-duplicates are estimated from the
+  sample's means and proportions, with 95% confidence intervals
+- People can't be scaled up linearly, since the same people keep coming
+  back: their number is estimated from how many people were seen once and
+  twice in the sample (the Chao1 estimator)
+- Each scan profile is timed on a smaller part of the sample, which gives
+  the full scan time of that profile on this machine. The first photo is
+  left out as a warm-up, and the photos are read from the page cache after
+  the sample scan, so the times assume the disk keeps up with the decoders
+"""
+
+import math
+
+from job_scheduler import format_duration
+
+# Normal quantile of a two-sided 95% confidence interval
+Z_95 = 1.96
+
+# Photos of the sample each profile is timed on
+PROFILE_SAMPLE = 20
+
+# Scan profiles: name -> (description, scan_photos options); 'backend' is
+# a name and 'quality_gate' a flag here, replaced with the objects when the
+# profile is run
+SCAN_PROFILES = {
+    'fast': ("hog, near-duplicate reuse, quality gate",
+             {'backend': 'dlib', 'model': 'hog', 'dedup': True, 'quality_gate': True}),
+    'standard': ("hog", {'backend': 'dlib', 'model': 'hog', 'dedup': False, 'quality_gate': False}),
+    'accurate': ("cnn", {'backend': 'dlib', 'model': 'cnn', 'dedup': False, 'quality_gate': False}),
+    'opencv': ("OpenCV YuNet + SFace", {'backend': 'opencv', 'model': 'hog', 'dedup': False,
+                                        'quality_gate': False}),
+}
+
+
+def mean_interval(values, population, z=Z_95):
+    """
+    Estimated population total of a per-photo value, from a simple sample
+
+    Args:
+        values (list): The value for every sampled photo
+        population (int): Photos in the library
+        z (float): Normal quantile of the interval
+
+    Returns:
+        tuple: (total, low, high)
+    """
+    n = len(values)
+    if not n:
+        return 0.0, 0.0, 0.0
+    mean = sum(values) / n
+    variance = sum((value - mean) ** 2 for value in values) / (n - 1) if n > 1 else 0.0
+    # The sample is drawn without replacement from a finite library
+    correction = (population - n) / (population - 1) if population > 1 else 0.0
+    margin = z * math.sqrt(variance / n * max(0.0, correction))
+    return population * mean, population * max(0.0, mean - margin), population * (mean + margin)
+
+
+def proportion_interval(hits, n, population, z=Z_95):
+    """
+    Estimated number of photos with some property, from a sample
+
+    Uses the Wilson score interval, which stays sensible for proportions
+    close to 0 or 1 and for small samples.
+
+    Returns:
+        tuple: (count, low, high)
+    """
+    if not n:
+        return 0.0, 0.0, 0.0
+    p = hits / n
+    denominator = 1 + z * z / n
+    centre = (p + z * z / (2 * n)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator
+    return population * p, population * max(0.0, centre - margin), population * min(1.0, centre + margin)
+
+
+def chao1(cluster_sizes, z=Z_95):
+    """
+    Estimated number of distinct people, seen or not, from a sample's clusters
+
+    Args:
+        cluster_sizes (list): Faces in each cluster of the sample
+
+    Returns:
+        tuple: (estimate, low, high)
+    """
+    observed = len(cluster_sizes)
+    f1 = sum(1 for size in cluster_sizes if size == 1)
+    f2 = sum(1 for size in cluster_sizes if size == 2)
+    if f1 == 0:
+        return float(observed), float(observed), float(observed)
+
+    if f2 > 0:
+        ratio = f1 / f2
+        unseen = f1 * f1 / (2 * f2)
+        variance = f2 * (ratio ** 2 / 2 + ratio ** 3 + ratio ** 4 / 4)
+    else:
+        # Bias-corrected form, defined without doubletons
+        unseen = f1 * (f1 - 1) / 2
+        variance = f1 * (f1 - 1) / 2 + f1 * (2 * f1 - 1) ** 2 / 4 - f1 ** 4 / (4 * (observed + unseen))
+    estimate = observed + unseen
+    if unseen <= 0 or variance <= 0:
+        return estimate, estimate, estimate
+    # Log-normal interval: the estimate can't be below what was seen
+    spread = math.exp(z * math.sqrt(math.log(1 + variance / unseen ** 2)))
+    return estimate, observed + unseen / spread, observed + unseen * spread
+
+
+def _count(value):
+    return f"{value:,.0f}"
+
+
+def format_preview(report):
+    """
+    Human readable preview report
+
+    Args:
+        report (dict): From FaceRecognitionExplorer.preview_scan
+
+    Returns:
+        str: The report
+    """
+    population, n = report['population'], report['sample']
+    lines = [f"Preview of {n:,} of {population:,} photos (stratified random sample), "
+             f"scanned in {report['seconds']:.1f}s"]
+    if not n:
+        return lines[0]
+
+    def interval(label, estimate, note=''):
+        total, low, high = estimate
+        lines.append(f"  {label:<18} ~{_count(total)} (95% CI {_count(low)} - {_count(high)}){note}")
+
+    interval("Faces:", report['faces'], f", {report['faces'][0] / population:.2f} per photo")
+    interval("Photos with faces:", report['photos_with_faces'],
+             f", {100 * report['photos_with_faces'][0] / population:.0f}%")
+    interval("Near-duplicates:", report['duplicates'],
+             f", {100 * report['duplicates'][0] / population:.0f}% of photos would reuse another's faces")
+    interval("People:", report['people'], f", {report['clusters']} seen in the sample")
+    if report['skipped']:
+        lines.append(f"  Not sampled: {report['skipped']} archives and videos")
+
+    if report['profiles']:
+        lines.append(f"Estimated full scan on this machine (each profile timed on "
+                     f"{report['profile_sample']} photos, the first a warm-up):")
+        for name, timing in report['profiles'].items():
+            lines.append(f"  {name:<9} {SCAN_PROFILES[name][0]:<42} {timing['per_photo']:.2f}s per photo, "
+                         f"~{format_duration(timing['total'])}")
+        lines.append("  Timed photos were read from the page cache: add time if the disk "
+                     "can't keep up with the decoders")
+    return "\n".join(lines)
@@ -0,0 +1,131 @@
+"""
+Scan scheduling for Face Recognition File Explorer
+
+By default photos are scanned in the order they lie on disk, which reads
+fastest but shows the first faces of a large library only after hours, all
+from the first few folders. A schedule chooses the order instead:
+
+- A stratified sample comes first: photos picked at even steps through the
+  library sorted by folder, so every folder gets its share and labeling can
+  start on faces representative of the whole library
+- Then the folders the user chose, then everything else, newest first
+- Within each of those, files much bigger than usual start first (longest
+  processing time first), so the scan doesn't end with one worker detecting
+  faces in a panorama while the others sit idle
+
+Scheduling needs the size and date of every photo, so the photos directory
+is listed up front rather than lazily.
+"""
+
+import os
+
+from photo_sources import is_archive
+
+SCAN_ORDERS = ('disk', 'priority')
+
+# Photos in the stratified sample scanned first
+SAMPLE_FIRST = 200
+
+# Files this many times the median size start before the rest of their tier
+LARGE_FILE_FACTOR = 4
+
+
+class ScanCandidate:
+    """A photo file (or archive) waiting to be scheduled"""
+
+    __slots__ = ('path', 'rel_path', 'folder', 'size', 'mtime')
+
+    def __init__(self, path, rel_path):
+        self.path = path
+        self.rel_path = rel_path
+        self.folder = os.path.dirname(rel_path).replace(os.sep, '/')
+        try:
+            stat = os.stat(path)
+            self.size, self.mtime = stat.st_size, stat.st_mtime
+        except OSError:
+            # Left for the read stage to report
+            self.size, self.mtime = 0, 0.0
+
+
+def stratified_sample(candidates, count, rng=None):
+    """
+    Pick photos spread evenly over the folders of a library
+
+    Every folder gets a share of the sample in proportion to its size,
+    and within a folder the picks are spread over its photos' dates.
+
+    Args:
+        candidates (list): Objects with 'folder', 'mtime' and 'rel_path'
+        count (int): Photos to pick
+        rng (random.Random, optional): Pick at random within each step
+            instead of at its middle
+
+    Returns:
+        list: The picked candidates, in library order
+    """
+    ordered = sorted(candidates, key=lambda candidate: (candidate.folder, candidate.mtime, candidate.rel_path))
+    if count >= len(ordered):
+        return ordered
+    if count <= 0:
+        return []
+    step = len(ordered) / count
+    return [ordered[int(step * (i + (rng.random() if rng is not None else 0.5)))] for i in range(count)]
+
+
+class ScanSchedule:
+    """Orders the photos of a scan for a fast first result and a short tail"""
+
+    def __init__(self, sample_first=SAMPLE_FIRST, priority_folders=(), newest_first=True,
+                 largest_first=True):
+        """
+        Args:
+            sample_first (int): Photos in the stratified sample scanned first
+            priority_folders (iterable): Folders, relative to the photos
+                directory, scanned right after the sample
+            newest_first (bool): Scan newer photos before older ones
+            largest_first (bool): Start unusually big files early
+        """
+        self.sample_first = max(0, int(sample_first or 0))
+        self.priority_folders = [folder.replace(os.sep, '/').strip('/') for folder in priority_folders or ()]
+        self.newest_first = newest_first
+        self.largest_first = largest_first
+        self.sample_size = 0
+
+    def _tier(self, candidate):
+        for folder in self.priority_folders:
+            if not folder or candidate.folder == folder or candidate.folder.startswith(folder + '/'):
+                return 0
+        return 1
+
+    def order(self, candidates):
+        """
+        Put candidates in scan order
+
+        Args:
+            candidates (list): ScanCandidates, in disk order
+
+        Returns:
+            list: The same candidates in the order to scan them
+        """
+        sample = stratified_sample(candidates, self.sample_first)
+        self.sample_size = len(sample)
+        sampled = {id(candidate) for candidate in sample}
+        rest = [candidate for candidate in candidates if id(candidate) not in sampled]
+
+        # Archives are read as a stream of small photos, so their size says
+        # nothing about how long one photo takes
+        sizes = sorted(candidate.size for candidate in rest if not is_archive(candidate.rel_path))
+        large = sizes[len(sizes) // 2] * LARGE_FILE_FACTOR if sizes and self.largest_first else None
+
+        def key(position):
+            index, candidate = position
+            big = large is not None and candidate.size > large and not is_archive(candidate.rel_path)
+            if big:
+                within = -candidate.size
+            elif self.newest_first:
+                within = -candidate.mtime
+            else:
+                within = index
+            return (self._tier(candidate), not big, within)
+
+        return sample + [candidate for _, candidate in sorted(enumerate(rest), key=key)]
@@ -0,0 +1,164 @@
+"""
+Metadata sidecar files for Face Recognition File Explorer
+
+Writes one sidecar per photo listing everyone recognized in it, either as
+a Windows Search ``.properties`` file or as an XMP sidecar using the IPTC
+``PersonInImage`` property, which Lightroom, digiKam, darktable and most
+photo managers read.
+"""
+
+import concurrent.futures
+import os
+from collections import Counter
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+from photo_output import OutputManifest
+
+SIDECAR_FORMATS = ('properties', 'xmp', 'both')
+
+SIDECAR_MANIFEST_NAME = '.sidecar_manifest.json'
+
+_XMP_TEMPLATE = """<?xpacket begin="\ufeff" id="W5M0MpCehiHzreSzNTczkc9d"?>
+<x:xmpmeta xmlns:x="adobe:ns:meta/">
+ <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+  <rdf:Description rdf:about=""
+    xmlns:Iptc4xmpExt="http://iptc.org/std/Iptc4xmpExt/2008-02-29/">
+   <Iptc4xmpExt:PersonInImage>
+    <rdf:Bag>
+{items}
+    </rdf:Bag>
+   </Iptc4xmpExt:PersonInImage>
+  </rdf:Description>
+ </rdf:RDF>
+</x:xmpmeta>
+<?xpacket end="w"?>
+"""
+
+
+def properties_content(names):
+    """Windows Search property file text; multiple values are ';' separated"""
+    return f"Person={';'.join(names)}"
+
+
+def xmp_content(names):
+    """XMP sidecar text listing names as IPTC PersonInImage"""
+    items = '\n'.join(f"     <rdf:li>{escape(name)}</rdf:li>" for name in names)
+    return _XMP_TEMPLATE.format(items=items)
+
+
+def sidecar_paths(photo_file, formats='properties', full_name=False):
+    """
+    Sidecar files belonging to a photo
+
+    Args:
+        photo_file (Path): The photo the sidecars describe
+        formats (str): One of SIDECAR_FORMATS
+        full_name (bool): Name the sidecars after the whole file name
+            (img.jpg.xmp) rather than its stem (img.xmp)
+
+    Returns:
+        dict: Path -> function producing the file's text from a list of names
+    """
+    photo_file = Path(photo_file)
+    base = photo_file.name if full_name else photo_file.stem
+    paths = {}
+    if formats in ('properties', 'both'):
+        paths[photo_file.parent / f"{base}.properties"] = properties_content
+    if formats in ('xmp', 'both'):
+        paths[photo_file.parent / f"{base}.xmp"] = xmp_content
+    return paths
+
+
+def _stem_key(rel_photo):
+    # Case-insensitive, as on Windows and macOS
+    path = Path(rel_photo)
+    return path.parent.as_posix().lower(), path.stem.lower()
+
+
+def _write_if_changed(path, text):
+    """Write text to path unless it already holds exactly that; returns True if written"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            if f.read() == text:
+                return False
+    except (OSError, UnicodeDecodeError):
+        pass
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+    return True
+
+
+def write_sidecars(root, photo_people, formats='properties', max_workers=None,
+                   manifest_name=SIDECAR_MANIFEST_NAME):
+    """
+    Bring the sidecars under root in line with who is in each photo
+
+    Args:
+        root (Path): Directory the photo paths are relative to; the manifest
+            of written sidecars is kept here
+        photo_people (dict): Photo path relative to root -> list of names
+        formats (str): One of SIDECAR_FORMATS
+        max_workers (int, optional): Threads writing sidecars in parallel
+        manifest_name (str): File name of the manifest in root
+
+    Returns:
+        dict: Counts of 'written', 'unchanged', 'removed', 'skipped' (XMP
+        files this tool didn't create) and 'errors'
+    """
+    root = Path(root)
+    manifest = OutputManifest(root, manifest_name)
+    stats = {'written': 0, 'unchanged': 0, 'removed': 0, 'skipped': 0, 'errors': 0}
+
+    # Photos differing only by extension (img.jpg, img.png) would share
+    # img.xmp; their sidecars are named after the whole file name instead
+    stems = Counter(_stem_key(rel_photo) for rel_photo in photo_people)
+
+    todo = {}
+    for rel_photo, names in photo_people.items():
+        full_name = stems[_stem_key(rel_photo)] > 1
+        for path, content in sidecar_paths(root / rel_photo, formats, full_name).items():
+            todo[path.relative_to(root).as_posix()] = (path, content(names))
+
+    # Sidecars of photos that no longer have anyone in them
+    for rel_path in list(manifest.files):
+        if rel_path not in todo:
+            try:
+                (root / rel_path).unlink()
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"  Error removing {root / rel_path}: {e}")
+                stats['errors'] += 1
+                continue
+            del manifest.files[rel_path]
+            stats['removed'] += 1
+
+    # XMP sidecars made by other programs may hold edits; never replace those
+    for rel_path, (path, _) in list(todo.items()):
+        if path.suffix == '.xmp' and rel_path not in manifest.files and path.exists():
+            print(f"  Leaving existing sidecar {path} alone")
+            stats['skipped'] += 1
+            del todo[rel_path]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(_write_if_changed, path, text): rel_path
+            for rel_path, (path, text) in todo.items()
+        }
+        for future in concurrent.futures.as_completed(futures):
+            rel_path = futures[future]
+            try:
+                written = future.result()
+            except Exception as e:
+                print(f"  Error writing {root / rel_path}: {e}")
+                stats['errors'] += 1
+                continue
+            manifest.files[rel_path] = {}
+            stats['written' if written else 'unchanged'] += 1
+
+    manifest.save()
+    return stats
@@ -0,0 +1,81 @@
+"""
+Test script for the face quality gate.
+Checks face size, sharpness and pose scoring and what the gate keeps, using
+synthetic images and landmarks.
+"""
+import sys
+
+import cv2
+import numpy as np
+
+from face_quality import QualityGate, face_sharpness, face_size, face_yaw
+
+
+def landmarks(nose_x):
+    """Five-point landmarks with the eyes at x=40 and x=80"""
+    return {'left_eye': [(35, 50), (45, 50)], 'right_eye': [(75, 50), (85, 50)],
+            'nose_tip': [(nose_x, 70)]}
+
+
+def test_scores():
+    """Size, sharpness and yaw score what they should"""
+    print("Testing face scores...")
+    assert face_size((10, 90, 50, 20)) == 40
+
+    rng = np.random.default_rng(0)
+    sharp = rng.integers(0, 255, (120, 120, 3), dtype=np.uint8)
+    blurred = cv2.GaussianBlur(sharp, (31, 31), 10)
+    box = (10, 110, 110, 10)
+    assert face_sharpness(sharp, box) > 10 * face_sharpness(blurred, box)
+    assert face_sharpness(sharp, (200, 300, 300, 200)) == 0.0
+
+    assert face_yaw(landmarks(60)) == 0.0
+    assert face_yaw(landmarks(90)) == 0.75
+    assert face_yaw({'left_eye': [(60, 50)], 'right_eye': [(60, 50)], 'nose_tip': [(70, 70)]}) == float('inf')
+    assert face_yaw({'left_eye': [(35, 50)]}) is None
+    print("✓ Faces are scored correctly")
+
+
+def test_gate_filter():
+    """The gate keeps good faces in order and counts why others were dropped"""
+    print("Testing the quality gate...")
+    rng = np.random.default_rng(1)
+    image = rng.integers(0, 255, (200, 300, 3), dtype=np.uint8)
+    image[:, 200:] = cv2.GaussianBlur(image[:, 200:], (31, 31), 10)
+
+    gate = QualityGate(min_face_size=40, min_sharpness=50.0, max_yaw=None)
+    faces = [(10, 90, 90, 10), (10, 120, 30, 100), (100, 190, 190, 100), (10, 290, 90, 210)]
+    assert gate.filter(image, faces) == [(10, 90, 90, 10), (100, 190, 190, 100)]
+    assert gate.passed == 2
+    assert gate.dropped == {'too_small': 1, 'blurry': 1, 'extreme_pose': 0}, gate.dropped
+    assert gate.dropped_total == 2
+    assert "2 faces passed, 2 dropped" in gate.format_stats()
+
+    # Zero disables a check
+    assert len(QualityGate(min_face_size=0, min_sharpness=0, max_yaw=None).filter(image, faces)) == 4
+    print("✓ The gate drops small and blurry faces")
+
+
+def main():
+    print("Face Quality Test")
+    print("=================\n")
+
+    tests = [test_scores, test_gate_filter]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            print(f"✗ {test.__doc__} failed: {e}")
+            failed += 1
+
+    if failed:
+        print(f"\n❌ {failed} of {len(tests)} tests failed.")
+        return False
+    print("\n✅ All tests passed!")
+    return True
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
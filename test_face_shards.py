@@ -0,0 +1,163 @@
+"""
+Test script for sharded scanning.
+Checks shard assignment, merging shard databases and querying them unmerged,
+using temporary SQLite databases.
+"""
+import os
+import sys
+import tempfile
+import zipfile
+
+import cv2
+import numpy as np
+
+from face_shards import (FederatedStore, merge_shards, scan_shard, shard_database_path,
+                         shard_of, share_workers)
+from face_store import SQLiteStore
+
+
+def random_encoding(rng):
+    return rng.normal(size=128)
+
+
+def make_shard(database_file, shard, shards, photos, rng):
+    """Shard database with two unlabeled faces per photo and one recognized face"""
+    store = SQLiteStore(shard_database_path(database_file, shard, shards))
+    for photo_path in photos:
+        store.add_unlabeled(photo_path, random_encoding(rng), (10, 60, 60, 10))
+        store.add_unlabeled(photo_path, random_encoding(rng), (70, 120, 120, 70))
+        store.set_photo_faces(photo_path, [("Alice", (10, 60, 60, 10))])
+    store.add_reference("Alice", random_encoding(rng))
+    store.close()
+    return shard_database_path(database_file, shard, shards)
+
+
+def test_shard_assignment():
+    """Shards depend on nothing but the path, and archives stay together"""
+    print("Testing shard assignment...")
+    # Fixed values: a change here would split existing shard databases differently
+    assert shard_of("2019/beach/img_001.jpg", 8) == 3
+    assert shard_of("2019/beach/img_001.jpg", 8, "subtree") == 5
+    assert shard_of("2019/beach/img_002.jpg", 8, "subtree") == 5
+    assert shard_of("2020/party.zip!/a.jpg", 8) == shard_of("2020/party.zip", 8)
+    for photo_path in ("a.jpg", "x/y/z.png", "2020/party.zip!/inner/b.jpg"):
+        for shards in (1, 3, 16):
+            assert 0 <= shard_of(photo_path, shards) < shards
+    print("✓ Shard assignment is stable")
+
+
+def test_merge_twice():
+    """Merging the same shards again changes nothing"""
+    print("Testing shard merging...")
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as directory:
+        database_file = os.path.join(directory, "faces.db")
+        shard_files = [make_shard(database_file, 0, 2, ["a.jpg", "b.jpg"], rng),
+                       make_shard(database_file, 1, 2, ["c.jpg"], rng)]
+        store = SQLiteStore(database_file)
+        try:
+            merge_shards(store, shard_files)
+            counts = (store.unlabeled_count(), store.photo_count(), store.reference_counts())
+            assert counts == (6, 3, {"Alice": 2}), counts
+            merge_shards(store, shard_files)
+            again = (store.unlabeled_count(), store.photo_count(), store.reference_counts())
+            assert again == counts, again
+        finally:
+            store.close()
+    print("✓ Merging a shard twice is harmless")
+
+
+def test_federated_ids():
+    """Face IDs of a federation are unique and lead back to their face"""
+    print("Testing federated face IDs...")
+    rng = np.random.default_rng(1)
+    with tempfile.TemporaryDirectory() as directory:
+        database_file = os.path.join(directory, "faces.db")
+        make_shard(database_file, 0, 2, ["a.jpg", "b.jpg"], rng)
+        make_shard(database_file, 1, 2, ["c.jpg"], rng)
+        store = FederatedStore.open(database_file)
+        try:
+            faces = store.unlabeled_faces()
+            face_ids = [face_id for face_id, *_ in faces]
+            assert len(face_ids) == len(set(face_ids)) == 6, face_ids
+            for face_id, photo_path, encoding, face_location in faces:
+                face = store.unlabeled_face(face_id)
+                assert face[0] == face_id and face[1] == photo_path and face[3] == face_location
+                assert np.array_equal(face[2], encoding)
+        finally:
+            store.close()
+    print("✓ Federated face IDs are unique")
+
+
+def test_skip_archive_members():
+    """A shard scan leaves out photos the main database has scanned, faces or not"""
+    print("Testing shard scans against the main database...")
+    with tempfile.TemporaryDirectory() as directory:
+        photos_dir = os.path.join(directory, "photos")
+        os.makedirs(photos_dir)
+        blank = np.full((64, 64, 3), 200, dtype=np.uint8)
+        cv2.imwrite(os.path.join(photos_dir, "a.png"), blank)
+        _, data = cv2.imencode(".png", blank)
+        with zipfile.ZipFile(os.path.join(photos_dir, "pack.zip"), "w") as archive:
+            archive.writestr("b.png", data.tobytes())
+            archive.writestr("c.png", data.tobytes())
+
+        # b.png is already labeled in the main database
+        database_file = os.path.join(directory, "faces.db")
+        main = SQLiteStore(database_file)
+        main.set_photo_faces("pack.zip!/b.png", [("Alice", (10, 60, 60, 10))])
+        main.close()
+
+        result = scan_shard(photos_dir, database_file, 0, 1, parallel=False)
+        assert result["photos"] == 2, result
+
+        main = SQLiteStore(database_file)
+        try:
+            merge_shards(main, [result["path"]])
+            assert main.unlabeled_count() == 0
+            assert main.photo_faces("pack.zip!/b.png") == [("Alice", (10, 60, 60, 10))]
+            # Photos without faces are remembered as scanned too
+            assert main.scanned_photos() == {"a.png", "pack.zip!/b.png", "pack.zip!/c.png"}
+        finally:
+            main.close()
+
+        os.remove(result["path"])
+        again = scan_shard(photos_dir, database_file, 0, 1, parallel=False)
+        assert again["photos"] == 0, again
+    print("✓ Photos already scanned are skipped")
+
+
+def test_share_workers():
+    """Shard processes on one machine split its compute workers"""
+    print("Testing worker sharing...")
+    options = share_workers({"stage_workers": {"read": 4, "detect": 8}, "governor": {"max_workers": 8}}, 4)
+    assert options["stage_workers"]["read"] == 4
+    assert options["stage_workers"]["detect"] == 2
+    assert options["governor"]["max_workers"] == 2
+    print("✓ Compute workers are shared between shard processes")
+
+
+def main():
+    print("Sharded Scan Test")
+    print("=================\n")
+
+    tests = [test_shard_assignment, test_merge_twice, test_federated_ids, test_skip_archive_members,
+             test_share_workers]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            print(f"✗ {test.__doc__} failed: {e}")
+            failed += 1
+
+    if failed:
+        print(f"\n❌ {failed} of {len(tests)} tests failed.")
+        return False
+    print("\n✅ All tests passed!")
+    return True
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,90 @@
+"""
+Test script for the person index.
+Checks how boolean person queries parse and what an index built from photo
+faces answers for them.
+"""
+import sys
+
+from person_index import PersonIndex, parse_query, query_names
+
+
+def test_parse_precedence():
+    """AND binds tighter than OR, NOT tightest, and parentheses group"""
+    print("Testing query parsing...")
+    assert parse_query("Alice") == ('name', 'Alice')
+    assert parse_query("A OR B AND C") == ('or', [('name', 'A'), ('and', [('name', 'B'), ('name', 'C')])])
+    assert parse_query("(A OR B) AND C") == ('and', [('or', [('name', 'A'), ('name', 'B')]), ('name', 'C')])
+    assert parse_query("NOT A AND B") == ('and', [('not', ('name', 'A')), ('name', 'B')])
+    assert parse_query("NOT NOT A") == ('not', ('not', ('name', 'A')))
+    assert parse_query("NOT (A OR B)") == ('not', ('or', [('name', 'A'), ('name', 'B')]))
+    print("✓ Queries parse with the right precedence")
+
+
+def test_parse_names():
+    """Bare words join into one name, quotes keep keywords literal"""
+    print("Testing names in queries...")
+    assert parse_query("John Doe AND Alice") == ('and', [('name', 'John Doe'), ('name', 'Alice')])
+    assert parse_query('"Mary Ann" OR \'NOT\'') == ('or', [('name', 'Mary Ann'), ('name', 'NOT')])
+    assert query_names(parse_query("A AND (B OR NOT C)")) == ['A', 'B', 'C']
+
+    for bad in ("", "A AND", "AND A", "(A OR B", "A)", "NOT"):
+        try:
+            parse_query(bad)
+        except ValueError:
+            continue
+        raise AssertionError(f"{bad!r} should not parse")
+    print("✓ Names and malformed queries are handled")
+
+
+def test_query_index():
+    """Queries return the photos matching them"""
+    print("Testing index queries...")
+    index = PersonIndex.from_photo_faces({
+        "1.jpg": [("Alice", None), ("Bob", None)],
+        "2.jpg": [("Alice", None)],
+        "3.jpg": [("Bob", None), ("Carol", None)],
+        "4.jpg": [("Carol", None)],
+    })
+    assert index.query("Alice AND Bob") == ["1.jpg"]
+    assert index.query("Alice OR Carol") == ["1.jpg", "2.jpg", "3.jpg", "4.jpg"]
+    assert index.query("Bob AND NOT Alice") == ["3.jpg"]
+    assert index.query("NOT Bob") == ["2.jpg", "4.jpg"]
+    assert index.query("Alice OR Bob AND Carol") == ["1.jpg", "2.jpg", "3.jpg"]
+    assert index.query("(Alice OR Bob) AND Carol") == ["3.jpg"]
+    assert index.query("Dave") == []
+    assert index.query("NOT Dave") == ["1.jpg", "2.jpg", "3.jpg", "4.jpg"]
+
+    index.remove("Bob", "3.jpg")
+    assert index.query("Bob") == ["1.jpg"]
+    assert index.query("NOT Alice") == ["3.jpg", "4.jpg"]
+    index.add("Dave", "5.jpg")
+    assert index.query("Dave OR Alice AND Bob") == ["1.jpg", "5.jpg"]
+
+    restored = PersonIndex.from_state(index.state())
+    assert restored.person_photos() == index.person_photos()
+    print("✓ Index queries match the right photos")
+
+
+def main():
+    print("Person Index Test")
+    print("=================\n")
+
+    tests = [test_parse_precedence, test_parse_names, test_query_index]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            print(f"✗ {test.__doc__} failed: {e}")
+            failed += 1
+
+    if failed:
+        print(f"\n❌ {failed} of {len(tests)} tests failed.")
+        return False
+    print("\n✅ All tests passed!")
+    return True
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,96 @@
+"""
+Test script for photo sources.
+Checks how photo keys of files, archive members and video frames are split
+and read, using temporary photo directories.
+"""
+import os
+import sys
+import tempfile
+import zipfile
+
+from photo_sources import PhotoReader, frame_key, member_key, split_archive_path
+
+
+def test_split_keys():
+    """Keys split after archive and video names, and nowhere else"""
+    print("Testing photo keys...")
+    assert split_archive_path("2019/beach/img.jpg") == ("2019/beach/img.jpg", None)
+    assert split_archive_path(member_key("2019/holiday.zip", "beach/img.jpg")) == ("2019/holiday.zip",
+                                                                                  "beach/img.jpg")
+    assert split_archive_path("old.TAR.GZ!/a.jpg") == ("old.TAR.GZ", "a.jpg")
+    assert split_archive_path(frame_key("clips/party.mp4", 12.4)) == ("clips/party.mp4", "12.400")
+    # Separators in folder names are part of an ordinary path
+    assert split_archive_path("Party!/p.jpg") == ("Party!/p.jpg", None)
+    assert split_archive_path("Party!/x.zip!/y.jpg") == ("Party!/x.zip", "y.jpg")
+    assert split_archive_path("notes#t=1/p.jpg") == ("notes#t=1/p.jpg", None)
+    print("✓ Photo keys split correctly")
+
+
+def test_read_folder_with_separator():
+    """Photos in a folder whose name ends in '!' read like any other"""
+    print("Testing folders named like separators...")
+    with tempfile.TemporaryDirectory() as directory:
+        os.makedirs(os.path.join(directory, "Party!"))
+        with open(os.path.join(directory, "Party!", "p.jpg"), "wb") as f:
+            f.write(b"photo")
+        with zipfile.ZipFile(os.path.join(directory, "Party!", "x.zip"), "w") as archive:
+            archive.writestr("y.jpg", b"member")
+
+        reader = PhotoReader(directory)
+        try:
+            assert reader.exists("Party!/p.jpg")
+            assert reader.read_bytes("Party!/p.jpg") == b"photo"
+            assert reader.local_path("Party!/p.jpg") is not None
+            assert reader.exists("Party!/x.zip!/y.jpg")
+            assert reader.read_bytes("Party!/x.zip!/y.jpg") == b"member"
+        finally:
+            reader.close()
+    print("✓ Folders named like separators are read as folders")
+
+
+def test_evict_archive_in_use():
+    """An archive pushed out of the cache stays open until its read finishes"""
+    print("Testing archive eviction...")
+    with tempfile.TemporaryDirectory() as directory:
+        for name in ("a.zip", "b.zip"):
+            with zipfile.ZipFile(os.path.join(directory, name), "w") as archive:
+                archive.writestr("p.jpg", name.encode())
+
+        reader = PhotoReader(directory, max_open_archives=1)
+        try:
+            with reader._archive("a.zip") as in_use:
+                # Opening b.zip evicts a.zip while it is still being read
+                assert reader.read_bytes("b.zip!/p.jpg") == b"b.zip"
+                assert in_use.evicted
+                assert in_use.read("p.jpg") == b"a.zip"
+            assert in_use.zip.fp is None
+
+            assert reader.read_bytes("a.zip!/p.jpg") == b"a.zip"
+        finally:
+            reader.close()
+    print("✓ Evicted archives close after their last read")
+
+
+def main():
+    print("Photo Sources Test")
+    print("==================\n")
+
+    tests = [test_split_keys, test_read_folder_with_separator, test_evict_archive_in_use]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            print(f"✗ {test.__doc__} failed: {e}")
+            failed += 1
+
+    if failed:
+        print(f"\n❌ {failed} of {len(tests)} tests failed.")
+        return False
+    print("\n✅ All tests passed!")
+    return True
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,165 @@
+"""
+Test script for the scan pipeline.
+Checks near-duplicate detection, how near-duplicates wait for the photo they
+copy, and a full pipeline run, using a stand-in backend and temporary photos.
+"""
+import os
+import sys
+import tempfile
+
+import cv2
+import numpy as np
+
+from face_backends import FaceBackend
+from perceptual_hash import HashEntry, HashIndex, hamming_distance, image_hash
+from scan_pipeline import ScanItem, ScanPipeline
+
+
+class BoxBackend(FaceBackend):
+    """Finds one face in the middle of every photo and counts its detections"""
+
+    name = 'test'
+
+    def __init__(self):
+        self.detections = 0
+
+    def detect(self, image):
+        self.detections += 1
+        height, width = image.shape[:2]
+        return [(height // 4, 3 * width // 4, 3 * height // 4, width // 4)]
+
+    def encode(self, image, face_locations):
+        return [np.full(128, 0.5) for _ in face_locations]
+
+
+def make_photo(seed):
+    """Smooth random 160x120 photo, so hashes survive resizing"""
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 255, (6, 8, 3), dtype=np.uint8)
+    return cv2.resize(small, (160, 120), interpolation=cv2.INTER_CUBIC)
+
+
+def encode_png(pixels):
+    return cv2.imencode(".png", pixels)[1].tobytes()
+
+
+def test_hash_distance():
+    """Resized copies hash alike, different photos don't"""
+    print("Testing perceptual hashes...")
+    photo = make_photo(0)
+    larger = cv2.resize(photo, (320, 240))
+    brighter = cv2.convertScaleAbs(photo, alpha=1, beta=6)
+    for method in ("dhash", "phash"):
+        value, size = image_hash(encode_png(photo), method)
+        assert size == (160, 120), size
+        assert image_hash(encode_png(larger), method)[1] == (320, 240)
+        assert hamming_distance(value, image_hash(encode_png(larger), method)[0]) <= 4
+        assert hamming_distance(value, image_hash(encode_png(brighter), method)[0]) <= 4
+        assert hamming_distance(value, image_hash(encode_png(make_photo(1)), method)[0]) > 16
+
+    index = HashIndex(max_distance=4)
+    first = HashEntry("a.png", (160, 120))
+    assert index.find_or_add(0b1011 << 40, first) is None
+    assert index.find_or_add(0b0011 << 40 | 0b111, HashEntry("b.png", (160, 120))) is first
+    assert index.find_or_add(~(0b1011 << 40) & (2 ** 64 - 1), HashEntry("c.png", (160, 120))) is None
+    assert index.size == 2
+    print("✓ Near-duplicates are found within the distance")
+
+
+def test_resolve_holds_duplicates():
+    """A near-duplicate finishing first waits for the photo it copies"""
+    print("Testing near-duplicate hold and release...")
+    pipeline = ScanPipeline(backend=BoxBackend(), dedup=True)
+    entry = HashEntry("a.png", (100, 100))
+
+    duplicate = ScanItem(None, "b.png")
+    duplicate.size = (200, 200)
+    duplicate.duplicate_of = entry
+    assert pipeline._resolve(duplicate) == []
+
+    original = ScanItem(None, "a.png")
+    original.hash_entry = entry
+    original.face_locations = [(10, 60, 60, 10)]
+    original.face_encodings = [np.zeros(128)]
+    assert pipeline._resolve(original) == [original, duplicate]
+    assert duplicate.face_locations == [(20, 120, 120, 20)], duplicate.face_locations
+    assert len(duplicate.face_encodings) == 1
+    assert pipeline.skipped_detections == 1
+
+    # Later duplicates of a finished photo don't wait at all
+    late = ScanItem(None, "c.png")
+    late.size = (100, 100)
+    late.duplicate_of = entry
+    assert pipeline._resolve(late) == [late]
+    assert late.face_locations == [(10, 60, 60, 10)]
+
+    # Duplicates of a photo that failed fail too
+    failed_entry = HashEntry("d.png", (100, 100))
+    waiting = ScanItem(None, "e.png")
+    waiting.duplicate_of = failed_entry
+    assert pipeline._resolve(waiting) == []
+    failed = ScanItem(None, "d.png")
+    failed.hash_entry = failed_entry
+    failed.error = RuntimeError("unreadable")
+    assert pipeline._resolve(failed) == [failed, waiting]
+    assert waiting.error is not None and not waiting.face_encodings
+    assert not pipeline._waiting
+    print("✓ Near-duplicates are held until their photo is done")
+
+
+def test_run_with_dedup():
+    """A scan detects once per distinct photo and skips files that aren't images"""
+    print("Testing a pipeline run...")
+    with tempfile.TemporaryDirectory() as directory:
+        photo = make_photo(0)
+        cv2.imwrite(os.path.join(directory, "a.png"), photo)
+        cv2.imwrite(os.path.join(directory, "b.png"), cv2.resize(photo, (320, 240)))
+        cv2.imwrite(os.path.join(directory, "c.png"), make_photo(1))
+        with open(os.path.join(directory, "notes.jpg"), "wb") as f:
+            f.write(b"not a photo")
+
+        backend = BoxBackend()
+        pipeline = ScanPipeline(backend=backend, dedup=True, parallel=False,
+                                memory_budget_mb=1, read_ahead_mb=1)
+        names = ["a.png", "b.png", "c.png", "notes.jpg"]
+        items = [ScanItem(os.path.join(directory, name), name) for name in names]
+        results = {}
+        pipeline.run(items, lambda item: results.update({item.rel_path: item}))
+
+        assert sorted(results) == names, sorted(results)
+        assert pipeline.committed == 4 and pipeline.errors == 0
+        assert backend.detections == 2, backend.detections
+        assert pipeline.skipped_detections == 1
+        assert results["a.png"].face_locations == [(30, 120, 90, 40)]
+        assert results["b.png"].face_locations == [(60, 240, 180, 80)]
+        assert len(results["b.png"].face_encodings) == 1
+        assert results["notes.jpg"].face_count == 0
+
+        # Everything read or decoded was given back
+        assert pipeline.memory.in_use == 0 and pipeline.read_ahead.in_use == 0
+    print("✓ Pipeline runs detect each distinct photo once")
+
+
+def main():
+    print("Scan Pipeline Test")
+    print("==================\n")
+
+    tests = [test_hash_distance, test_resolve_holds_duplicates, test_run_with_dedup]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            print(f"✗ {test.__doc__} failed: {e}")
+            failed += 1
+
+    if failed:
+        print(f"\n❌ {failed} of {len(tests)} tests failed.")
+        return False
+    print("\n✅ All tests passed!")
+    return True
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
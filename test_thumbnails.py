@@ -0,0 +1,80 @@
+"""
+Test script for gallery thumbnails.
+Checks that thumbnails are made once per photo version and that pruning
+removes those of changed and removed photos, using a temporary photo directory.
+"""
+import os
+import sys
+import tempfile
+
+import cv2
+import numpy as np
+
+from photo_sources import PhotoReader
+from thumbnails import ThumbnailStore
+
+
+def thumbnail_files(thumbs_dir):
+    return sorted(name for _, _, names in os.walk(thumbs_dir) for name in names)
+
+
+def test_prune_outdated():
+    """Pruning keeps the current thumbnails and removes the rest"""
+    print("Testing thumbnail pruning...")
+    with tempfile.TemporaryDirectory() as directory:
+        photos_dir = os.path.join(directory, "photos")
+        thumbs_dir = os.path.join(directory, "thumbs")
+        os.makedirs(photos_dir)
+        for name in ("a.jpg", "b.jpg"):
+            cv2.imwrite(os.path.join(photos_dir, name), np.full((300, 400, 3), 128, dtype=np.uint8))
+
+        reader = PhotoReader(photos_dir)
+        store = ThumbnailStore(thumbs_dir, reader, sizes=(64, 128))
+        try:
+            keys, stats = store.ensure(["a.jpg", "b.jpg"])
+            assert stats == {'created': 2, 'existing': 0, 'errors': 0}, stats
+            assert store.prune(keys.values()) == 0
+            assert len(thumbnail_files(thumbs_dir)) == 4
+
+            # a.jpg changes: its thumbnails are made again under a new key
+            cv2.imwrite(os.path.join(photos_dir, "a.jpg"), np.zeros((200, 200, 3), dtype=np.uint8))
+            os.utime(os.path.join(photos_dir, "a.jpg"), ns=(0, 10 ** 9))
+            keys, stats = store.ensure(["a.jpg", "b.jpg"])
+            assert stats == {'created': 1, 'existing': 1, 'errors': 0}, stats
+            assert store.prune(keys.values()) == 2
+            current = sorted(f"{key}_{size}.jpg" for key in keys.values() for size in (64, 128))
+            assert thumbnail_files(thumbs_dir) == current
+
+            # b.jpg leaves the gallery
+            keys, _ = store.ensure(["a.jpg"])
+            assert store.prune(keys.values()) == 2
+            assert len(thumbnail_files(thumbs_dir)) == 2
+            assert len(os.listdir(thumbs_dir)) == 1
+        finally:
+            reader.close()
+    print("✓ Outdated thumbnails are pruned")
+
+
+def main():
+    print("Thumbnails Test")
+    print("===============\n")
+
+    tests = [test_prune_outdated]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            print(f"✗ {test.__doc__} failed: {e}")
+            failed += 1
+
+    if failed:
+        print(f"\n❌ {failed} of {len(tests)} tests failed.")
+        return False
+    print("\n✅ All tests passed!")
+    return True
+
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
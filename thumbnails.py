@@ -0,0 +1,185 @@
+"""
+Thumbnail pyramid for Face Recognition File Explorer galleries
+
+Every photo gets a small set of JPEG thumbnails, stored once under a shared
+directory no matter how many people appear in it. Thumbnail names include
+the source file's size and modification time, so generation is incremental:
+photos that haven't changed keep their existing thumbnails, and prune()
+removes those of photos that changed or left the gallery.
+"""
+
+import concurrent.futures
+import hashlib
+import io
+import os
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+from photo_sources import split_archive_path
+
+# Longest side in pixels of each thumbnail level, smallest first
+THUMBNAIL_SIZES = (240, 1024)
+
+THUMBNAIL_DIR = '.thumbs'
+
+
+class ThumbnailStore:
+    """Creates and locates the thumbnails of photos"""
+
+    def __init__(self, thumbs_dir, reader, sizes=THUMBNAIL_SIZES, quality=80):
+        """
+        Args:
+            thumbs_dir (Path): Directory thumbnails are stored in
+            reader (PhotoReader): Reads photos, including archive members
+            sizes (tuple): Longest side of each thumbnail level
+            quality (int): JPEG quality of the thumbnails
+        """
+        self.thumbs_dir = Path(thumbs_dir)
+        self.reader = reader
+        self.sizes = tuple(sorted(sizes))
+        self.quality = quality
+
+    def key(self, photo_path):
+        """Thumbnail name shared by every level, changes when the source does"""
+        archive, _ = split_archive_path(photo_path)
+        stat = os.stat(self.reader.photos_dir / archive)
+        signature = f"{photo_path}|{stat.st_size}|{stat.st_mtime_ns}"
+        return hashlib.sha1(signature.encode('utf-8')).hexdigest()[:20]
+
+    def paths(self, photo_path, key=None):
+        """
+        Where the thumbnails of a photo live
+
+        Args:
+            photo_path (str): Photo key
+            key (str, optional): Thumbnail key, if already known
+
+        Returns:
+            dict: size -> Path of the thumbnail
+        """
+        key = key or self.key(photo_path)
+        # Two-character subfolders keep directories small on huge libraries
+        folder = self.thumbs_dir / key[:2]
+        return {size: folder / f"{key}_{size}.jpg" for size in self.sizes}
+
+    def render(self, photo_path, sizes=None):
+        """
+        Decode a photo once and produce JPEG thumbnails for several sizes
+
+        Args:
+            photo_path (str): Photo key
+            sizes (iterable, optional): Sizes to produce (default: all levels)
+
+        Returns:
+            dict: size -> JPEG bytes
+        """
+        sizes = sorted(sizes or self.sizes, reverse=True)
+        results = {}
+        with self.reader.open(photo_path) as f, Image.open(f) as image:
+            # JPEGs can be decoded at a fraction of their size directly
+            image.draft('RGB', (sizes[0], sizes[0]))
+            image = ImageOps.exif_transpose(image).convert('RGB')
+            # Work from the largest level down, so each one resizes the last
+            for size in sizes:
+                image.thumbnail((size, size), Image.LANCZOS)
+                buffer = io.BytesIO()
+                image.save(buffer, 'JPEG', quality=self.quality, optimize=True)
+                results[size] = buffer.getvalue()
+        return results
+
+    def _create(self, photo_path, paths):
+        missing = {size: path for size, path in paths.items() if not path.exists()}
+        if not missing:
+            return False
+        rendered = self.render(photo_path, missing)
+        for size, path in missing.items():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(path.name + '.tmp')
+            with open(tmp_path, 'wb') as f:
+                f.write(rendered[size])
+            os.replace(tmp_path, path)
+        return True
+
+    def ensure(self, photo_paths, max_workers=None, cancel_event=None, progress=None):
+        """
+        Create any missing thumbnails in parallel
+
+        Args:
+            photo_paths (iterable): Photo keys
+            max_workers (int, optional): Threads decoding photos
+            cancel_event (threading.Event, optional): Stop creating thumbnails
+                once set
+            progress (callable, optional): Called as progress(done, total)
+
+        Returns:
+            tuple: (dict photo key -> thumbnail key, dict of counts
+            'created', 'existing' and 'errors')
+        """
+        stats = {'created': 0, 'existing': 0, 'errors': 0}
+        located = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {}
+            for photo_path in photo_paths:
+                if photo_path in located:
+                    continue
+                try:
+                    key = self.key(photo_path)
+                except OSError:
+                    stats['errors'] += 1
+                    continue
+                located[photo_path] = key
+                paths = self.paths(photo_path, key)
+                futures[executor.submit(self._create, photo_path, paths)] = photo_path
+
+            for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                if cancel_event is not None and cancel_event.is_set():
+                    for pending in futures:
+                        pending.cancel()
+                photo_path = futures[future]
+                if future.cancelled():
+                    del located[photo_path]
+                    continue
+                if progress is not None:
+                    progress(done, len(futures))
+                try:
+                    created = future.result()
+                except Exception as e:
+                    print(f"  Error creating thumbnails for {photo_path}: {e}")
+                    stats['errors'] += 1
+                    del located[photo_path]
+                    continue
+                stats['created' if created else 'existing'] += 1
+        return located, stats
+
+    def prune(self, keys):
+        """
+        Remove every thumbnail except those of the given keys
+
+        Thumbnails of a photo that changed are left under its old key, and
+        those of a removed photo under a key nobody asks for any more.
+
+        Args:
+            keys (iterable): Thumbnail keys still in use, as returned by ensure()
+
+        Returns:
+            int: Number of files removed
+        """
+        keep = {f"{key}_{size}.jpg" for key in keys for size in self.sizes}
+        if not self.thumbs_dir.is_dir():
+            return 0
+        removed = 0
+        for folder in self.thumbs_dir.iterdir():
+            if not folder.is_dir():
+                continue
+            for path in folder.iterdir():
+                if path.name in keep:
+                    continue
+                try:
+                    path.unlink()
+                    removed += 1
+                except OSError:
+                    pass
+            if not any(folder.iterdir()):
+                folder.rmdir()
+        return removed
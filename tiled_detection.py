@@ -0,0 +1,276 @@
+"""
+Tiled face detection for Face Recognition File Explorer
+
+Panoramas and scanned group photos can run past 100 megapixels. Decoding one
+whole takes hundreds of MB, detecting faces in it takes minutes, and
+shrinking it first loses the small faces. Images above a size threshold are
+handled a region at a time instead:
+
+- The image is cut into overlapping tiles, each decoded on its own and
+  searched for faces in parallel
+- A downscaled overview of the whole image is searched too, for faces too
+  big to fit in the overlap between tiles
+- Faces found more than once, where tiles overlap, are merged with
+  non-maximum suppression
+- Each face is encoded from a crop around it
+
+With the optional pyvips package, regions are decoded straight from the
+file and large decoded images spill to a temporary file, so memory per image
+stays bounded whatever its resolution. Without it, the image is decoded
+once with PIL and tiles are cut from that copy: detection is still tiled,
+but the whole image is held in memory.
+"""
+
+import contextlib
+import io
+
+import numpy as np
+from PIL import Image
+
+try:
+    import pyvips
+except (ImportError, OSError):
+    # OSError: the package is installed but libvips itself is missing
+    pyvips = None
+
+# Images with more pixels than this are detected in tiles
+TILE_THRESHOLD_MP = 40
+
+# Side of a detection tile, and how far neighbouring tiles overlap; a face
+# smaller than the overlap is always whole in at least one tile
+TILE_SIZE = 2048
+TILE_OVERLAP = 256
+
+# Longest side of the overview searched for faces bigger than the overlap
+OVERVIEW_SIZE = 1600
+
+# Two boxes overlapping by more than this (intersection over union, or over
+# the smaller box for a face cut off at a tile's edge) are the same face
+NMS_IOU = 0.3
+NMS_CONTAINMENT = 0.7
+
+# Room around a face, as a fraction of its size, in the crop it's encoded from
+CROP_MARGIN = 0.5
+
+
+def region_decoding_available():
+    """Whether regions are decoded without decoding the whole image"""
+    return pyvips is not None
+
+
+def plan_tiles(width, height, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    """
+    Overlapping tiles covering an image
+
+    Returns:
+        list: (left, top, right, bottom) boxes in image pixels
+    """
+    step = max(1, tile_size - overlap)
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size, step))
+        positions.append(length - tile_size)
+        return positions
+
+    return [(left, top, min(width, left + tile_size), min(height, top + tile_size))
+            for top in starts(height) for left in starts(width)]
+
+
+def tile_memory(tile_size=TILE_SIZE, workers=1):
+    """Bytes of decoded pixels held at once while detecting in tiles"""
+    return (workers * tile_size * tile_size + OVERVIEW_SIZE * OVERVIEW_SIZE) * 3
+
+
+class RegionReader:
+    """Decodes rectangular regions of one encoded image"""
+
+    def __init__(self, data):
+        """
+        Args:
+            data (bytes): The encoded image
+        """
+        self.data = data
+        self._image = None
+        if pyvips is not None:
+            # Random access: tiles are read in any order, by several threads
+            self._vips = pyvips.Image.new_from_buffer(data, '', access='random')
+            self.size = (self._vips.width, self._vips.height)
+        else:
+            self._vips = None
+            with Image.open(io.BytesIO(data)) as probe:
+                self.size = probe.size
+
+    @property
+    def streaming(self):
+        """True if regions are decoded on their own, False if the whole image is"""
+        return self._vips is not None
+
+    @staticmethod
+    def _vips_rgb(image):
+        if image.hasalpha():
+            image = image.flatten()
+        if image.interpretation != 'srgb':
+            image = image.colourspace('srgb')
+        if image.format != 'uchar':
+            image = image.cast('uchar')
+        return np.ndarray(buffer=image.write_to_memory(), dtype=np.uint8,
+                          shape=(image.height, image.width, 3))
+
+    def _full_image(self):
+        if self._image is None:
+            with Image.open(io.BytesIO(self.data)) as image:
+                self._image = np.asarray(image.convert('RGB'))
+        return self._image
+
+    def region(self, box):
+        """
+        Decode one region
+
+        Args:
+            box (tuple): (left, top, right, bottom) in image pixels
+
+        Returns:
+            ndarray: RGB pixels of the region
+        """
+        left, top, right, bottom = box
+        if self._vips is not None:
+            return self._vips_rgb(self._vips.crop(left, top, right - left, bottom - top))
+        return np.ascontiguousarray(self._full_image()[top:bottom, left:right])
+
+    def overview(self, max_side=OVERVIEW_SIZE):
+        """
+        The whole image shrunk to fit max_side, decoded at reduced size where possible
+
+        Returns:
+            tuple: (RGB ndarray, scale from overview to image pixels)
+        """
+        scale = max(self.size) / max_side
+        if scale <= 1:
+            return self.region((0, 0) + self.size), 1.0
+        if self._vips is not None:
+            image = self._vips_rgb(pyvips.Image.thumbnail_buffer(self.data, max_side))
+        elif self._image is not None:
+            with Image.fromarray(self._image) as full:
+                image = np.asarray(full.reduce(int(scale)))
+        else:
+            with Image.open(io.BytesIO(self.data)) as full:
+                full.draft('RGB', (int(full.size[0] / scale), int(full.size[1] / scale)))
+                full = full.convert('RGB')
+                full.thumbnail((max_side, max_side))
+                image = np.asarray(full)
+        return image, self.size[0] / image.shape[1]
+
+    def face_crop(self, face_location, margin=CROP_MARGIN):
+        """
+        A crop around one face, big enough to encode it from
+
+        Returns:
+            tuple: (RGB ndarray, the face's location inside the crop)
+        """
+        top, right, bottom, left = face_location
+        pad = int(max(bottom - top, right - left) * margin)
+        width, height = self.size
+        box = (max(0, left - pad), max(0, top - pad), min(width, right + pad), min(height, bottom + pad))
+        x0, y0 = box[0], box[1]
+        return self.region(box), (top - y0, right - x0, bottom - y0, left - x0)
+
+    def close(self):
+        self._image = None
+        self._vips = None
+        self.data = None
+
+
+def _edge_distance(face_location, tile, size):
+    """How far a face is from the nearest tile edge that isn't the image's edge, relative to its size"""
+    top, right, bottom, left = face_location
+    tile_left, tile_top, tile_right, tile_bottom = tile
+    width, height = size
+    distances = []
+    if tile_left > 0:
+        distances.append(left - tile_left)
+    if tile_top > 0:
+        distances.append(top - tile_top)
+    if tile_right < width:
+        distances.append(tile_right - right)
+    if tile_bottom < height:
+        distances.append(tile_bottom - bottom)
+    if not distances:
+        return 1.0
+    return min(1.0, max(0, min(distances)) / max(1, bottom - top))
+
+
+def _overlap(a, b):
+    """(intersection over union, intersection over the smaller box) of two face boxes"""
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    if bottom <= top or right <= left:
+        return 0.0, 0.0
+    intersection = (bottom - top) * (right - left)
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    return intersection / (area_a + area_b - intersection), intersection / min(area_a, area_b)
+
+
+def merge_detections(detections, iou=NMS_IOU, containment=NMS_CONTAINMENT):
+    """
+    Non-maximum suppression over faces found in overlapping tiles
+
+    Args:
+        detections (list): (score, face_location) pairs; of two boxes for
+            the same face, the higher score is kept
+
+    Returns:
+        list: Face locations, top to bottom and left to right
+    """
+    kept = []
+    for score, face_location in sorted(detections, key=lambda detection: -detection[0]):
+        overlaps = [_overlap(face_location, other) for other in kept]
+        if all(union <= iou and smaller <= containment for union, smaller in overlaps):
+            kept.append(face_location)
+    return sorted(kept, key=lambda face_location: (face_location[0], face_location[3]))
+
+
+def detect_faces_tiled(reader, backend, executor=None, tile_size=TILE_SIZE,
+                       overlap=TILE_OVERLAP, compute=contextlib.nullcontext):
+    """
+    Find faces in a large image one tile at a time
+
+    Args:
+        reader (RegionReader): The image
+        backend (FaceBackend): Detects the faces in each tile
+        executor (Executor, optional): Runs tiles in parallel
+        tile_size (int): Side of a tile in pixels
+        overlap (int): Pixels shared by neighbouring tiles
+        compute (callable): Returns a context held while detecting in a tile
+
+    Returns:
+        list: (top, right, bottom, left) face locations in image pixels
+    """
+    def detect_tile(tile):
+        pixels = reader.region(tile)
+        with compute():
+            found = backend.detect(pixels)
+        left, top = tile[0], tile[1]
+        return [(_edge_distance((t + top, r + left, b + top, l + left), tile, reader.size),
+                 (t + top, r + left, b + top, l + left))
+                for t, r, b, l in found]
+
+    def detect_overview():
+        pixels, scale = reader.overview()
+        with compute():
+            found = backend.detect(pixels)
+        # Coarser than the tiles' boxes, so they win where both found a face
+        return [(0.0, tuple(int(round(v * scale)) for v in face_location)) for face_location in found]
+
+    tiles = plan_tiles(*reader.size, tile_size=tile_size, overlap=overlap)
+    detections = []
+    if executor is None:
+        for tile in tiles:
+            detections.extend(detect_tile(tile))
+    else:
+        for found in executor.map(detect_tile, tiles):
+            detections.extend(found)
+    detections.extend(detect_overview())
+    return merge_detections(detections)
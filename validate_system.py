@@ -45,13 +45,14 @@ def test_dependency(module_name, minimum_version=None):
         return False
 
 def test_face_detection():
-    """Test basic face detection functionality"""
+    """Test basic face detection functionality of every backend that can be loaded"""
     print_header("Testing Face Detection")
     
     try:
         import face_recognition
         import numpy as np
         from PIL import Image
+        from face_backends import DlibBackend, OpenCVBackend
         
         # Create a simple test image with a "face" (just a circle)
         img_size = (200, 200, 3)
@@ -70,17 +71,31 @@ def test_face_detection():
         test_img_path = os.path.join(temp_dir, "test_face.jpg")
         Image.fromarray(img).save(test_img_path)
         
-        # Try to detect faces
-        test_image = face_recognition.load_image_file(test_img_path)
-        face_locations = face_recognition.face_locations(test_image)
+        # The OpenCV backend is optional: it needs its model files
+        backends = [DlibBackend()]
+        try:
+            backends.append(OpenCVBackend())
+        except FileNotFoundError as e:
+            print(f"Skipping the OpenCV backend: {e}")
         
-        # This simple "face" won't actually be detected, but we're just testing if
-        # the function runs without errors
-        print_result("Face detection functions without errors", True)
+        # Try to detect and encode faces
+        test_image = face_recognition.load_image_file(test_img_path)
+        success = True
+        for backend in backends:
+            try:
+                face_locations = backend.detect(test_image)
+                backend.encode(test_image, face_locations)
+                # This simple "face" won't actually be detected, but we're just testing if
+                # the functions run without errors
+                print_result(f"Face detection with {backend.describe()} functions without errors", True)
+            except Exception as e:
+                print(f"Error during face detection with {backend.describe()}: {str(e)}")
+                print_result(f"Face detection with {backend.describe()} functions without errors", False)
+                success = False
         
         # Clean up
         shutil.rmtree(temp_dir)
-        return True
+        return success
     
     except Exception as e:
         print(f"Error during face detection test: {str(e)}")
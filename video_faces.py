@@ -0,0 +1,247 @@
+"""
+Faces in videos for Face Recognition File Explorer
+
+A phone video holds thousands of frames, nearly all of them showing the same
+faces as the frame before. Rather than treating frames as photos:
+
+- Frames are probed a few times a second on a tiny grayscale copy, and
+  faces are only searched for when the scene changes, while faces are being
+  followed, or after a few quiet seconds
+- Faces found in successive searches are joined into tracks by how much
+  their boxes overlap
+- Each track is encoded a few times, spread over its length, and stored as
+  one face: the mean of its encodings, shown by the frame where the face is
+  biggest, with the times it appears and disappears
+"""
+
+import contextlib
+
+import cv2
+import numpy as np
+
+from face_backends import DlibBackend
+
+# Seconds between frames compared for scene changes
+PROBE_INTERVAL = 0.25
+
+# Longest gap in seconds between face searches while faces are being
+# followed, and while there are none
+TRACK_INTERVAL = 0.5
+IDLE_INTERVAL = 2.0
+
+# Mean difference of the 64x36 grayscale probes (0-255) that counts as a cut
+SCENE_CHANGE = 30.0
+
+# Boxes in successive searches overlapping at least this much (intersection
+# over union) belong to the same track
+TRACK_IOU = 0.3
+
+# Seconds a track survives without being found again
+TRACK_GAP = 1.5
+
+# Encodings computed per track, at least this many seconds apart
+ENCODINGS_PER_TRACK = 3
+ENCODING_SPACING = 1.0
+
+# A new encoding this far from the track's mean means the boxes swapped
+# people, so the track is split
+SPLIT_DISTANCE = 0.6
+
+# Longest side frames are shrunk to for face detection
+DETECT_SIZE = 960
+
+_PROBE_SIZE = (64, 36)
+
+
+class FaceTrack:
+    """One face followed through a video"""
+
+    __slots__ = ('start', 'end', 'location', 'frame_time', 'frame_location', 'encodings', 'encoded_at')
+
+    def __init__(self, time, face_location):
+        self.start = time
+        self.end = time
+        self.location = face_location           # box in the latest search
+        self.frame_time = time                  # time of the frame where the face is biggest
+        self.frame_location = face_location     # the face's box in that frame
+        self.encodings = []
+        self.encoded_at = None
+
+    @property
+    def area(self):
+        top, right, bottom, left = self.frame_location
+        return (bottom - top) * (right - left)
+
+    def encoding(self):
+        """Mean of the track's encodings"""
+        return np.mean(self.encodings, axis=0)
+
+
+def _iou(a, b):
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    if bottom <= top or right <= left:
+        return 0.0
+    intersection = (bottom - top) * (right - left)
+    union = (a[2] - a[0]) * (a[1] - a[3]) + (b[2] - b[0]) * (b[1] - b[3]) - intersection
+    return intersection / union
+
+
+class VideoFaceTracker:
+    """Samples frames of a video and joins the faces found into tracks"""
+
+    def __init__(self, backend=None, encodings_per_track=ENCODINGS_PER_TRACK,
+                 compute=contextlib.nullcontext, cancel_event=None):
+        """
+        Args:
+            backend (FaceBackend, optional): Detects and encodes faces
+                (default: dlib with HOG)
+            encodings_per_track (int): Most encodings computed per track
+            compute (callable): Returns a context held while detecting or
+                encoding
+            cancel_event (threading.Event, optional): Stops reading the
+                video once set; track() then returns None
+        """
+        self.backend = backend if backend is not None else DlibBackend()
+        self.encodings_per_track = encodings_per_track
+        self.compute = compute
+        self.cancel_event = cancel_event
+
+    def _detect(self, rgb):
+        scale = max(rgb.shape[:2]) / DETECT_SIZE
+        if scale > 1:
+            small = cv2.resize(rgb, (int(rgb.shape[1] / scale), int(rgb.shape[0] / scale)),
+                               interpolation=cv2.INTER_AREA)
+        else:
+            small, scale = rgb, 1.0
+        with self.compute():
+            found = self.backend.detect(small)
+        return [tuple(int(round(v * scale)) for v in face_location) for face_location in found]
+
+    def _encode(self, rgb, face_location):
+        with self.compute():
+            encodings = self.backend.encode(rgb, [face_location])
+        return encodings[0] if encodings else None
+
+    def _wants_encoding(self, track, time):
+        return (len(track.encodings) < self.encodings_per_track
+                and (track.encoded_at is None or time - track.encoded_at >= ENCODING_SPACING))
+
+    def _new_track(self, rgb, time, face_location, encoding=None):
+        track = FaceTrack(time, face_location)
+        if encoding is None:
+            encoding = self._encode(rgb, face_location)
+        if encoding is not None:
+            track.encodings.append(encoding)
+            track.encoded_at = time
+        return track
+
+    def _update(self, active, finished, rgb, time):
+        """Match one search's faces to the active tracks"""
+        detections = self._detect(rgb)
+        pairs = sorted(((_iou(track.location, face_location), t, d)
+                        for t, track in enumerate(active) for d, face_location in enumerate(detections)),
+                       reverse=True)
+        matched_tracks, matched_detections = set(), set()
+        still_active = []
+        for overlap, t, d in pairs:
+            if overlap < TRACK_IOU:
+                break
+            if t in matched_tracks or d in matched_detections:
+                continue
+            matched_tracks.add(t)
+            matched_detections.add(d)
+            track, face_location = active[t], detections[d]
+
+            if self._wants_encoding(track, time):
+                encoding = self._encode(rgb, face_location)
+                if encoding is not None and track.encodings and \
+                        np.linalg.norm(track.encoding() - encoding) > SPLIT_DISTANCE:
+                    # Someone else walked into the box: end the track here
+                    finished.append(track)
+                    still_active.append(self._new_track(rgb, time, face_location, encoding))
+                    continue
+                if encoding is not None:
+                    track.encodings.append(encoding)
+                    track.encoded_at = time
+
+            track.end = time
+            track.location = face_location
+            top, right, bottom, left = face_location
+            if (bottom - top) * (right - left) > track.area:
+                track.frame_time, track.frame_location = time, face_location
+            still_active.append(track)
+
+        for t, track in enumerate(active):
+            if t in matched_tracks:
+                continue
+            if time - track.end > TRACK_GAP:
+                finished.append(track)
+            else:
+                still_active.append(track)
+        for d, face_location in enumerate(detections):
+            if d not in matched_detections:
+                still_active.append(self._new_track(rgb, time, face_location))
+        return still_active
+
+    def track(self, video_path):
+        """
+        Find and follow the faces in a video
+
+        Args:
+            video_path (Path): The video file
+
+        Returns:
+            tuple: (list of FaceTrack with at least one encoding, dict of
+            'frames', 'searches' and 'encodings' counts), or None if
+            cancelled
+        """
+        capture = cv2.VideoCapture(str(video_path))
+        if not capture.isOpened():
+            raise OSError(f"Can't open video {video_path}")
+        fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+        probe_every = max(1, int(round(fps * PROBE_INTERVAL)))
+
+        active, finished = [], []
+        stats = {'frames': 0, 'searches': 0}
+        previous_probe = None
+        searched_at = None
+        try:
+            index = -1
+            # grab() skips the colour conversion and copy of frames nobody looks at
+            while capture.grab():
+                index += 1
+                if index % probe_every:
+                    continue
+                if self.cancel_event is not None and self.cancel_event.is_set():
+                    return None
+                ok, frame = capture.retrieve()
+                if not ok:
+                    break
+                msec = capture.get(cv2.CAP_PROP_POS_MSEC)
+                time = msec / 1000 if msec > 0 else index / fps
+
+                probe = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), _PROBE_SIZE,
+                                   interpolation=cv2.INTER_AREA).astype(np.int16)
+                cut = previous_probe is not None and np.abs(probe - previous_probe).mean() > SCENE_CHANGE
+                previous_probe = probe
+
+                interval = TRACK_INTERVAL if active else IDLE_INTERVAL
+                if not (cut or searched_at is None or time - searched_at >= interval):
+                    continue
+                if cut:
+                    # Nothing carries over a cut
+                    finished.extend(active)
+                    active = []
+                searched_at = time
+                stats['searches'] += 1
+                rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                active = self._update(active, finished, rgb, time)
+            stats['frames'] = index + 1
+        finally:
+            capture.release()
+
+        finished.extend(active)
+        tracks = sorted((track for track in finished if track.encodings), key=lambda track: track.start)
+        stats['encodings'] = sum(len(track.encodings) for track in finished)
+        return tracks, stats